@@ -0,0 +1,345 @@
+import random
+from itertools import count
+
+import numpy as np
+
+from clock import SimulationClock
+from collision import CollisionWorld
+from collision import particle_arrays
+from enemy import EnemyManager
+from food import FoodField
+from projectile import OWNER_ENEMY
+from projectile import OWNER_SNAKE
+from projectile import ProjectileManager
+from projectile import kill_score
+from snake import Snake
+from snapshot import VersionedRandom
+from stats import GameStats
+from utils import world_bounds
+
+# Snakes spawn at least SPAWN_MARGIN inside the walls, at the first of
+# SPAWN_ATTEMPTS random points that is SPAWN_CLEARANCE away from every living
+# snake (or the roomiest one tried)
+SPAWN_ATTEMPTS = 16
+SPAWN_CLEARANCE = 1.0
+SPAWN_MARGIN = 1.0
+
+
+class Player:
+    def __init__(self, player_id, snake, stats):
+        self.id = player_id
+        self.snake = snake
+        self.stats = stats
+        self.inputs = []  # Actions queued for the next tick
+
+    @property
+    def alive(self):
+        return not self.snake.deadFlag
+
+
+class Arena:
+    # Several snakes in one world, sharing its food, enemy ships and
+    # projectiles. Each snake plays by the rules of Game, and also dies when
+    # its head touches another snake. Ships hunt the highest scoring snake but
+    # ram any of them; players score for their own shots and rams.
+    def __init__(
+        self,
+        screen_leftx=-5,
+        screen_rightx=5,
+        screen_topy=-5,
+        screen_bottomy=5,
+        seed=None,
+        clock=None,
+        max_players=64,
+        initial_length=3,
+        food_count=1,
+        world_size=None,
+    ):
+        # A world_size replaces the screen bounds, as in Game
+        if world_size is not None:
+            screen_leftx, screen_rightx, screen_topy, screen_bottomy = world_bounds(
+                world_size
+            )
+        self.seed = random.randrange(1 << 63) if seed is None else seed
+        self.rng = VersionedRandom(self.seed)
+        self.clock = SimulationClock() if clock is None else clock
+        self.max_players = max_players
+        self.initial_length = initial_length
+        self.leftx = screen_leftx
+        self.rightx = screen_rightx
+        self.topy = screen_topy
+        self.bottomy = screen_bottomy
+        # The shared managers need stats of their own; players are scored
+        # into their own GameStats
+        self.stats = GameStats()
+        self.players = {}
+        self.player_ids = count(1)
+        self.collision_world = CollisionWorld()
+        # Player and segment of each body in the "snakes" collision layer
+        self.body_player = np.zeros(0, dtype=np.intp)
+        self.body_segment = np.zeros(0, dtype=np.intp)
+        self.projectile_manager = ProjectileManager(
+            screen_leftx=self.leftx,
+            screen_rightx=self.rightx,
+            screen_topy=self.topy,
+            screen_bottomy=self.bottomy,
+            stats=self.stats,
+        )
+        self.food = FoodField(
+            screen_leftx=self.leftx,
+            screen_rightx=self.rightx,
+            screen_topy=self.topy,
+            screen_bottomy=self.bottomy,
+            count=food_count,
+            rng=self.rng,
+        )
+        self.food.refill()
+        self.enemy_manager = EnemyManager(
+            screen_leftx=self.leftx,
+            screen_rightx=self.rightx,
+            screen_topy=self.topy,
+            screen_bottomy=self.bottomy,
+            projectile_manager=self.projectile_manager,
+            stats=self.stats,
+            clock=self.clock,
+            rng=self.rng,
+        )
+
+    @property
+    def tick(self):
+        return self.clock.tick
+
+    def living(self):
+        return [player for player in self.players.values() if player.alive]
+
+    def join(self):
+        if len(self.players) >= self.max_players:
+            raise RuntimeError("Arena is full")
+        player_id = next(self.player_ids)
+        stats = GameStats()
+        stats.start_timer(self.clock)
+        player = Player(player_id, self.spawn_snake(player_id), stats)
+        self.players[player_id] = player
+        return player
+
+    def leave(self, player_id):
+        self.players.pop(player_id, None)
+
+    def queue_action(self, player_id, action):
+        # Actions are applied at the start of the next tick, in the order
+        # they were queued
+        player = self.players.get(player_id)
+        if player is not None:
+            player.inputs.append(action)
+
+    def apply_action(self, player, action):
+        # ("move", direction), ("shoot", game_x, game_y) or ("respawn",); only
+        # a dead snake can respawn, and only a living one moves and shoots
+        if action[0] == "respawn":
+            if not player.alive:
+                player.snake = self.spawn_snake(player.id)
+                player.stats.reset()
+                player.stats.start_timer(self.clock)
+        elif action[0] == "move":
+            if player.alive:
+                player.snake.move(action[1])
+        elif action[0] == "shoot":
+            if player.alive and player.snake.shoot(action[1], action[2]):
+                player.stats.record_shot()
+        else:
+            raise ValueError("Unknown action: " + str(action[0]))
+
+    def spawn_snake(self, player_id):
+        snake = Snake(
+            projectile_manager=self.projectile_manager,
+            initial_length=self.initial_length,
+            screen_leftx=self.leftx,
+            screen_rightx=self.rightx,
+            screen_topy=self.topy,
+            screen_bottomy=self.bottomy,
+            clock=self.clock,
+        )
+        snake.player_id = player_id
+
+        # Move the whole body so the head sits on the spawn point
+        x, y = self.spawn_point()
+        head = snake.getHead
+        delta_x = x - head.x
+        delta_y = y - head.y
+        for particle in snake.particles:
+            particle.x += delta_x
+            particle.y += delta_y
+            particle.px += delta_x
+            particle.py += delta_y
+        snake.physics.max_displacement = None
+        return snake
+
+    def spawn_point(self):
+        bodies = [particle_arrays(player.snake.particles) for player in self.living()]
+        if bodies:
+            xs = np.concatenate([body[0] for body in bodies])
+            ys = np.concatenate([body[1] for body in bodies])
+        best = None
+        best_gap = -1.0
+        for _ in range(SPAWN_ATTEMPTS):
+            x = self.rng.uniform(self.leftx + SPAWN_MARGIN, self.rightx - SPAWN_MARGIN)
+            y = self.rng.uniform(self.topy + SPAWN_MARGIN, self.bottomy - SPAWN_MARGIN)
+            if not bodies:
+                return x, y
+            gap = float(np.min((xs - x) ** 2 + (ys - y) ** 2)) ** 0.5
+            if gap > best_gap:
+                best = (x, y)
+                best_gap = gap
+            if gap >= SPAWN_CLEARANCE:
+                break
+        return best
+
+    def step(self):
+        # Queued inputs first, then the tick in the order of Game.update
+        for player in self.players.values():
+            inputs, player.inputs = player.inputs, []
+            for action in inputs:
+                self.apply_action(player, action)
+
+        self.clock.advance()
+
+        for player in self.living():
+            player.stats.update_time()
+            player.snake.update()
+
+        living = self.living()
+        self.index_snakes(living)
+        self.projectile_manager.update_projectiles()
+        self.update_enemies(living)
+        self.check_collisions(living)
+
+    def index_snakes(self, living):
+        # Every living snake in one "snakes" layer, remembering whose segment
+        # each body is
+        bodies = [particle_arrays(player.snake.particles) for player in living]
+        if not bodies:
+            self.collision_world.set_layer("snakes", [], [], [])
+            self.body_player = np.zeros(0, dtype=np.intp)
+            self.body_segment = np.zeros(0, dtype=np.intp)
+            return
+        lengths = np.array([len(body[0]) for body in bodies])
+        self.collision_world.set_layer(
+            "snakes",
+            np.concatenate([body[0] for body in bodies]),
+            np.concatenate([body[1] for body in bodies]),
+            np.concatenate([body[2] for body in bodies]),
+        )
+        self.body_player = np.repeat(np.arange(len(bodies)), lengths)
+        self.body_segment = np.arange(int(lengths.sum())) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+
+    def update_enemies(self, living):
+        # With nobody alive the ships hold still
+        if not living:
+            return
+        world = self.collision_world
+        target = max(living, key=lambda player: player.stats.score)
+        world.index_snake(target.snake)
+        self.enemy_manager.update(target.snake, world, target.stats)
+        for player in living:
+            if player is not target and player.alive:
+                world.index_snake(player.snake)
+                self.enemy_manager.check_collision(player.snake, world, player.stats)
+
+    def check_collisions(self, living):
+        world = self.collision_world
+
+        # Heads touching another snake's body, both ways for head-on crashes
+        if len(living) > 1:
+            heads = [player.snake.getHead for player in living]
+            query, body = world.overlap_pairs(
+                "snakes",
+                [head.x for head in heads],
+                [head.y for head in heads],
+                [head.r for head in heads],
+            )
+            crashed = query[self.body_player[body] != query]
+            for index in np.unique(crashed):
+                living[index].snake.deadFlag = True
+
+        # Food goes to the first snake that reaches it, and what was eaten
+        # respawns clear of every body
+        self.enemy_manager.index(world)
+        eaten = 0
+        for player in living:
+            if not player.alive:
+                continue
+            snake = player.snake
+            head = snake.getHead
+            grown = self.food.eat(head.x, head.y, head.r + snake.particle_radii)
+            for _ in range(grown):
+                snake.grow()
+            eaten += grown
+        if eaten:
+            self.food.refill(world.bodies("snakes", "enemies"))
+
+        self.check_projectiles(living)
+
+    def check_projectiles(self, living):
+        # ProjectileManager.check_collisions for many snakes: enemy shots hit
+        # whichever snake they touch first, player shots score for the player
+        # who fired them
+        world = self.collision_world
+        pool = self.projectile_manager.pool
+        n = pool.count
+        if n == 0:
+            return
+        x = pool.x[:n]
+        y = pool.y[:n]
+        size = pool.size[:n]
+        owner = pool.owner[:n]
+
+        removed = ~(
+            (self.leftx <= x)
+            & (x <= self.rightx)
+            & (self.topy <= y)
+            & (y <= self.bottomy)
+        )
+
+        shots = np.flatnonzero(~removed & (owner == OWNER_ENEMY))
+        if len(shots) and len(self.body_player):
+            first_body = world.sweeps(
+                "snakes",
+                pool.prev_x[shots],
+                pool.prev_y[shots],
+                x[shots],
+                y[shots],
+                size[shots],
+            )
+            for index, body in zip(shots, first_body):
+                if body < 0:
+                    continue
+                snake = living[self.body_player[body]].snake
+                if self.body_segment[body] < snake.getSize:
+                    snake.shrink(int(pool.damage[index]))
+                    removed[index] = True
+
+        shots = np.flatnonzero(~removed & (owner == OWNER_SNAKE))
+        enemies = world.layers.get("enemies")
+        if len(shots) and enemies is not None:
+            query, body = world.sweep_pairs(
+                "enemies",
+                pool.prev_x[shots],
+                pool.prev_y[shots],
+                x[shots],
+                y[shots],
+                size[shots],
+            )
+            for query_index, body_index in zip(query, body):
+                index = shots[query_index]
+                enemy = enemies.items[body_index]
+                if removed[index] or not self.enemy_manager.destroy_enemy(enemy):
+                    continue
+                # Shots outlive players who leave; their kills score nothing
+                shooter = self.players.get(int(pool.shooter[index]))
+                if shooter is not None:
+                    shooter.stats.record_kill(kill_score(shooter.snake.getSize))
+                removed[index] = True
+
+        pool.remove_many(removed)
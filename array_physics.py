@@ -0,0 +1,329 @@
+import numpy as np
+
+from snake import SnakePhysics
+from snake import solve_tridiagonal
+from utils import Particle
+
+
+class ParticleView:
+    # Particle-like handle onto one row of a ParticleArray, so existing callers
+    # can keep reading and writing particle.x, particle.px, ... as before
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def _field(name):
+        def getter(self):
+            return float(getattr(self.store, name)[self.index])
+
+        def setter(self, value):
+            getattr(self.store, name)[self.index] = value
+
+        return property(getter, setter)
+
+    x = _field("x")
+    y = _field("y")
+    px = _field("px")
+    py = _field("py")
+    vx = _field("vx")
+    vy = _field("vy")
+    r = _field("r")
+    inv_mass = _field("inv_mass")
+
+    del _field
+
+    def draw(self, viewport=None):
+        Particle.draw(self, viewport)
+
+
+class ParticleArray:
+    # Structure-of-arrays particle store. Every field lives in its own
+    # contiguous float64 array; only the first `count` rows are live.
+    fields = ("x", "y", "px", "py", "vx", "vy", "r", "inv_mass")
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.capacity = max(1, capacity)
+        for name in self.fields:
+            setattr(self, name, np.zeros(self.capacity, dtype=np.float64))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield ParticleView(self, index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ParticleView(self, i) for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("particle index out of range")
+        return ParticleView(self, index)
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(capacity, self.capacity * 2)
+        for name in self.fields:
+            array = np.zeros(new_capacity, dtype=np.float64)
+            array[: self.count] = getattr(self, name)[: self.count]
+            setattr(self, name, array)
+        self.capacity = new_capacity
+
+    def append(self, particle):
+        self.reserve(self.count + 1)
+        for name in self.fields:
+            getattr(self, name)[self.count] = getattr(particle, name)
+        self.count += 1
+
+    def pop(self):
+        if self.count == 0:
+            raise IndexError("pop from empty ParticleArray")
+        self.count -= 1
+        index = self.count
+        particle = Particle(float(self.x[index]), float(self.y[index]))
+        for name in self.fields:
+            setattr(particle, name, float(getattr(self, name)[index]))
+        return particle
+
+
+def expand_ranges(sources, starts, counts):
+    # Pair every source with each of the `count` consecutive entries beginning
+    # at its `start`, without a Python-level loop
+    total = int(counts.sum())
+    if total == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(sources, counts), np.repeat(starts, counts) + offsets
+
+
+def grid_candidate_pairs(x, y, cell_size):
+    # Vectorized uniform-grid broadphase. Particles are sorted by cell key and
+    # paired with later particles in their own cell and with every particle in
+    # the four "forward" neighbour cells, yielding each unordered pair once.
+    # Returns the candidate index arrays and the number of occupied cells.
+    cell_x = np.floor(x / cell_size).astype(np.int64)
+    cell_y = np.floor(y / cell_size).astype(np.int64)
+    cell_x -= cell_x.min()
+    cell_y -= cell_y.min() - 1
+    stride = int(cell_y.max()) + 2
+    keys = cell_x * stride + cell_y
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    cells, cell_start, cell_count = np.unique(
+        sorted_keys, return_index=True, return_counts=True
+    )
+    positions = np.arange(len(sorted_keys))
+    own_cell = np.searchsorted(cells, sorted_keys)
+
+    # Later particles in the same cell
+    own_end = cell_start[own_cell] + cell_count[own_cell]
+    sources, targets = expand_ranges(positions, positions + 1, own_end - positions - 1)
+    id1_parts = [sources]
+    id2_parts = [targets]
+
+    # Every particle in the forward neighbour cells
+    for offset in (stride - 1, stride, stride + 1, 1):
+        neighbour_keys = sorted_keys + offset
+        neighbour = np.searchsorted(cells, neighbour_keys)
+        neighbour = np.minimum(neighbour, len(cells) - 1)
+        found = cells[neighbour] == neighbour_keys
+        counts = np.where(found, cell_count[neighbour], 0)
+        sources, targets = expand_ranges(positions, cell_start[neighbour], counts)
+        id1_parts.append(sources)
+        id2_parts.append(targets)
+
+    id1 = order[np.concatenate(id1_parts)]
+    id2 = order[np.concatenate(id2_parts)]
+    return id1, id2, len(cells)
+
+
+def project_chain_constraints(
+    px, py, inv_mass, rest, max_iterations, tolerance, active=None
+):
+    # Batched SnakePhysics.apply_distance_constraints over chains stored
+    # column-wise: particle k of chain c sits at [k, c] of the predicted
+    # positions px, py (updated in place) and link k joins particles k and
+    # k + 1. Links where `active` is False are left alone. Returns the
+    # iterations run and the largest link error after the last one.
+    if rest.size == 0:
+        return 0, 0.0
+    if active is None:
+        active = np.ones(rest.shape, dtype=bool)
+
+    inv_mass1 = inv_mass[:-1]
+    inv_mass2 = inv_mass[1:]
+    total_inv_mass = inv_mass1 + inv_mass2
+
+    iterations = 0
+    while True:
+        delta_x = px[1:] - px[:-1]
+        delta_y = py[1:] - py[:-1]
+        current_distance = np.sqrt(delta_x * delta_x + delta_y * delta_y)
+        difference = np.where(active, current_distance - rest, 0.0)
+        residual = float(np.abs(difference).max())
+        if residual <= tolerance or iterations == max_iterations:
+            break
+        iterations += 1
+
+        # Degenerate links get no correction this iteration
+        solvable = active & (current_distance > 0) & (total_inv_mass > 0)
+        normal_x = np.divide(
+            delta_x, current_distance, out=np.zeros_like(delta_x), where=solvable
+        )
+        normal_y = np.divide(
+            delta_y, current_distance, out=np.zeros_like(delta_y), where=solvable
+        )
+        diagonal = np.where(solvable, total_inv_mass, 1.0)
+        rhs = np.where(solvable, -difference, 0.0)
+        off_diagonal = -inv_mass[1:-1] * (
+            normal_x[:-1] * normal_x[1:] + normal_y[:-1] * normal_y[1:]
+        )
+
+        # The Thomas sweeps run link by link, each step vectorized across
+        # the chains; a single chain is faster on plain floats
+        if rest.shape[1] == 1:
+            lambdas = solve_tridiagonal(
+                diagonal.ravel().tolist(),
+                off_diagonal.ravel().tolist(),
+                rhs.ravel().tolist(),
+            )
+            lambdas = np.array(lambdas)[:, None]
+        else:
+            lambdas = np.array(solve_tridiagonal(diagonal, off_diagonal, rhs))
+
+        step_x = lambdas * normal_x
+        step_y = lambdas * normal_y
+        px[:-1] -= inv_mass1 * step_x
+        py[:-1] -= inv_mass1 * step_y
+        px[1:] += inv_mass2 * step_x
+        py[1:] += inv_mass2 * step_y
+    return iterations, residual
+
+
+def project_collision_pairs(p, id1, id2, damping=0.2):
+    # Batched SnakePhysics.collision_constraint over candidate pairs. Returns
+    # the number of pairs that were actually in contact.
+    delta_x = p.x[id1] - p.x[id2]
+    delta_y = p.y[id1] - p.y[id2]
+    current_distance = np.sqrt(delta_x * delta_x + delta_y * delta_y)
+    radii_sum = p.r[id1] + p.r[id2]
+    inv_mass1 = p.inv_mass[id1]
+    inv_mass2 = p.inv_mass[id2]
+    total_inv_mass = inv_mass1 + inv_mass2
+
+    # The scalar solver visits every ordered pair, so each unordered pair
+    # receives its correction twice, except coincident particles whose
+    # fallback (1, 0) directions cancel out
+    overlapping = (
+        (current_distance < radii_sum) & (current_distance > 0) & (total_inv_mass > 0)
+    )
+    if not overlapping.any():
+        return 0
+
+    id1 = id1[overlapping]
+    id2 = id2[overlapping]
+    current_distance = current_distance[overlapping]
+    direction_x = delta_x[overlapping] / current_distance
+    direction_y = delta_y[overlapping] / current_distance
+    overlap = radii_sum[overlapping] - current_distance
+    correction = 2 * damping * overlap / total_inv_mass[overlapping]
+
+    np.add.at(p.px, id1, inv_mass1[overlapping] * correction * direction_x)
+    np.add.at(p.py, id1, inv_mass1[overlapping] * correction * direction_y)
+    np.add.at(p.px, id2, -inv_mass2[overlapping] * correction * direction_x)
+    np.add.at(p.py, id2, -inv_mass2[overlapping] * correction * direction_y)
+    return len(id1)
+
+
+class ArraySnakePhysics(SnakePhysics):
+    # SnakePhysics running on a ParticleArray. Prediction, constraint
+    # projection and the velocity update are batched array operations.
+    def __init__(self, particles, distance_constraints, time_delta, cell_size=0.2):
+        super().__init__(particles, distance_constraints, time_delta, cell_size)
+        self._constraint_key = None
+        self._constraint_arrays = None
+
+    def predict_positions(self, snake_direction):
+        p = self.particles
+        if p.count == 0:
+            return
+
+        # Apply direction movement to the head
+        p.px[0] += snake_direction[0] * self.head_speed
+        p.py[0] += snake_direction[1] * self.head_speed
+
+        # Apply friction to other particles
+        n = p.count
+        p.vx[1:n] *= self.friction
+        p.vy[1:n] *= self.friction
+        p.px[1:n] = p.x[1:n] + p.vx[1:n] * self.time_delta
+        p.py[1:n] = p.y[1:n] + p.vy[1:n] * self.time_delta
+
+    def update_velocities(self):
+        p = self.particles
+        n = p.count
+        p.vx[:n] = (p.px[:n] - p.x[:n]) / self.time_delta
+        p.vy[:n] = (p.py[:n] - p.y[:n]) / self.time_delta
+        p.x[:n] = p.px[:n]
+        p.y[:n] = p.py[:n]
+
+    def constraint_arrays(self):
+        # Constraints are only ever appended or popped by Snake.grow/shrink,
+        # so the cached arrays are rebuilt whenever the list length changes
+        key = len(self.distance_constraints)
+        if key != self._constraint_key:
+            constraints = self.distance_constraints
+            self._constraint_arrays = (
+                np.fromiter((c.id1 for c in constraints), np.intp, key),
+                np.fromiter((c.id2 for c in constraints), np.intp, key),
+                np.fromiter((c.distance for c in constraints), np.float64, key),
+            )
+            self._constraint_key = key
+        return self._constraint_arrays
+
+    def apply_distance_constraints(self):
+        # The snake is one chain, passed as (particles, 1) column views
+        _, _, rest = self.constraint_arrays()
+        p = self.particles
+        n = len(rest) + 1
+        iterations, residual = project_chain_constraints(
+            p.px[:n, None],
+            p.py[:n, None],
+            p.inv_mass[:n, None],
+            rest[:, None],
+            self.max_solver_iterations,
+            self.solver_tolerance,
+        )
+        self.solver_stats.record(len(rest), iterations, residual)
+
+    def head_collision(self, first=2):
+        # The whole body is one vectorized squared-distance test
+        p = self.particles
+        n = p.count
+        if n <= first:
+            return False
+        delta_x = p.x[first:n] - p.x[0]
+        delta_y = p.y[first:n] - p.y[0]
+        radii_sum = p.r[first:n] + p.r[0]
+        return bool(
+            (delta_x * delta_x + delta_y * delta_y < radii_sum * radii_sum).any()
+        )
+
+    def resolve_collision_constraints(self, damping=0.2):
+        p = self.particles
+        n = p.count
+        if n < 2:
+            self.broadphase_stats.record(n, n, 0, 0)
+            return
+        cell_size = self.broadphase_cell_size(float(p.r[:n].max()))
+        id1, id2, cells = grid_candidate_pairs(p.x[:n], p.y[:n], cell_size)
+        contacts = project_collision_pairs(p, id1, id2, damping)
+        self.broadphase_stats.record(n, cells, len(id1), contacts)
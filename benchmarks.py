@@ -0,0 +1,648 @@
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from clock import SimulationClock
+from collision import CollisionWorld
+from collision import particle_arrays
+from enemy import Enemy
+from enemy import EnemyManager
+from food import FOOD_CELL_SIZE
+from food import FoodField
+from projectile import OWNER_ENEMY
+from projectile import OWNER_SNAKE
+from projectile import ProjectileManager
+from snake import Snake
+from stats import GameStats
+from statestream import PLAYER_DTYPE
+from statestream import capture_world
+from statestream import decode_frame
+from statestream import encode_frame
+from swarm import EnemySwarm
+from utils import VIEW_SIZE
+from utils import Viewport
+from utils import world_bounds
+
+# Output format version; bump when result fields change meaning
+SCHEMA_VERSION = 1
+
+BOUNDS = (-5, 5, -5, 5)
+BACKENDS = ("python", "numpy")
+
+# Sweeps of the full suite, and of --quick
+SNAKE_LENGTHS = (3, 10, 100, 1000, 5000)
+PROJECTILE_COUNTS = (0, 10, 100, 1000, 10000)
+ENEMY_COUNTS = (1, 3, 10, 100, 1000)
+QUICK_SNAKE_LENGTHS = (3, 100, 1000)
+QUICK_PROJECTILE_COUNTS = (0, 100, 1000)
+QUICK_ENEMY_COUNTS = (1, 10, 100)
+SWARM_COUNTS = (1, 10, 100, 1000, 10000)
+QUICK_SWARM_COUNTS = (10, 1000)
+FOOD_COUNTS = (1, 100, 1000, 10000)
+QUICK_FOOD_COUNTS = (1, 1000)
+WORLD_SIZES = (10, 40, 160)
+QUICK_WORLD_SIZES = (10, 80)
+
+# Ticks between the keyframe and the frame the stream benchmarks encode
+STREAM_DELTA_TICKS = 8
+
+# Food benchmarks spread their items over this many times as many cells, and
+# eat with this reach
+FOOD_CELLS_PER_ITEM = 4
+FOOD_REACH = 0.3
+
+# Food items per unit of area in the world size sweeps
+FOOD_DENSITY = 1.0
+
+# Snake length and enemy count held fixed while another size is swept
+DEFAULT_SNAKE_LENGTH = 10
+DEFAULT_ENEMY_COUNT = 3
+
+
+def make_snake(length, backend="python", seed=0):
+    # A snake of `length` segments folded into rows across the arena, with a
+    # little jitter so neighbouring rows touch and the collision solver has
+    # contacts to resolve
+    leftx, rightx, topy, bottomy = BOUNDS
+    snake = Snake(
+        ProjectileManager(*BOUNDS, stats=GameStats()),
+        initial_length=length,
+        screen_leftx=leftx,
+        screen_rightx=rightx,
+        screen_topy=topy,
+        screen_bottomy=bottomy,
+        physics_backend=backend,
+        clock=SimulationClock(),
+    )
+    rng = random.Random(seed)
+    spacing = snake.particle_radii * 2.1
+    per_row = int((rightx - leftx) / spacing) - 1
+    for index, particle in enumerate(snake.particles):
+        row, column = divmod(index, per_row)
+        if row % 2:
+            column = per_row - 1 - column
+        x = leftx + spacing * (column + 1) + rng.uniform(-0.02, 0.02)
+        y = topy + spacing * (row + 1) + rng.uniform(-0.02, 0.02)
+        particle.x = particle.px = x
+        particle.y = particle.py = y
+    snake.move("right")
+    return snake
+
+
+def save_particles(snake):
+    return [(p.x, p.y, p.px, p.py, p.vx, p.vy) for p in snake.particles]
+
+
+def restore_particles(snake, saved):
+    for particle, state in zip(snake.particles, saved):
+        (
+            particle.x,
+            particle.y,
+            particle.px,
+            particle.py,
+            particle.vx,
+            particle.vy,
+        ) = state
+
+
+def make_enemies(manager, count, seed=0):
+    # `count` ships already in position, so ramming checks run every tick
+    rng = random.Random(seed)
+    for _ in range(count):
+        enemy = Enemy(*BOUNDS, manager.projectile_manager, clock=manager.clock, rng=rng)
+        enemy.init_x, enemy.init_y = enemy.x, enemy.y
+        enemy.inPosition = True
+        enemy.save_state()
+        manager.enemies.append(enemy)
+    return list(manager.enemies)
+
+
+def physics_case(method, length, backend):
+    snake = make_snake(length, backend)
+    physics = snake.physics
+    saved = save_particles(snake)
+
+    def reset():
+        restore_particles(snake, saved)
+
+    if method == "apply_physics":
+
+        def run():
+            physics.apply_physics(snake.snake_direction)
+
+    else:
+        run = getattr(physics, method)
+    return reset, run
+
+
+def projectile_case(count, enemies, length):
+    # Half snake shots, half enemy shots, scattered over the arena slightly
+    # wider than the bounds so some leave it
+    rng = np.random.default_rng(0)
+    clock = SimulationClock()
+    projectile_manager = ProjectileManager(
+        *BOUNDS, stats=GameStats(), capacity=max(count, 1)
+    )
+    enemy_manager = EnemyManager(
+        *BOUNDS, projectile_manager, max_enemies=enemies, clock=clock
+    )
+    ships = make_enemies(enemy_manager, enemies)
+    pool = projectile_manager.pool
+    for index in range(count):
+        angle = rng.uniform(0, 2 * math.pi)
+        x, y = rng.uniform(-5.5, 5.5, 2)
+        owner = OWNER_SNAKE if index % 2 else OWNER_ENEMY
+        vx, vy = math.cos(angle) * 0.025, math.sin(angle) * 0.025
+        pool.spawn(x, y, vx, vy, 0.1, 1, owner)
+    pool.prev_x[:count] = pool.x[:count] - pool.vx[:count]
+    pool.prev_y[:count] = pool.y[:count] - pool.vy[:count]
+    saved = {name: getattr(pool, name).copy() for name in pool.fields}
+    state = {}
+
+    def reset():
+        for name, values in saved.items():
+            getattr(pool, name)[:] = values
+        pool.count = count
+        enemy_manager.enemies[:] = ships
+        state["snake"] = make_snake(length)
+        state["world"] = CollisionWorld()
+        state["world"].index_snake(state["snake"])
+        state["world"].index_enemies(ships)
+
+    def run():
+        projectile_manager.check_collisions(
+            state["snake"], enemy_manager, state["world"]
+        )
+
+    return reset, run
+
+
+def enemy_case(count, length):
+    clock = SimulationClock()
+    projectile_manager = ProjectileManager(*BOUNDS, stats=GameStats())
+    enemy_manager = EnemyManager(
+        *BOUNDS,
+        projectile_manager,
+        max_enemies=count,
+        stats=GameStats(),
+        clock=clock,
+    )
+    ships = make_enemies(enemy_manager, count)
+    state = {}
+
+    def reset():
+        enemy_manager.enemies[:] = ships
+        projectile_manager.pool.clear()
+        state["snake"] = make_snake(length)
+        state["world"] = CollisionWorld()
+        state["world"].index_snake(state["snake"])
+
+    def run():
+        enemy_manager.update(state["snake"], state["world"])
+
+    return reset, run
+
+
+def swarm_case(count, length):
+    # enemy_case for an EnemySwarm: `count` ships already in position
+    clock = SimulationClock()
+    projectile_manager = ProjectileManager(*BOUNDS, stats=GameStats())
+    swarm = EnemySwarm(
+        *BOUNDS,
+        projectile_manager,
+        max_enemies=count,
+        stats=GameStats(),
+        clock=clock,
+        rng=random.Random(0),
+    )
+    swarm.spawn_enemies(count)
+    ships = swarm.ships
+    ships.x[:count] = ships.target_x[:count]
+    ships.y[:count] = ships.target_y[:count]
+    ships.in_position[:count] = True
+    saved = [getattr(ships, name).copy() for name in ships.fields]
+    state = {}
+
+    def reset():
+        for name, values in zip(ships.fields, saved):
+            getattr(ships, name)[:] = values
+        ships.count = count
+        ships.rebuild_slots()
+        projectile_manager.pool.clear()
+        state["snake"] = make_snake(length)
+        state["world"] = CollisionWorld()
+        state["world"].index_snake(state["snake"])
+
+    def run():
+        swarm.update(state["snake"], state["world"])
+
+    return reset, run
+
+
+def food_case(count, length):
+    # Head-vs-food lookup and respawning on a field of `count` items: each
+    # run eats around the next of a cycle of head positions and refills the
+    # field clear of the snake
+    half = max(5.0, FOOD_CELL_SIZE * math.sqrt(FOOD_CELLS_PER_ITEM * count) / 2)
+    food = FoodField(-half, half, -half, half, count=count, rng=random.Random(0))
+    snake = make_snake(length)
+    bodies = [particle_arrays(snake.particles)]
+    food.refill(bodies)
+    heads = np.random.default_rng(0).uniform(-half, half, (256, 2)).tolist()
+    state = {"index": 0}
+
+    def reset():
+        pass
+
+    def run():
+        x, y = heads[state["index"] % len(heads)]
+        state["index"] += 1
+        if food.eat(x, y, FOOD_REACH):
+            food.refill(bodies)
+
+    return reset, run
+
+
+def visible_food_case(world_size):
+    # Finding the food a camera of VIEW_SIZE shows, in a world filled to
+    # FOOD_DENSITY; the time should not grow with the world
+    food = FoodField(
+        *world_bounds(world_size),
+        count=int(FOOD_DENSITY * world_size * world_size),
+        rng=random.Random(0),
+    )
+    food.refill()
+    half = VIEW_SIZE / 2
+
+    def reset():
+        pass
+
+    def run():
+        visible = food.visible(-half, half, -half, half)
+        food.x[visible], food.y[visible]
+
+    return reset, run
+
+
+def stream_case(operation, count, length):
+    # A frame of a world with `count` moving projectiles, STREAM_DELTA_TICKS
+    # after its keyframe. Encoding includes capturing the world, as a server
+    # does every tick. The case reports the size of the frame and of the
+    # keyframe sent in full.
+    rng = np.random.default_rng(0)
+    projectile_manager = ProjectileManager(
+        *BOUNDS, stats=GameStats(), capacity=max(count, 1)
+    )
+    enemy_manager = EnemyManager(
+        *BOUNDS, projectile_manager, max_enemies=DEFAULT_ENEMY_COUNT
+    )
+    ships = make_enemies(enemy_manager, DEFAULT_ENEMY_COUNT)
+    for index, ship in enumerate(ships):
+        ship.id = index + 1
+    pool = projectile_manager.pool
+    for index in range(count):
+        angle = rng.uniform(0, 2 * math.pi)
+        x, y = rng.uniform(-5, 5, 2)
+        owner = OWNER_SNAKE if index % 2 else OWNER_ENEMY
+        pool.spawn(
+            x, y, math.cos(angle) * 0.025, math.sin(angle) * 0.025, 0.1, 1, owner
+        )
+    snake = make_snake(length)
+    players = np.zeros(1, PLAYER_DTYPE)
+    players[0] = (0, True, length, 0)
+    food = FoodField(*BOUNDS, rng=random.Random(0))
+    food.refill()
+
+    def capture(tick):
+        return capture_world(
+            tick,
+            players,
+            [(0, snake.particles)],
+            pool,
+            enemy_manager.ship_arrays(),
+            food,
+        )
+
+    keyframe = capture(0)
+    for _ in range(STREAM_DELTA_TICKS):
+        snake.physics.apply_physics(snake.snake_direction)
+        projectile_manager.update_projectiles()
+    frame = encode_frame(capture(STREAM_DELTA_TICKS), keyframe)
+    info = {
+        "frame_bytes": len(frame),
+        "keyframe_bytes": len(encode_frame(keyframe)),
+    }
+
+    def reset():
+        pass
+
+    if operation == "encode":
+
+        def run():
+            encode_frame(capture(STREAM_DELTA_TICKS), keyframe)
+
+    else:
+
+        def run():
+            decode_frame(frame, keyframe)
+
+    return reset, run, info
+
+
+def gl_context():
+    # Hidden window for the draw benchmarks; None when no display or GL
+    # bindings are available
+    try:
+        import glfw
+        from OpenGL.GLU import gluOrtho2D
+    except ImportError:
+        return None
+    if not glfw.init():
+        return None
+    glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+    window = glfw.create_window(800, 800, "benchmarks", None, None)
+    if not window:
+        glfw.terminate()
+        return None
+    glfw.make_context_current(window)
+    leftx, rightx, topy, bottomy = BOUNDS
+    gluOrtho2D(leftx, rightx, bottomy, topy)
+    return window
+
+
+def draw_case(length):
+    from OpenGL.GL import glFinish
+
+    snake = make_snake(length)
+    viewport = Viewport(*BOUNDS, 800, 800)
+
+    def reset():
+        pass
+
+    def run():
+        # Wait for the driver, so the time covers the work it was given
+        snake.draw(viewport)
+        glFinish()
+
+    return reset, run
+
+
+def cases(quick=False):
+    # (name, params, factory) for every benchmark of the suite
+    snake_lengths = QUICK_SNAKE_LENGTHS if quick else SNAKE_LENGTHS
+    projectile_counts = QUICK_PROJECTILE_COUNTS if quick else PROJECTILE_COUNTS
+    enemy_counts = QUICK_ENEMY_COUNTS if quick else ENEMY_COUNTS
+    food_counts = QUICK_FOOD_COUNTS if quick else FOOD_COUNTS
+    world_sizes = QUICK_WORLD_SIZES if quick else WORLD_SIZES
+    swarm_counts = QUICK_SWARM_COUNTS if quick else SWARM_COUNTS
+
+    for method in (
+        "apply_physics",
+        "resolve_collision_constraints",
+        "apply_distance_constraints",
+    ):
+        for backend in BACKENDS:
+            for length in snake_lengths:
+                yield (
+                    "SnakePhysics." + method,
+                    {"backend": backend, "snake_length": length},
+                    lambda m=method, n=length, b=backend: physics_case(m, n, b),
+                )
+
+    for enemies in (0, DEFAULT_ENEMY_COUNT):
+        for count in projectile_counts:
+            yield (
+                "ProjectileManager.check_collisions",
+                {"projectiles": count, "enemies": enemies},
+                lambda n=count, e=enemies: projectile_case(n, e, DEFAULT_SNAKE_LENGTH),
+            )
+
+    for count in enemy_counts:
+        yield (
+            "EnemyManager.update",
+            {"enemies": count},
+            lambda n=count: enemy_case(n, DEFAULT_SNAKE_LENGTH),
+        )
+
+    for count in swarm_counts:
+        yield (
+            "EnemySwarm.update",
+            {"enemies": count},
+            lambda n=count: swarm_case(n, DEFAULT_SNAKE_LENGTH),
+        )
+
+    for count in food_counts:
+        yield (
+            "FoodField.eat",
+            {"food": count},
+            lambda n=count: food_case(n, DEFAULT_SNAKE_LENGTH),
+        )
+
+    for size in world_sizes:
+        yield (
+            "FoodField.visible",
+            {"world_size": size},
+            lambda n=size: visible_food_case(n),
+        )
+
+    for operation in ("encode", "decode"):
+        for count in projectile_counts:
+            yield (
+                "statestream." + operation + "_frame",
+                {"projectiles": count, "snake_length": DEFAULT_SNAKE_LENGTH},
+                lambda o=operation, n=count: stream_case(o, n, DEFAULT_SNAKE_LENGTH),
+            )
+
+    for length in snake_lengths:
+        yield ("Snake.draw", {"snake_length": length}, lambda n=length: draw_case(n))
+
+
+def case_id(name, params):
+    return name + "[" + ",".join(k + "=" + str(v) for k, v in params.items()) + "]"
+
+
+def measure(reset, run, min_time=0.2, min_repeats=5, max_repeats=10000):
+    # Time single calls of `run`, each after a `reset` that is not timed,
+    # until both the time budget and the minimum repeat count are spent
+    reset()
+    run()
+    timings = []
+    total = 0.0
+    while len(timings) < max_repeats and (
+        total < min_time or len(timings) < min_repeats
+    ):
+        reset()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+    return {
+        "repeats": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def run_suite(quick=False, filters=(), min_time=0.2, progress=None):
+    results = []
+    window = None
+    for name, params, factory in cases(quick):
+        identifier = case_id(name, params)
+        if filters and not any(text in identifier for text in filters):
+            continue
+
+        result = {"id": identifier, "name": name, "params": params}
+        if name == "Snake.draw" and window is None:
+            window = gl_context() or False
+        if name == "Snake.draw" and not window:
+            result["skipped"] = "no OpenGL context"
+        else:
+            # Factories return (reset, run), plus a dict of extra result
+            # fields for cases that measure more than time
+            case = factory()
+            result.update(measure(case[0], case[1], min_time=min_time))
+            if len(case) > 2:
+                result.update(case[2])
+        results.append(result)
+        if progress is not None:
+            progress(result)
+
+    if window:
+        import glfw
+
+        glfw.terminate()
+
+    return {
+        "schema": SCHEMA_VERSION,
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold=0.1):
+    # Benchmarks whose median got more than `threshold` slower than in the
+    # baseline report, as (id, baseline median, median) tuples
+    before = {
+        result["id"]: result["median"]
+        for result in baseline["results"]
+        if "median" in result
+    }
+    regressions = []
+    for result in report["results"]:
+        if "median" not in result or result["id"] not in before:
+            continue
+        if result["median"] > before[result["id"]] * (1 + threshold):
+            regressions.append((result["id"], before[result["id"]], result["median"]))
+    return regressions
+
+
+def format_result(result):
+    if "skipped" in result:
+        return result["id"] + ": skipped (" + result["skipped"] + ")"
+    return (
+        result["id"]
+        + ": median "
+        + format(result["median"] * 1e6, ".1f")
+        + " us, min "
+        + format(result["min"] * 1e6, ".1f")
+        + " us over "
+        + str(result["repeats"])
+        + " runs"
+        + (
+            ", " + str(result["frame_bytes"]) + " bytes per frame"
+            if "frame_bytes" in result
+            else ""
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the physics, collision and drawing hot paths"
+    )
+    parser.add_argument("--quick", action="store_true", help="smaller sweeps")
+    parser.add_argument(
+        "--filter",
+        action="append",
+        default=[],
+        help="only run benchmarks whose id contains this text (repeatable)",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="seconds of timed calls per benchmark",
+    )
+    parser.add_argument("--json", metavar="PATH", help="write the report to PATH")
+    parser.add_argument(
+        "--compare", metavar="PATH", help="baseline report to check against"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown of the median that counts as a regression",
+    )
+    parser.add_argument("--list", action="store_true", help="list benchmark ids")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, params, _ in cases(args.quick):
+            print(case_id(name, params))
+        sys.exit(0)
+
+    report = run_suite(
+        quick=args.quick,
+        filters=args.filter,
+        min_time=args.min_time,
+        progress=lambda result: print(format_result(result), flush=True),
+    )
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.threshold)
+        for identifier, before, after in regressions:
+            print(
+                "Regression: "
+                + identifier
+                + " "
+                + format(before * 1e6, ".1f")
+                + " us -> "
+                + format(after * 1e6, ".1f")
+                + " us"
+            )
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,39 @@
+import time
+
+# Duration of one simulation tick in game seconds
+TIME_DELTA = 1 / 64.0
+
+
+class SimulationClock:
+    # Game time measured in whole ticks. Nothing reads the host clock, so a
+    # run advances identically however fast it is stepped.
+    def __init__(self, time_delta=TIME_DELTA):
+        self.time_delta = time_delta
+        self.tick = 0
+
+    @property
+    def time(self):
+        return self.tick * self.time_delta
+
+    def advance(self, ticks=1):
+        self.tick += ticks
+
+    def reset(self):
+        self.tick = 0
+
+
+class WallClock:
+    # Host time, for objects used outside a Game loop
+    def __init__(self, time_delta=TIME_DELTA):
+        self.time_delta = time_delta
+        self.tick = 0
+
+    @property
+    def time(self):
+        return time.time()
+
+    def advance(self, ticks=1):
+        self.tick += ticks
+
+    def reset(self):
+        self.tick = 0
@@ -0,0 +1,233 @@
+import numpy as np
+
+# Cell coordinates are offset and packed into one int64 key per cell
+CELL_OFFSET = 1 << 20
+CELL_STRIDE = 1 << 21
+
+# Below this many query-body combinations every pair is tested directly;
+# building and walking the grid costs more than it saves
+DENSE_PAIR_LIMIT = 1 << 14
+
+
+def particle_arrays(particles):
+    # x, y and radius arrays of a snake's particles. A ParticleArray already
+    # stores them as arrays; a list of particles is gathered once.
+    if isinstance(getattr(particles, "x", None), np.ndarray):
+        n = len(particles)
+        return particles.x[:n], particles.y[:n], particles.r[:n]
+    n = len(particles)
+    return (
+        np.fromiter((particle.x for particle in particles), np.float64, n),
+        np.fromiter((particle.y for particle in particles), np.float64, n),
+        np.fromiter((particle.r for particle in particles), np.float64, n),
+    )
+
+
+def swept_touching(x0, y0, x1, y1, r, body_x, body_y, body_r):
+    # Whether circles of radius r swept from (x0, y0) to (x1, y1) touch the
+    # bodies at any point along the way, by the closest point of each swept
+    # segment to the body centre. Arguments broadcast against each other.
+    delta_x = x1 - x0
+    delta_y = y1 - y0
+    to_body_x = body_x - x0
+    to_body_y = body_y - y0
+    length_squared = delta_x * delta_x + delta_y * delta_y
+    t = (to_body_x * delta_x + to_body_y * delta_y) / np.where(
+        length_squared > 0, length_squared, 1.0
+    )
+    np.clip(t, 0.0, 1.0, out=t)
+    gap_x = to_body_x - t * delta_x
+    gap_y = to_body_y - t * delta_y
+    reach = r + body_r
+    return gap_x * gap_x + gap_y * gap_y < reach * reach
+
+
+def expand(counts):
+    # For runs of the given lengths, the run each element belongs to and its
+    # position inside the run
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, local
+
+
+class GridIndex:
+    # Uniform grid over circle centres, stored as bodies sorted by cell key
+    def __init__(self, x, y, r, cell_size):
+        self.cell_size = cell_size
+        self.max_radius = float(r.max()) if len(r) else 0.0
+        keys = self.cell_keys(
+            np.floor(x / cell_size).astype(np.int64),
+            np.floor(y / cell_size).astype(np.int64),
+        )
+        self.order = np.argsort(keys, kind="stable")
+        self.cells, self.cell_start, self.cell_count = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+        )
+
+    @staticmethod
+    def cell_keys(cell_x, cell_y):
+        return (cell_x + CELL_OFFSET) * CELL_STRIDE + (cell_y + CELL_OFFSET)
+
+    def candidates(self, min_x, min_y, max_x, max_y):
+        # (query, body) index pairs for every body whose cell intersects the
+        # query's bounding box, padded by the largest body radius
+        if len(self.cells) == 0 or len(min_x) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty
+        pad = self.max_radius
+        cell_x0 = np.floor((min_x - pad) / self.cell_size).astype(np.int64)
+        cell_y0 = np.floor((min_y - pad) / self.cell_size).astype(np.int64)
+        cell_x1 = np.floor((max_x + pad) / self.cell_size).astype(np.int64)
+        cell_y1 = np.floor((max_y + pad) / self.cell_size).astype(np.int64)
+        span_y = cell_y1 - cell_y0 + 1
+        cell_counts = (cell_x1 - cell_x0 + 1) * span_y
+
+        # Every cell covered by every query
+        query, local = expand(cell_counts)
+        keys = self.cell_keys(
+            cell_x0[query] + local // span_y[query],
+            cell_y0[query] + local % span_y[query],
+        )
+        slot = np.minimum(np.searchsorted(self.cells, keys), len(self.cells) - 1)
+        found = self.cells[slot] == keys
+        query = query[found]
+        slot = slot[found]
+
+        # Every body in those cells
+        run, local = expand(self.cell_count[slot])
+        bodies = self.order[self.cell_start[slot][run] + local]
+        return query[run], bodies
+
+
+class CollisionLayer:
+    def __init__(self, x, y, r, items=None, min_cell_size=0.2):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.r = np.asarray(r, dtype=np.float64)
+        self.items = items
+        self.min_cell_size = min_cell_size
+        self._index = None
+
+    @property
+    def index(self):
+        # Built on the first query, so layers nobody asks about cost nothing
+        if self._index is None:
+            cell_size = self.min_cell_size
+            if len(self.r):
+                cell_size = max(cell_size, 2 * float(self.r.max()))
+            self._index = GridIndex(self.x, self.y, self.r, cell_size)
+        return self._index
+
+    def __len__(self):
+        return len(self.x)
+
+
+class CollisionWorld:
+    # Circular bodies indexed once per tick, in named layers ("snake",
+    # "enemies", ...), shared by every manager's overlap queries
+    def __init__(self):
+        self.layers = {}
+
+    def set_layer(self, name, x, y, r, items=None):
+        self.layers[name] = CollisionLayer(x, y, r, items)
+        return self.layers[name]
+
+    def index_snake(self, snake):
+        x, y, r = particle_arrays(snake.particles)
+        return self.set_layer("snake", x.copy(), y.copy(), r.copy())
+
+    def index_enemies(self, enemies):
+        enemies = list(enemies)
+        n = len(enemies)
+        return self.set_layer(
+            "enemies",
+            np.fromiter((enemy.x for enemy in enemies), np.float64, n),
+            np.fromiter((enemy.y for enemy in enemies), np.float64, n),
+            np.fromiter((enemy.size for enemy in enemies), np.float64, n),
+            enemies,
+        )
+
+    def bodies(self, *names):
+        # (x, y, radius) arrays of the named layers that exist
+        return [
+            (layer.x, layer.y, layer.r)
+            for layer in (self.layers.get(name) for name in names)
+            if layer is not None
+        ]
+
+    def overlap_pairs(self, name, x, y, r):
+        # (query, body) pairs of query circles overlapping bodies of a layer
+        return self.sweep_pairs(name, x, y, x, y, r)
+
+    def sweep_pairs(self, name, x0, y0, x1, y1, r):
+        # (query, body) pairs of circles swept from (x0, y0) to (x1, y1) that
+        # touch bodies of a layer at any point along the way, so fast movers
+        # can't tunnel through thin bodies between ticks
+        layer = self.layers.get(name)
+        x0 = np.atleast_1d(np.asarray(x0, dtype=np.float64))
+        y0 = np.atleast_1d(np.asarray(y0, dtype=np.float64))
+        x1 = np.atleast_1d(np.asarray(x1, dtype=np.float64))
+        y1 = np.atleast_1d(np.asarray(y1, dtype=np.float64))
+        r = np.asarray(r, dtype=np.float64)
+        if r.shape != x0.shape:
+            r = np.full(x0.shape, r)
+        if layer is None or len(layer) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty
+        if len(x0) * len(layer) <= DENSE_PAIR_LIMIT:
+            return self.dense_sweep_pairs(layer, x0, y0, x1, y1, r)
+
+        query, body = layer.index.candidates(
+            np.minimum(x0, x1) - r,
+            np.minimum(y0, y1) - r,
+            np.maximum(x0, x1) + r,
+            np.maximum(y0, y1) + r,
+        )
+
+        touching = swept_touching(
+            x0[query],
+            y0[query],
+            x1[query],
+            y1[query],
+            r[query],
+            layer.x[body],
+            layer.y[body],
+            layer.r[body],
+        )
+
+        query = query[touching]
+        body = body[touching]
+        order = np.lexsort((body, query))
+        return query[order], body[order]
+
+    def dense_sweep_pairs(self, layer, x0, y0, x1, y1, r):
+        # Same test as sweep_pairs over the full (query, body) matrix
+        return np.nonzero(
+            swept_touching(
+                x0[:, None],
+                y0[:, None],
+                x1[:, None],
+                y1[:, None],
+                r[:, None],
+                layer.x[None, :],
+                layer.y[None, :],
+                layer.r[None, :],
+            )
+        )
+
+    def first_hits(self, pairs, query_count):
+        # Lowest body index touched by each query, or -1
+        query, body = pairs
+        first = np.full(query_count, np.iinfo(np.intp).max, dtype=np.intp)
+        np.minimum.at(first, query, body)
+        first[first == np.iinfo(np.intp).max] = -1
+        return first
+
+    def overlaps(self, name, x, y, r):
+        x = np.atleast_1d(x)
+        return self.first_hits(self.overlap_pairs(name, x, y, r), len(x))
+
+    def sweeps(self, name, x0, y0, x1, y1, r):
+        x0 = np.atleast_1d(x0)
+        return self.first_hits(self.sweep_pairs(name, x0, y0, x1, y1, r), len(x0))
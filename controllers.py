@@ -0,0 +1,85 @@
+import importlib
+import random
+
+# Controllers play a headless Game: `act(game)` is called before every tick
+# and returns the ("move", direction) and ("shoot", game_x, game_y) actions
+# of Game.step. Each controller is built with the seed of the match it plays,
+# so its own randomness repeats with the match.
+
+DIRECTIONS = ("up", "down", "left", "right")
+
+
+class IdleController:
+    def __init__(self, seed=None):
+        pass
+
+    def act(self, game):
+        return ()
+
+
+class RandomController:
+    # Turns and fires at random
+    def __init__(self, seed=None, turn_chance=0.05, shoot_chance=0.1):
+        self.rng = random.Random(seed)
+        self.turn_chance = turn_chance
+        self.shoot_chance = shoot_chance
+
+    def act(self, game):
+        actions = []
+        if self.rng.random() < self.turn_chance:
+            actions.append(("move", self.rng.choice(DIRECTIONS)))
+        if self.rng.random() < self.shoot_chance:
+            actions.append(
+                (
+                    "shoot",
+                    self.rng.uniform(game.leftx, game.rightx),
+                    self.rng.uniform(game.topy, game.bottomy),
+                )
+            )
+        return actions
+
+
+class WallAvoidController:
+    # Turns back towards the centre near the walls and shoots at the closest
+    # enemy ship
+    def __init__(self, seed=None, margin=1.5):
+        self.margin = margin
+
+    def act(self, game):
+        actions = []
+        head = game.snake.getHead
+        if head.y < game.topy + self.margin:
+            actions.append(("move", "down"))
+        elif head.y > game.bottomy - self.margin:
+            actions.append(("move", "up"))
+        elif head.x < game.leftx + self.margin:
+            actions.append(("move", "right"))
+        elif head.x > game.rightx - self.margin:
+            actions.append(("move", "left"))
+
+        enemies = game.enemy_manager.enemies
+        if enemies:
+            target = min(
+                enemies,
+                key=lambda enemy: (enemy.x - head.x) ** 2 + (enemy.y - head.y) ** 2,
+            )
+            actions.append(("shoot", target.x, target.y))
+        return actions
+
+
+CONTROLLERS = {
+    "idle": IdleController,
+    "random": RandomController,
+    "wall_avoider": WallAvoidController,
+}
+
+
+def load_controller(name):
+    # A built-in controller by name, or any importable class as
+    # "package.module:ClassName"
+    if name in CONTROLLERS:
+        return CONTROLLERS[name]
+    if ":" not in name:
+        raise ValueError("Unknown controller: " + str(name))
+    module_name, _, attribute = name.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
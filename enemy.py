@@ -1,7 +1,11 @@
-from OpenGL.GL import *
 import random
 import math
-import time
+
+import numpy as np
+
+from clock import WallClock
+from collision import CollisionWorld
+from projectile import OWNER_ENEMY
 from stats import game_stats
 
 
@@ -14,7 +18,12 @@ class Enemy:
         screen_bottomy,
         projectile_manager,
         size=0.45,
+        clock=None,
+        rng=None,
     ):
+        self.id = 0  # Numbered by the EnemyManager that spawns the ship
+        self.clock = WallClock() if clock is None else clock
+        self.rng = random if rng is None else rng
         self.screen_leftx = screen_leftx
         self.screen_rightx = screen_rightx
         self.screen_topy = screen_topy
@@ -23,23 +32,43 @@ class Enemy:
         self.inPosition = False
         self.init_x, self.init_y = 0, self.screen_topy - (2 * self.size)
         self.x, self.y = self.generate_cords()
-        self.last_fire_time = time.time()
+        self.angle = 0.0
+        self.save_state()
+        self.last_fire_time = self.clock.time
         self.bulllets = []
         self.fire_rate = 1.75  # One bullet every 1.75 seconds
         self.bullet_speed = 0.025
         self.projectile_manager = projectile_manager
 
     def generate_cords(self):
-        x = random.uniform(
+        x = self.rng.uniform(
             self.screen_leftx + self.size, self.screen_rightx - self.size
         )
-        y = random.uniform(
+        y = self.rng.uniform(
             self.screen_topy + self.size, self.screen_bottomy - self.size
         )
 
         return x, y
 
-    def update_position(self, speed=0.02):
+    def save_state(self):
+        # Remember the state of the last tick, for renders between ticks
+        self.prev_init_x, self.prev_init_y = self.init_x, self.init_y
+        self.prev_angle = self.angle if self.inPosition else 0.0
+
+    def interpolate(self, alpha=1.0):
+        # Position and facing `alpha` of the way from the previous tick to the
+        # current one. Approaching ships fly unrotated; init_x/init_y snap to
+        # x/y once the ship is in position.
+        x = self.prev_init_x + (self.init_x - self.prev_init_x) * alpha
+        y = self.prev_init_y + (self.init_y - self.prev_init_y) * alpha
+        if not self.inPosition:
+            return x, y, 0.0
+
+        # Turn the short way round
+        turn = (self.angle - self.prev_angle + math.pi) % (2 * math.pi) - math.pi
+        return x, y, self.prev_angle + turn * alpha
+
+    def update_position(self, speed=0.06):
         # Calculate the direction vector towards the target position
         direction_x = self.x - self.init_x
         direction_y = self.y - self.init_y
@@ -59,41 +88,6 @@ class Enemy:
             self.init_x, self.init_y = self.x, self.y  # Snap to the target position
             self.inPosition = True
 
-    def draw(self):
-        if self.inPosition:
-            return
-
-        # Draw the main body of the ship as a triangle
-        glPushMatrix()
-        glTranslatef(self.init_x, self.init_y, 0)
-        glScalef(self.size, self.size, 1.0)
-
-        glBegin(GL_TRIANGLES)
-        glColor3f(1.0, 0.0, 0.0)  # Red color for the ship
-        glVertex2f(-0.5, -0.5)  # Left vertex
-        glVertex2f(0.5, -0.5)  # Right vertex
-        glVertex2f(0.0, 0.5)  # Top vertex
-        glEnd()
-
-        # Draw a circle for the ship's cockpit
-        glPopMatrix()
-
-        self.update_position()
-
-    def draw_ship(self):
-        # Draw the main body of the ship as a triangle
-        glPushMatrix()
-        glScalef(self.size, self.size, 1.0)
-
-        glBegin(GL_TRIANGLES)
-        glColor3f(1.0, 0.0, 0.0)  # Red color for the ship
-        glVertex2f(-0.5, -0.5)  # Left vertex
-        glVertex2f(0.5, -0.5)  # Right vertex
-        glVertex2f(0.0, 0.5)  # Top vertex (tip of the ship)
-        glEnd()
-
-        glPopMatrix()
-
     def track_target(self, snake_cords):
         if not self.inPosition:
             return
@@ -105,11 +99,11 @@ class Enemy:
         # Calculate the angle to the target
         angle_to_target = math.atan2(direction_y, direction_x)
 
-        # Rotate the ship to face the target
-        self.rotate_to_target(angle_to_target)
+        # Face the target; the rotation is applied when the ship is drawn
+        self.angle = angle_to_target
 
         # Fire a bullet if the cooldown has expired
-        current_time = time.time()
+        current_time = self.clock.time
         if current_time - self.last_fire_time >= self.fire_rate:
             self.last_fire_time = current_time
             self.projectile_manager.fire(
@@ -118,25 +112,10 @@ class Enemy:
                 angle_to_target,
                 self.bullet_speed,
                 size=0.1,
-                color=(1, 0, 0),
                 damage=1,
+                owner=OWNER_ENEMY,
             )
 
-    def rotate_to_target(self, angle):
-        # Perform rotation to face the target angle
-        glPushMatrix()
-
-        # First, translate to the ship's position
-        glTranslatef(self.x, self.y, 0)
-
-        # Then, rotate around the Z-axis at the ship's position
-        glRotatef(math.degrees(angle), 0, 0, 1)
-
-        # Draw the ship here in the rotated orientation
-        self.draw_ship()
-
-        glPopMatrix()
-
 
 class EnemyManager:
     def __init__(
@@ -147,55 +126,101 @@ class EnemyManager:
         screen_bottomy,
         projectile_manager,
         max_enemies=3,
+        stats=game_stats,
+        clock=None,
+        rng=None,
     ):
         self.enemies = []
+        self.next_id = 1
+        self.stats = stats
+        self.clock = WallClock() if clock is None else clock
+        self.rng = random if rng is None else rng
         self.max_enemies = max_enemies
         self.screen_bounds = (screen_leftx, screen_rightx, screen_topy, screen_bottomy)
         self.projectile_manager = projectile_manager
         self.spawn_rate = 3  # Time in seconds to spawn a new enemy
-        self.last_spawn_time = time.time()
+        self.last_spawn_time = self.clock.time
 
-    def update(self, snake):
+    def update(self, snake, world=None, stats=None):
         # Spawn new enemies if needed
         if (
             len(self.enemies) < self.max_enemies
-            and time.time() - self.last_spawn_time > self.spawn_rate
+            and self.clock.time - self.last_spawn_time > self.spawn_rate
         ):
             self.spawn_enemy()
-            self.last_spawn_time = time.time()
+            self.last_spawn_time = self.clock.time
 
-        # Update existing enemies
+        # Update existing enemies; BatchRenderer.draw_enemies interpolates
+        # between the saved and the new state
         for enemy in self.enemies:
+            enemy.save_state()
             enemy.update_position()
             enemy.track_target(snake.getHead)
-            enemy.draw()
 
         # Check for collisions
-        self.check_collision(snake)
+        self.check_collision(snake, world, stats)
 
     def spawn_enemy(self):
-        new_enemy = Enemy(*self.screen_bounds, self.projectile_manager)
+        new_enemy = Enemy(
+            *self.screen_bounds,
+            self.projectile_manager,
+            clock=self.clock,
+            rng=self.rng,
+        )
+        new_enemy.id = self.next_id
+        self.next_id += 1
         self.enemies.append(new_enemy)
 
-    def draw_enemies(self):
-        for enemy in self.enemies:
-            enemy.draw()
+    def index(self, world):
+        return world.index_enemies(self.enemies)
+
+    def ship_arrays(self):
+        # (id, x, y, angle) of every ship where it is drawn
+        enemies = self.enemies
+        n = len(enemies)
+        return (
+            np.fromiter((enemy.id for enemy in enemies), np.uint64, n),
+            np.fromiter((enemy.init_x for enemy in enemies), np.float64, n),
+            np.fromiter((enemy.init_y for enemy in enemies), np.float64, n),
+            np.fromiter((enemy.angle for enemy in enemies), np.float64, n),
+        )
 
     def destroy_enemy(self, enemy):
+        # Returns whether the ship was still alive
         if enemy in self.enemies:
             self.enemies.remove(enemy)
-
-    def check_collision(self, snake):
-        for enemy in self.enemies:
-            if enemy.inPosition:
-                if snake.check_collision(enemy.x, enemy.y, enemy.size):
-                    snake.shrink(2)
-                    self.destroy_enemy(enemy)
-
-                    snake_len = snake.getSize
-                    if snake_len < 5:
-                        game_stats.add_score(0.5)
-                    elif snake_len < 7:
-                        game_stats.add_score(1)
-                    else:
-                        game_stats.add_score(1.75)
+            return True
+        return False
+
+    def check_collision(self, snake, world=None, stats=None):
+        # Ships in position ram the snake; `world` holds the snake's segments
+        # indexed this tick (indexed here when not given). Points go to
+        # `stats`, the manager's own by default.
+        rammers = [enemy for enemy in self.enemies if enemy.inPosition]
+        if not rammers:
+            return
+        if stats is None:
+            stats = self.stats
+        if world is None:
+            world = CollisionWorld()
+            world.index_snake(snake)
+
+        first_segment = world.overlaps(
+            "snake",
+            [enemy.x for enemy in rammers],
+            [enemy.y for enemy in rammers],
+            [enemy.size for enemy in rammers],
+        )
+        for enemy, segment in zip(rammers, first_segment):
+            # Earlier rams pop tail segments, so the hit must still be attached
+            if 0 <= segment < snake.getSize:
+                snake.shrink(2)
+                self.destroy_enemy(enemy)
+
+                snake_len = snake.getSize
+                if snake_len < 5:
+                    stats.record_kill(0.5)
+                elif snake_len < 7:
+                    stats.record_kill(1)
+                else:
+                    stats.record_kill(1.75)
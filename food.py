@@ -1,35 +1,201 @@
 import random
-from utils import Particle
+from math import floor
 
+import numpy as np
+
+from collision import expand
+
+# Side of the cells of a FoodField's grid, at least; one item per cell
+FOOD_CELL_SIZE = 0.4
+
+
+class FoodField:
+    # Many food items on a uniform grid over the arena, at most one per cell.
+    # The grid is the spatial index (cell_item maps a cell to the item in
+    # it) and the occupancy map spawning draws from: `free` is a permutation
+    # of all cells whose first `free_count` entries are the cells without
+    # food, and `free_slot` is its inverse. New items go to a uniformly
+    # random free cell that no body covers, found without rejected draws;
+    # eating only looks at the few cells within reach of the head.
+    fields = ("x", "y", "id", "cell", "cell_item", "free", "free_slot")
 
-class Food:
     def __init__(
-        self, screen_leftx, screen_rightx, screen_topy, screen_bottomy, food_size=0.12
+        self,
+        screen_leftx,
+        screen_rightx,
+        screen_topy,
+        screen_bottomy,
+        count=1,
+        food_size=0.12,
+        cell_size=FOOD_CELL_SIZE,
+        rng=None,
     ):
+        self.rng = random if rng is None else rng
         self.screen_leftx = screen_leftx
         self.screen_rightx = screen_rightx
         self.screen_topy = screen_topy
         self.screen_bottomy = screen_bottomy
         self.food_size = food_size
-        self.food_particle = self.spawn_food()
+        self.target_count = count
+
+        # Whole cells across the arena, stretched to cover it exactly
+        cell_size = max(cell_size, 2 * food_size)
+        self.columns = max(1, int((screen_rightx - screen_leftx) // cell_size))
+        self.rows = max(1, int((screen_bottomy - screen_topy) // cell_size))
+        self.cell_width = (screen_rightx - screen_leftx) / self.columns
+        self.cell_height = (screen_bottomy - screen_topy) / self.rows
+        cells = self.columns * self.rows
+        if count > cells:
+            raise ValueError("More food than grid cells: " + str(count))
+
+        # Items, packed into the first `count` slots
+        self.count = 0
+        self.next_id = 1
+        self.x = np.zeros(cells)
+        self.y = np.zeros(cells)
+        self.id = np.zeros(cells, dtype=np.uint64)
+        self.cell = np.zeros(cells, dtype=np.intp)
+
+        self.cell_item = np.full(cells, -1, dtype=np.intp)
+        self.free = np.arange(cells, dtype=np.intp)
+        self.free_slot = np.arange(cells, dtype=np.intp)
+        self.free_count = cells
+
+    def __len__(self):
+        return self.count
+
+    def positions(self):
+        return self.x[: self.count], self.y[: self.count]
 
-    @property
-    def get_position(self):
-        return self.food_particle.x, self.food_particle.y
+    def swap_free(self, slot_a, slot_b):
+        free = self.free
+        cell_a, cell_b = free[slot_a], free[slot_b]
+        free[slot_a], free[slot_b] = cell_b, cell_a
+        self.free_slot[cell_a] = slot_b
+        self.free_slot[cell_b] = slot_a
 
-    def spawn_food(self):
-        # Randomly place the food within the game boundaries
-        x = random.uniform(
-            self.screen_leftx + self.food_size, self.screen_rightx - self.food_size
+    def covered_cells(self, bodies):
+        # Cells a food item placed in them could touch one of the bodies in;
+        # bodies are (x, y, radius) arrays
+        cells = []
+        for x, y, r in bodies:
+            if len(x) == 0:
+                continue
+            pad = np.asarray(r) + self.food_size
+            column0 = np.floor((x - pad - self.screen_leftx) / self.cell_width)
+            column1 = np.floor((x + pad - self.screen_leftx) / self.cell_width)
+            row0 = np.floor((y - pad - self.screen_topy) / self.cell_height)
+            row1 = np.floor((y + pad - self.screen_topy) / self.cell_height)
+            column0 = np.clip(column0, 0, self.columns - 1).astype(np.intp)
+            column1 = np.clip(column1, 0, self.columns - 1).astype(np.intp)
+            row0 = np.clip(row0, 0, self.rows - 1).astype(np.intp)
+            row1 = np.clip(row1, 0, self.rows - 1).astype(np.intp)
+            span = row1 - row0 + 1
+            body, local = expand((column1 - column0 + 1) * span)
+            cells.append(
+                (column0[body] + local // span[body]) * self.rows
+                + row0[body]
+                + local % span[body]
+            )
+        if not cells:
+            return np.zeros(0, dtype=np.intp)
+        return np.unique(np.concatenate(cells))
+
+    def spawn(self, count=1, bodies=()):
+        # Place up to `count` items in free cells clear of `bodies`; returns
+        # how many found room. Free cells under bodies are first moved to the
+        # end of the free region, so draws come from the cells before them.
+        free_slot = self.free_slot
+        unblocked = self.free_count
+        for cell in self.covered_cells(bodies):
+            slot = free_slot[cell]
+            if slot < unblocked:
+                unblocked -= 1
+                self.swap_free(slot, unblocked)
+
+        spawned = 0
+        while spawned < count and unblocked > 0:
+            # Move the drawn cell to the end of the unblocked cells, then to
+            # the end of the free region, keeping both regions contiguous
+            self.swap_free(self.rng.randrange(unblocked), unblocked - 1)
+            self.swap_free(unblocked - 1, self.free_count - 1)
+            unblocked -= 1
+            self.free_count -= 1
+            self.place(int(self.free[self.free_count]))
+            spawned += 1
+        return spawned
+
+    def place(self, cell):
+        column, row = divmod(cell, self.rows)
+        inset_x = self.food_size / self.cell_width
+        inset_y = self.food_size / self.cell_height
+        index = self.count
+        self.x[index] = self.screen_leftx + self.cell_width * (
+            column + self.rng.uniform(inset_x, 1 - inset_x)
         )
-        y = random.uniform(
-            self.screen_topy + self.food_size, self.screen_bottomy - self.food_size
+        self.y[index] = self.screen_topy + self.cell_height * (
+            row + self.rng.uniform(inset_y, 1 - inset_y)
         )
-        return Particle(x, y, self.food_size)
+        self.id[index] = self.next_id
+        self.next_id += 1
+        self.cell[index] = cell
+        self.cell_item[cell] = index
+        self.count += 1
+
+    def remove(self, index):
+        cell = self.cell[index]
+        self.cell_item[cell] = -1
+        self.swap_free(self.free_slot[cell], self.free_count)
+        self.free_count += 1
+
+        last = self.count - 1
+        if index != last:
+            for values in (self.x, self.y, self.id, self.cell):
+                values[index] = values[last]
+            self.cell_item[self.cell[index]] = index
+        self.count = last
 
-    def draw(self):
-        self.food_particle.draw()
+    def eat(self, x, y, reach):
+        # Remove every item centred within `reach` of (x, y); returns how
+        # many. Items lie inside their cells, so only cells overlapping the
+        # reach can hold one.
+        column0 = max(0, floor((x - reach - self.screen_leftx) / self.cell_width))
+        column1 = min(
+            self.columns - 1, floor((x + reach - self.screen_leftx) / self.cell_width)
+        )
+        row0 = max(0, floor((y - reach - self.screen_topy) / self.cell_height))
+        row1 = min(
+            self.rows - 1, floor((y + reach - self.screen_topy) / self.cell_height)
+        )
+        eaten = 0
+        reach_squared = reach * reach
+        for column in range(column0, column1 + 1):
+            for row in range(row0, row1 + 1):
+                index = self.cell_item[column * self.rows + row]
+                if index < 0:
+                    continue
+                delta_x = self.x[index] - x
+                delta_y = self.y[index] - y
+                if delta_x * delta_x + delta_y * delta_y < reach_squared:
+                    self.remove(index)
+                    eaten += 1
+        return eaten
+
+    def visible(self, min_x, max_x, min_y, max_y):
+        # Indices of the items inside a rectangle, found from the cells it
+        # covers, so the cost follows the rectangle's area and not the
+        # field's
+        column0 = max(0, floor((min_x - self.screen_leftx) / self.cell_width))
+        column1 = min(
+            self.columns - 1, floor((max_x - self.screen_leftx) / self.cell_width)
+        )
+        row0 = max(0, floor((min_y - self.screen_topy) / self.cell_height))
+        row1 = min(self.rows - 1, floor((max_y - self.screen_topy) / self.cell_height))
+        grid = self.cell_item.reshape(self.columns, self.rows)
+        items = grid[column0 : column1 + 1, row0 : row1 + 1]
+        return items[items >= 0]
 
-    def reset(self):
-        # Respawn the food at a new location
-        self.food_particle = self.spawn_food()
+    def refill(self, bodies=()):
+        # Top the field back up to its target count
+        if self.count < self.target_count:
+            self.spawn(self.target_count - self.count, bodies)
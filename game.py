@@ -1,11 +1,26 @@
-import glfw
-from OpenGL.GL import *
-from OpenGL.GLU import *
+import random
+import time
+
+from clock import SimulationClock
+from collision import CollisionWorld
+from collision import particle_arrays
 from snake import Snake
-from food import Food
+from snapshot import VersionedRandom
+from snapshot import restore_snapshot
+from snapshot import take_snapshot
+from food import FoodField
+from inputqueue import InputLatency
+from inputqueue import InputQueue
 from enemy import EnemyManager
+from swarm import EnemySwarm
+from profiler import OVERLAY_REFRESH
+from profiler import FrameProfiler
 from projectile import ProjectileManager
 from stats import game_stats
+from utils import VIEW_SIZE
+from utils import Camera
+from utils import Viewport
+from utils import world_bounds
 from math import floor as floor
 
 
@@ -18,19 +33,63 @@ class Game:
         screen_rightx=5,
         screen_topy=-5,
         screen_bottomy=5,
+        headless=False,
+        stats=None,
+        seed=None,
+        clock=None,
+        time_scale=1.0,
+        profiler=None,
+        food_count=1,
+        world_size=None,
+        view_size=VIEW_SIZE,
+        swarm=0,
     ):
+        # A world_size replaces the screen bounds with a square world of that
+        # side around the origin; the camera shows view_size of it at a time
+        if world_size is not None:
+            screen_leftx, screen_rightx, screen_topy, screen_bottomy = world_bounds(
+                world_size
+            )
         self.width = width
         self.height = height
         self.window = None
+        self.renderer = None
+        self.headless = headless
+        self.stats = game_stats if stats is None else stats
+        # Every game gets a concrete seed, so any session can be recorded
+        self.seed = random.randrange(1 << 63) if seed is None else seed
+        self.rng = VersionedRandom(self.seed)
+        self.clock = SimulationClock() if clock is None else clock
+        self.time_scale = time_scale
+        self.max_frame_time = 0.25
+        self.recorder = None
+        self.playback = None
+        self.run_store = None
+        self.run_recorder = None
+        self.profiler = FrameProfiler(enabled=False) if profiler is None else profiler
+        self.input_queue = InputQueue()
+        self.input_latency = InputLatency()
+        self.collision_world = CollisionWorld()
         self.leftx = screen_leftx
         self.rightx = screen_rightx
         self.topy = screen_topy
         self.bottomy = screen_bottomy
+        self.viewport = Viewport(
+            self.leftx, self.rightx, self.topy, self.bottomy, self.width, self.height
+        )
+        self.camera = Camera(
+            self.viewport, self.leftx, self.rightx, self.topy, self.bottomy, view_size
+        )
+        # A swarm size replaces the EnemyManager with an EnemySwarm of up to
+        # that many ships, and makes room for their bullets
+        self.swarm = swarm
         self.projectile_manager = ProjectileManager(
             screen_leftx=self.leftx,
             screen_rightx=self.rightx,
             screen_topy=self.topy,
             screen_bottomy=self.bottomy,
+            stats=self.stats,
+            capacity=max(1024, 4 * swarm),
         )
         self.snake = Snake(
             projectile_manager=self.projectile_manager,
@@ -39,48 +98,127 @@ class Game:
             screen_rightx=self.rightx,
             screen_topy=self.topy,
             screen_bottomy=self.bottomy,
+            clock=self.clock,
         )
-        self.food = Food(
-            screen_leftx=self.leftx,
-            screen_rightx=self.rightx,
-            screen_topy=self.topy,
-            screen_bottomy=self.bottomy,
-        )
-        self.enemy_manager = EnemyManager(
+        self.food = FoodField(
             screen_leftx=self.leftx,
             screen_rightx=self.rightx,
             screen_topy=self.topy,
             screen_bottomy=self.bottomy,
-            projectile_manager=self.projectile_manager,
+            count=food_count,
+            rng=self.rng,
         )
-        self.initialize_game()
+        self.food.refill([particle_arrays(self.snake.particles)])
+        if swarm:
+            self.enemy_manager = EnemySwarm(
+                screen_leftx=self.leftx,
+                screen_rightx=self.rightx,
+                screen_topy=self.topy,
+                screen_bottomy=self.bottomy,
+                projectile_manager=self.projectile_manager,
+                max_enemies=swarm,
+                stats=self.stats,
+                clock=self.clock,
+                rng=self.rng,
+            )
+        else:
+            self.enemy_manager = EnemyManager(
+                screen_leftx=self.leftx,
+                screen_rightx=self.rightx,
+                screen_topy=self.topy,
+                screen_bottomy=self.bottomy,
+                projectile_manager=self.projectile_manager,
+                stats=self.stats,
+                clock=self.clock,
+                rng=self.rng,
+            )
+        if self.headless:
+            self.stats.start_timer(self.clock)
+        else:
+            self.initialize_game()
+
+    @property
+    def tick(self):
+        return self.clock.tick
 
     def key_callback(self, window, key, scancode, action, mods):
+        import glfw
+
         if action == glfw.PRESS:
             if key == glfw.KEY_ESCAPE:
                 glfw.set_window_should_close(window, True)
             elif key == glfw.KEY_W or key == glfw.KEY_UP:
-                self.snake.move("up")
+                self.input_queue.push(("move", "up"))
             elif key == glfw.KEY_S or key == glfw.KEY_DOWN:
-                self.snake.move("down")
+                self.input_queue.push(("move", "down"))
             elif key == glfw.KEY_A or key == glfw.KEY_LEFT:
-                self.snake.move("left")
+                self.input_queue.push(("move", "left"))
             elif key == glfw.KEY_D or key == glfw.KEY_RIGHT:
-                self.snake.move("right")
+                self.input_queue.push(("move", "right"))
 
     def mouse_button_callback(self, window, button, action, mods):
+        import glfw
+
         screen_x, screen_y = glfw.get_cursor_pos(window)
         game_x, game_y = self.convert_screen_to_game_coordinates(screen_x, screen_y)
 
         if button == glfw.MOUSE_BUTTON_LEFT and action == glfw.PRESS:
-            self.snake.shoot(game_x, game_y)
+            self.input_queue.push(("shoot", game_x, game_y))
+
+    def handle_input(self, action):
+        # Player input takes effect before the next tick. While a recording
+        # plays back, its inputs are the only ones applied.
+        if self.playback is not None:
+            return
+        if self.recorder is not None:
+            self.recorder.record_action(self.tick, action)
+        self.apply_action(action)
+
+    def apply_action(self, action):
+        # Actions are ("move", direction) or ("shoot", game_x, game_y) tuples
+        if action[0] == "move":
+            self.snake.move(action[1])
+        elif action[0] == "shoot":
+            if self.snake.shoot(action[1], action[2]):
+                self.stats.record_shot()
+        else:
+            raise ValueError("Unknown action: " + str(action[0]))
+
+    def start_recording(self, path):
+        # Stream the seed, every input and a per-tick state hash to `path`,
+        # for replay.py to play back
+        from replay import InputRecorder
+
+        if self.tick != 0:
+            raise RuntimeError("Recording must start before the first tick")
+        self.recorder = InputRecorder(
+            path,
+            self.seed,
+            self.clock.time_delta,
+            self.food.target_count,
+            (self.leftx, self.rightx, self.topy, self.bottomy),
+            self.swarm,
+        )
+
+    def start_run_stats(self, store, label=""):
+        # Sample this run's stats as it plays and queue them into `store`, a
+        # RunStore, when the game terminates
+        from runstore import RunRecorder
+
+        self.run_store = store
+        self.run_recorder = RunRecorder(label, self.seed)
 
     def convert_screen_to_game_coordinates(self, screen_x, screen_y):
-        game_x = (screen_x / self.width) * (self.rightx - self.leftx) + self.leftx
-        game_y = (screen_y / self.height) * (self.bottomy - self.topy) + self.topy
+        # Through the camera's current view of the world
+        view = self.viewport
+        game_x = (screen_x / self.width) * (view.rightx - view.leftx) + view.leftx
+        game_y = (screen_y / self.height) * (view.bottomy - view.topy) + view.topy
         return game_x, game_y
 
     def initialize_game(self):
+        import glfw
+        from renderer import BatchRenderer
+
         # Initialize GLFW and other settings
         if not glfw.init():
             raise Exception("GLFW can't be initialized")
@@ -102,66 +240,186 @@ class Game:
         # Make the window's context current
         glfw.make_context_current(self.window)
 
-        game_stats.start_timer()
+        self.stats.start_timer(self.clock)
+
+        self.camera.apply()
 
-        gluOrtho2D(self.leftx, self.rightx, self.bottomy, self.topy)
+        # Vertex buffers need the window's context to exist
+        self.renderer = BatchRenderer(self.viewport)
 
     def check_collisions(self):
-        # Check for food collision
-        if self.snake.check_food_collision(self.food.get_position):
-            self.snake.grow()
-            self.food.reset()
+        world = self.collision_world
+        self.enemy_manager.index(world)
+
+        # Check for food collision; eaten food respawns clear of every body
+        head = self.snake.getHead
+        eaten = self.food.eat(head.x, head.y, head.r + self.snake.particle_radii)
+        if eaten:
+            for _ in range(eaten):
+                self.snake.grow()
+            self.food.refill(world.bodies("snake", "enemies"))
 
         # Check projectile collision
-        self.projectile_manager.check_collisions(self.snake, self.enemy_manager)
+        self.projectile_manager.check_collisions(self.snake, self.enemy_manager, world)
 
     def update(self):
+        # Inputs of the session being played back, as recorded for this tick
+        if self.playback is not None:
+            for action in self.playback.actions_at(self.tick):
+                self.apply_action(action)
+
+        # Window inputs queued since the last tick, applied in arrival order
+        if self.input_queue:
+            now = time.perf_counter()
+            for timestamp, action in self.input_queue.drain():
+                self.handle_input(action)
+                if self.playback is None:
+                    self.input_latency.applied(timestamp, now)
+
+        # Advance the simulation clock by one fixed tick
+        self.clock.advance()
+
         # Update game time
-        game_stats.update_time()
+        self.stats.update_time()
 
-        # Update the snake's position
-        self.snake.update()
+        profiler = self.profiler
 
-        self.projectile_manager.update_projectiles()
+        # Update the snake's position and index its segments for this tick
+        with profiler.phase("update.snake"):
+            self.snake.update()
+            self.collision_world.index_snake(self.snake)
+
+        with profiler.phase("update.projectiles"):
+            self.projectile_manager.update_projectiles()
 
         # Enemy Track Snake
-        self.enemy_manager.update(self.snake)
+        with profiler.phase("update.enemies"):
+            self.enemy_manager.update(self.snake, self.collision_world)
 
         # Check for collisions
-        self.check_collisions()
-
-    def run(self):
-        # Main game loop
-        while not glfw.window_should_close(self.window) and not self.snake.deadFlag:
-            # Render the game elements
-            self.render()
+        with profiler.phase("update.collisions"):
+            self.check_collisions()
+
+        # Hash the resulting state into the recording, or against it
+        if self.recorder is not None:
+            self.recorder.record_tick(self)
+        if self.playback is not None:
+            self.playback.check(self)
+        if self.run_recorder is not None:
+            self.run_recorder.observe(self)
+
+    def snapshot(self, into=None):
+        # Simulation state only, for search agents to fork the game cheaply;
+        # pass an earlier snapshot as `into` to reuse its buffers
+        return take_snapshot(self, into)
+
+    def restore(self, snapshot):
+        restore_snapshot(self, snapshot)
+
+    def step(self, actions=()):
+        # Advance the simulation by one tick without touching GLFW or OpenGL.
+        # Actions are ("move", direction) or ("shoot", game_x, game_y) tuples.
+        with self.profiler.frame():
+            for action in actions:
+                self.handle_input(action)
+
+            with self.profiler.phase("update"):
+                self.update()
+        return self.snake.deadFlag
+
+    def run(self, poll_first=True):
+        import glfw
+
+        if self.headless:
+            raise RuntimeError("A headless game is advanced with step()")
+
+        # Main game loop. Host time only decides how many fixed ticks are due;
+        # the simulation itself advances in whole ticks of the game clock.
+        # Events are polled before the ticks, so inputs reach the first tick
+        # of the same frame; poll_first=False polls after the swap instead,
+        # to measure the difference.
+        profiler = self.profiler
+        accumulator = 0.0
+        previous_time = time.perf_counter()
+        while not glfw.window_should_close(self.window) and not self.finished:
+            with profiler.frame():
+                if poll_first:
+                    with profiler.phase("poll_events"):
+                        glfw.poll_events()
+
+                # Update the game elements
+                current_time = time.perf_counter()
+                frame_time = min(current_time - previous_time, self.max_frame_time)
+                previous_time = current_time
+                accumulator += frame_time * self.time_scale
+                while accumulator >= self.clock.time_delta and not self.finished:
+                    with profiler.phase("update"):
+                        self.update()
+                    accumulator -= self.clock.time_delta
+
+                # Render the game elements between the last two ticks. Frames
+                # never advance the simulation, so a faster display only adds
+                # interpolated frames.
+                with profiler.phase("render"):
+                    self.render(min(accumulator / self.clock.time_delta, 1.0))
+
+                # Swap front and back buffers
+                with profiler.phase("swap_buffers"):
+                    glfw.swap_buffers(self.window)
+                self.input_latency.swapped(time.perf_counter())
+
+                # Poll for and process events
+                if not poll_first:
+                    with profiler.phase("poll_events"):
+                        glfw.poll_events()
+
+            if profiler.overlay and profiler.frame_count % OVERLAY_REFRESH == 0:
+                glfw.set_window_title(
+                    self.window, "Serpent's Challenge - " + profiler.title()
+                )
 
-            # Update the game elements
-            self.update()
+        self.terminate()
 
-            # Swap front and back buffers
-            glfw.swap_buffers(self.window)
+    @property
+    def finished(self):
+        # The snake died, or the session being played back has ended
+        if self.playback is not None and self.playback.finished(self.tick):
+            return True
+        return self.snake.deadFlag
 
-            # Poll for and process events
-            glfw.poll_events()
+    def render(self, alpha=1.0):
+        # `alpha` is how far the frame lies between the previous tick and the
+        # current one
+        from OpenGL.GL import GL_COLOR_BUFFER_BIT, glClear, glFlush
 
-        self.terminate()
+        # Keep the head in view; everything below draws only what the
+        # camera shows
+        head = self.snake.getHead
+        self.camera.follow(head.x, head.y)
+        self.camera.apply()
 
-    def render(self):
         # Clear the screen
         glClear(GL_COLOR_BUFFER_BIT)
 
-        # Draw the snake
-        self.snake.draw()
-
-        # Draw the food
-        self.food.draw()
-
-        # Draw the enemy
-        self.enemy_manager.draw_enemies()
+        profiler = self.profiler
 
-        # Draw the projectiles
-        self.projectile_manager.draw_projectiles()
+        # Draw the snake
+        with profiler.phase("render.snake"):
+            self.snake.draw(self.viewport, alpha)
+
+        # Draw the food, enemies and projectiles, one batched call per type
+        with profiler.phase("render.food"):
+            self.renderer.draw_food(self.food)
+        with profiler.phase("render.enemies"):
+            if self.swarm:
+                self.renderer.draw_swarm(self.enemy_manager.ships, alpha)
+            else:
+                self.renderer.draw_enemies(self.enemy_manager.enemies, alpha)
+        with profiler.phase("render.projectiles"):
+            self.renderer.draw_projectiles(self.projectile_manager.pool, alpha)
+
+        if profiler.overlay:
+            profiler.draw_overlay(self.viewport)
 
         # Flush OpenGL commands
         glFlush()
@@ -171,12 +429,82 @@ class Game:
         print("Game Over!\n")
         print("Final Stats:")
         print("--------------------")
-        print("Score: " + str(game_stats.get_score))
-        print("Time Alive: " + str(floor(game_stats.get_time * 100) / 100))
-        glfw.terminate()
+        print("Score: " + str(self.stats.get_score))
+        print("Time Alive: " + str(floor(self.stats.get_time * 100) / 100))
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.run_recorder is not None:
+            self.run_store.record_run(self.run_recorder.finish(self))
+            self.run_recorder = None
+        if self.profiler.enabled and self.profiler.history:
+            print("--------------------")
+            print(self.profiler.format_summary())
+            if len(self.input_latency):
+                print(self.input_latency.format_summary())
+        if self.window is not None:
+            import glfw
+
+            glfw.terminate()
 
 
 # Main execution
 if __name__ == "__main__":
-    game = Game()
-    game.run()
+    # Only the command line needs argparse; headless workers import this
+    # module and shouldn't pay for it
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play Serpent's Challenge")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--record", metavar="PATH", help="write an input log")
+    parser.add_argument(
+        "--profile", action="store_true", help="time each frame phase, with overlay"
+    )
+    parser.add_argument(
+        "--poll-last",
+        action="store_true",
+        help="poll events after the buffer swap, as older builds did",
+    )
+    parser.add_argument(
+        "--trace", metavar="PATH", help="write a Chrome trace of the last frames"
+    )
+    parser.add_argument("--food", type=int, default=1, help="food items on the field")
+    parser.add_argument(
+        "--world-size", type=float, default=None, help="side of the square world"
+    )
+    parser.add_argument(
+        "--view-size", type=float, default=VIEW_SIZE, help="side of the view"
+    )
+    parser.add_argument(
+        "--swarm", type=int, default=0, help="fight a swarm of up to N ships"
+    )
+    parser.add_argument(
+        "--stats-db", metavar="PATH", help="add this run's stats to a SQLite file"
+    )
+    parser.add_argument("--label", default="", help="label of the run in --stats-db")
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile or args.trace:
+        profiler = FrameProfiler(overlay=args.profile)
+    game = Game(
+        seed=args.seed,
+        profiler=profiler,
+        food_count=args.food,
+        world_size=args.world_size,
+        view_size=args.view_size,
+        swarm=args.swarm,
+    )
+    if args.record:
+        game.start_recording(args.record)
+    store = None
+    if args.stats_db:
+        from runstore import RunStore
+
+        store = RunStore(args.stats_db)
+        game.start_run_stats(store, args.label)
+    game.run(poll_first=not args.poll_last)
+    if store is not None:
+        store.close()
+    if args.trace:
+        game.profiler.export_chrome_trace(args.trace)
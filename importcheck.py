@@ -0,0 +1,111 @@
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+# Modules headless runs are built from; they must import without graphics
+# libraries and within the budget
+SIMULATION_MODULES = (
+    "clock",
+    "utils",
+    "stats",
+    "collision",
+    "projectile",
+    "snake",
+    "array_physics",
+    "enemy",
+    "swarm",
+    "food",
+    "snapshot",
+    "profiler",
+    "inputqueue",
+    "game",
+    "replay",
+    "controllers",
+    "tournament",
+    "arena",
+    "statestream",
+    "server",
+    "vector_env",
+    "runstore",
+)
+
+# Top-level packages only rendering may load
+GRAPHICS_PACKAGES = ("OpenGL", "glfw", "renderer")
+
+# Milliseconds a fresh interpreter may spend importing any one module,
+# numpy included
+DEFAULT_BUDGET_MS = 250.0
+
+# Runs in a fresh interpreter: import one module, then report how long it
+# took and which graphics packages came with it
+PROBE = """
+import importlib
+import json
+import sys
+import time
+
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start
+graphics = sorted(
+    {name.split(".")[0] for name in sys.modules} & set(sys.argv[2:])
+)
+print(json.dumps({"seconds": elapsed, "graphics": graphics}))
+"""
+
+
+def probe(module, repeats=3):
+    # Best of `repeats` cold imports, each in its own interpreter
+    root = Path(__file__).resolve().parent
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE, module, *GRAPHICS_PACKAGES],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        report = json.loads(result.stdout)
+        if best is None or report["seconds"] < best["seconds"]:
+            best = report
+    return best
+
+
+def check(modules=SIMULATION_MODULES, budget_ms=DEFAULT_BUDGET_MS, repeats=3):
+    # (module, milliseconds, graphics modules loaded, ok) per module
+    results = []
+    for module in modules:
+        report = probe(module, repeats)
+        milliseconds = report["seconds"] * 1000.0
+        ok = milliseconds <= budget_ms and not report["graphics"]
+        results.append((module, milliseconds, report["graphics"], ok))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that simulation modules import fast and without graphics"
+    )
+    parser.add_argument(
+        "modules", nargs="*", default=SIMULATION_MODULES, help="modules to check"
+    )
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    for module, milliseconds, graphics, ok in check(
+        args.modules, args.budget_ms, args.repeats
+    ):
+        failed = failed or not ok
+        print(
+            module.ljust(16)
+            + format(milliseconds, "7.1f")
+            + " ms"
+            + ("" if ok else "  FAIL")
+            + (" (loads " + ", ".join(graphics) + ")" if graphics else "")
+        )
+    sys.exit(1 if failed else 0)
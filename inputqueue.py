@@ -0,0 +1,92 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from profiler import RingBuffer
+
+# Latency measures, in the order they are reported
+LATENCIES = ("input_to_sim", "input_to_swap")
+
+
+class InputQueue:
+    # Window inputs waiting for the next tick, each stamped with the
+    # perf_counter time its callback ran. GLFW runs callbacks from inside
+    # poll_events, so that is the earliest time the game can know of them.
+    def __init__(self):
+        self.pending = deque()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, action, timestamp=None):
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self.pending.append((timestamp, action))
+
+    def drain(self):
+        # (timestamp, action) pairs, oldest first, leaving the queue empty
+        pending = self.pending
+        while pending:
+            yield pending.popleft()
+
+
+class InputLatency:
+    # Seconds from an input being queued to the start of the tick that
+    # applied it, and to the end of the buffer swap that first showed that
+    # tick, for the last `capacity` inputs
+    def __init__(self, capacity=1024):
+        self.history = {name: RingBuffer(capacity) for name in LATENCIES}
+        self.unshown = []
+
+    def __len__(self):
+        return len(self.history["input_to_sim"])
+
+    def applied(self, timestamp, now):
+        self.history["input_to_sim"].append(now - timestamp)
+        self.unshown.append(timestamp)
+
+    def swapped(self, now):
+        # Every frame renders the newest tick, so it shows every input
+        # applied since the previous swap
+        history = self.history["input_to_swap"]
+        for timestamp in self.unshown:
+            history.append(now - timestamp)
+        self.unshown.clear()
+
+    def summary(self):
+        # Milliseconds per measure over the buffered inputs, in the shape of
+        # FrameProfiler.summary
+        summary = {}
+        for name in LATENCIES:
+            history = self.history[name]
+            if not len(history):
+                continue
+            values = history.recent() * 1000.0
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            summary[name] = {
+                "inputs": len(history),
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(values.max()),
+            }
+        return summary
+
+    def format_summary(self):
+        lines = []
+        for name, latency in self.summary().items():
+            lines.append(
+                name.ljust(24)
+                + "p50 "
+                + format(latency["p50"], "7.3f")
+                + " ms  p95 "
+                + format(latency["p95"], "7.3f")
+                + " ms  max "
+                + format(latency["max"], "7.3f")
+                + " ms over "
+                + str(latency["inputs"])
+                + " inputs"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from server import DEFAULT_HOST
+from server import DEFAULT_PORT
+from server import DIRECTIONS
+from server import KIND_FRAME
+from server import KIND_JSON
+from server import MESSAGE_HEADER
+from server import encode
+from statestream import FRAME_HEADER
+from statestream import FRAME_KEYFRAME
+from statestream import StreamDecoder
+
+# Connections opened at once; more can overflow the server's listen backlog
+CONNECT_CONCURRENCY = 64
+
+# Largest line a client accepts; state messages grow with the player count
+READ_LIMIT = 1 << 24
+
+
+class LoadStats:
+    def __init__(self):
+        self.connected = 0
+        self.refused = 0
+        self.failed = 0
+        self.connect_times = []
+        self.messages = 0
+        self.bytes = 0
+        self.expected_messages = 0
+        self.delivered_messages = 0
+        self.decoded_messages = 0
+        self.respawns = 0
+        self.actions = 0
+
+
+async def read_message(reader, binary):
+    # (kind, payload) of the next message after the welcome, None at the end
+    # of the stream
+    try:
+        if not binary:
+            line = await reader.readline()
+            return (KIND_JSON, line) if line else None
+        length, kind = MESSAGE_HEADER.unpack(
+            await reader.readexactly(MESSAGE_HEADER.size)
+        )
+        return kind, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def run_client(stats, connect, duration, rng, sample_every, action_chance):
+    # One headless player: joins, turns and shoots at random, respawns when
+    # dead. Every `sample_every`th state is decoded (and every keyframe of
+    # the binary stream, to follow its deltas); the rest are only counted, so
+    # hundreds of clients fit on the machine running the server.
+    start = time.perf_counter()
+    try:
+        reader, writer = await connect()
+        welcome = json.loads(await reader.readline())
+    except (OSError, ValueError):
+        stats.failed += 1
+        return
+    if welcome.get("type") != "welcome":
+        stats.refused += 1
+        writer.close()
+        return
+    stats.connected += 1
+    stats.connect_times.append(time.perf_counter() - start)
+
+    player_id = welcome["id"]
+    broadcast_every = welcome["broadcast_every"]
+    binary = welcome.get("stream") == "binary"
+    decoder = StreamDecoder()
+    leftx, rightx, topy, bottomy = welcome["bounds"]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    received = 0
+    first_tick = None
+    last_tick = None
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(
+                    read_message(reader, binary), remaining
+                )
+            except asyncio.TimeoutError:
+                break
+            if message is None:
+                break
+            kind, payload = message
+            stats.bytes += len(payload)
+            if kind != KIND_FRAME and not (
+                kind == KIND_JSON and payload.startswith(b'{"type":"state"')
+            ):
+                continue
+            received += 1
+
+            sampled = received % sample_every == 1 or sample_every == 1
+            alive = True
+            if binary:
+                tick = FRAME_HEADER.unpack_from(payload)[1]
+                if sampled or payload[0] & FRAME_KEYFRAME:
+                    acked = decoder.ack
+                    state = decoder.decode(payload)
+                    if decoder.ack != acked:
+                        writer.write(encode({"type": "ack", "tick": decoder.ack}))
+                    players = state.players
+                    alive = bool(np.all(players["alive"][players["id"] == player_id]))
+                    stats.decoded_messages += 1
+            else:
+                tick = None
+                if sampled:
+                    state = json.loads(payload)
+                    tick = state["tick"]
+                    for player in state["players"]:
+                        if player["id"] == player_id:
+                            alive = player["alive"]
+                    stats.decoded_messages += 1
+            if tick is not None:
+                if first_tick is None:
+                    first_tick = tick
+                    first_received = received
+                last_tick = tick
+                last_received = received
+            if not alive:
+                writer.write(encode({"type": "respawn"}))
+                stats.respawns += 1
+
+            if rng.random() < action_chance:
+                writer.write(
+                    encode({"type": "move", "direction": rng.choice(DIRECTIONS)})
+                )
+                stats.actions += 1
+            if rng.random() < action_chance:
+                writer.write(
+                    encode(
+                        {
+                            "type": "shoot",
+                            "x": rng.uniform(leftx, rightx),
+                            "y": rng.uniform(topy, bottomy),
+                        }
+                    )
+                )
+                stats.actions += 1
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+    stats.messages += received
+    if last_tick is not None:
+        # States the server sent between the first and last one seen, against
+        # the ones that arrived
+        stats.expected_messages += (last_tick - first_tick) // broadcast_every + 1
+        stats.delivered_messages += last_received - first_received + 1
+
+
+async def run_load(
+    clients,
+    duration,
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    path=None,
+    seed=0,
+    sample_every=16,
+    action_chance=0.05,
+):
+    stats = LoadStats()
+    gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect():
+        async with gate:
+            if path is None:
+                return await asyncio.open_connection(host, port, limit=READ_LIMIT)
+            return await asyncio.open_unix_connection(path, limit=READ_LIMIT)
+
+    rng = random.Random(seed)
+    await asyncio.gather(
+        *(
+            run_client(
+                stats,
+                connect,
+                duration,
+                random.Random(rng.randrange(1 << 63)),
+                sample_every,
+                action_chance,
+            )
+            for _ in range(clients)
+        )
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test server.py")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="connect to a Unix socket")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--sample-every", type=int, default=16, help="decode every Nth state"
+    )
+    parser.add_argument(
+        "--action-chance",
+        type=float,
+        default=0.05,
+        help="chance of a move and of a shot per state received",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = asyncio.run(
+        run_load(
+            args.clients,
+            args.duration,
+            args.host,
+            args.port,
+            args.unix,
+            args.seed,
+            args.sample_every,
+            args.action_chance,
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    connect_ms = np.array(stats.connect_times) * 1000.0
+    print(
+        str(stats.connected)
+        + " connected, "
+        + str(stats.refused)
+        + " refused, "
+        + str(stats.failed)
+        + " failed"
+    )
+    if stats.connected:
+        p50, p95 = np.percentile(connect_ms, (50, 95))
+        print(
+            "connect p50 "
+            + format(p50, ".1f")
+            + " ms p95 "
+            + format(p95, ".1f")
+            + " ms"
+        )
+    print(
+        str(stats.messages)
+        + " states ("
+        + format(stats.messages / elapsed, ".0f")
+        + "/s, "
+        + format(stats.bytes / elapsed / 1e6, ".2f")
+        + " MB/s), "
+        + str(stats.actions)
+        + " actions, "
+        + str(stats.respawns)
+        + " respawns"
+    )
+    if stats.expected_messages:
+        print(
+            "delivered "
+            + format(100.0 * stats.delivered_messages / stats.expected_messages, ".1f")
+            + "% of the states broadcast while connected"
+        )
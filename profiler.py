@@ -0,0 +1,207 @@
+import json
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+FRAME_PHASE = "frame"
+
+# Overlay layout, in world units from the top left corner of the viewport
+OVERLAY_MARGIN = 0.2
+OVERLAY_ROW_HEIGHT = 0.2
+OVERLAY_BAR_WIDTH = 4.0
+
+# Frames between recomputing the summary the overlay shows
+OVERLAY_REFRESH = 30
+
+# A shared no-op context, so disabled profiling costs next to nothing
+NULL_PHASE = nullcontext()
+
+
+class RingBuffer:
+    # The last `capacity` values pushed, oldest overwritten first
+    def __init__(self, capacity):
+        self.values = np.zeros(capacity)
+        self.count = 0
+        self.index = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        if self.count < len(self.values):
+            self.count += 1
+
+    def recent(self):
+        # Stored values in no particular order
+        return self.values[: self.count]
+
+
+class PhaseTimer:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class FrameProfiler:
+    # Wall time of named phases ("update", "update.snake", "render", ...).
+    # Time spent in a phase is summed over each frame and kept for the last
+    # `capacity` frames; individual phase runs are kept as trace events for
+    # the last `trace_capacity` runs.
+    def __init__(
+        self, capacity=1024, trace_capacity=65536, enabled=True, overlay=False
+    ):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.overlay = overlay
+        self.history = {}
+        self.frame_totals = {}
+        self.events = deque(maxlen=trace_capacity)
+        self.origin = time.perf_counter()
+        self.frame_count = 0
+        self.overlay_summary = {}
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return PhaseTimer(self, name)
+
+    def frame(self):
+        return self.phase(FRAME_PHASE)
+
+    def record(self, name, start, end):
+        duration = end - start
+        self.events.append((name, start, duration))
+        self.frame_totals[name] = self.frame_totals.get(name, 0.0) + duration
+        if name == FRAME_PHASE:
+            self.end_frame()
+
+    def end_frame(self):
+        for name, total in self.frame_totals.items():
+            history = self.history.get(name)
+            if history is None:
+                history = self.history[name] = RingBuffer(self.capacity)
+            history.append(total)
+        self.frame_totals.clear()
+        self.frame_count += 1
+        if self.overlay and self.frame_count % OVERLAY_REFRESH == 0:
+            self.overlay_summary = self.summary()
+
+    def reset(self):
+        self.history.clear()
+        self.frame_totals.clear()
+        self.events.clear()
+        self.origin = time.perf_counter()
+        self.frame_count = 0
+        self.overlay_summary = {}
+
+    def summary(self):
+        # Per-phase milliseconds per frame over the buffered frames
+        summary = {}
+        for name, history in self.history.items():
+            values = history.recent() * 1000.0
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            summary[name] = {
+                "frames": len(history),
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(values.max()),
+            }
+        return summary
+
+    def format_summary(self):
+        lines = []
+        for name, phase in sorted(self.summary().items()):
+            lines.append(
+                name.ljust(24)
+                + "p50 "
+                + format(phase["p50"], "7.3f")
+                + " ms  p95 "
+                + format(phase["p95"], "7.3f")
+                + " ms  p99 "
+                + format(phase["p99"], "7.3f")
+                + " ms"
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        # Complete ("X") events in microseconds; nested phases show up nested
+        # because their spans lie inside their parent's
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "cat": name.split(".")[0],
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": 1,
+                    "tid": 1,
+                }
+                for name, start, duration in self.events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+    def draw_overlay(self, viewport, budget=1 / 60):
+        # One bar per phase, longest at the top, showing its p95 against the
+        # frame budget: green within a quarter of it, yellow within the whole,
+        # red beyond
+        from OpenGL.GL import GL_QUADS, glBegin, glColor3f, glEnd, glVertex2f
+
+        phases = sorted(
+            ((phase["p95"], name) for name, phase in self.overlay_summary.items()),
+            reverse=True,
+        )
+        x = viewport.leftx + OVERLAY_MARGIN
+        y = viewport.topy + OVERLAY_MARGIN
+        budget_ms = budget * 1000.0
+        glBegin(GL_QUADS)
+        for p95, name in phases:
+            share = p95 / budget_ms
+            if share <= 0.25:
+                glColor3f(0.0, 0.8, 0.0)
+            elif share <= 1.0:
+                glColor3f(0.9, 0.8, 0.0)
+            else:
+                glColor3f(0.9, 0.0, 0.0)
+            width = min(share, 1.0) * OVERLAY_BAR_WIDTH
+            glVertex2f(x, y)
+            glVertex2f(x + width, y)
+            glVertex2f(x + width, y + OVERLAY_ROW_HEIGHT * 0.8)
+            glVertex2f(x, y + OVERLAY_ROW_HEIGHT * 0.8)
+            y += OVERLAY_ROW_HEIGHT
+        glEnd()
+
+    def title(self):
+        # p95 of the top-level phases, for the window title next to the overlay
+        summary = self.overlay_summary
+        if FRAME_PHASE not in summary:
+            return ""
+        parts = [
+            name + " " + format(phase["p95"], ".2f")
+            for name, phase in sorted(
+                summary.items(), key=lambda item: item[1]["p95"], reverse=True
+            )
+            if "." not in name
+        ]
+        return "p95 ms: " + ", ".join(parts)
@@ -1,110 +1,310 @@
-from OpenGL.GL import *
 import math
 
+import numpy as np
+
+from collision import CollisionWorld
 from stats import game_stats
 
+# Projectile owners; the owner decides what a projectile can hit
+OWNER_SNAKE = 0
+OWNER_ENEMY = 1
+
+# Shooter of projectiles not fired by a player
+NO_SHOOTER = -1
+
+OWNER_COLORS = {
+    OWNER_SNAKE: (0, 0, 1),
+    OWNER_ENEMY: (1, 0, 0),
+}
+
+
+def kill_score(snake_len):
+    # Points for shooting down a ship; longer snakes earn more
+    if snake_len < 5:
+        return 1
+    elif snake_len < 7:
+        return 2
+    return 3
+
 
 class Projectile:
-    def __init__(self, x, y, vx, vy, size, color, damage):
-        self.x = x
-        self.y = y
-        self.vx = vx
-        self.vy = vy
-        self.size = size
-        self.color = color
-        self.damage = damage
+    # Handle onto one live slot of a ProjectilePool. Slots move when other
+    # projectiles are removed, so handles are only valid until the next
+    # ProjectileManager.check_collisions.
+    __slots__ = ("pool", "index")
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    def _field(name, kind=float):
+        def getter(self):
+            return kind(getattr(self.pool, name)[self.index])
+
+        def setter(self, value):
+            getattr(self.pool, name)[self.index] = value
+
+        return property(getter, setter)
+
+    x = _field("x")
+    y = _field("y")
+    vx = _field("vx")
+    vy = _field("vy")
+    size = _field("size")
+    damage = _field("damage", int)
+    owner = _field("owner", int)
+    shooter = _field("shooter", int)
+
+    del _field
+
+    @property
+    def color(self):
+        return OWNER_COLORS[self.owner]
 
     def update(self):
         self.x += self.vx
         self.y += self.vy
 
-    def draw(self):
-        glColor3f(*self.color)
-        glBegin(GL_TRIANGLES)
-        glVertex2f(self.x - self.size, self.y - self.size)
-        glVertex2f(self.x + self.size, self.y - self.size)
-        glVertex2f(self.x, self.y + self.size)
-        glEnd()
+
+class ProjectilePool:
+    # Fixed-capacity structure of arrays. Live projectiles are packed into
+    # the first `count` slots; removal swaps the last live slot into the hole.
+    fields = (
+        "x",
+        "y",
+        "prev_x",
+        "prev_y",
+        "vx",
+        "vy",
+        "size",
+        "damage",
+        "owner",
+        "shooter",
+        "id",
+    )
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.count = 0
+        self.high_water_mark = 0
+        self.dropped = 0
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.vx = np.zeros(capacity)
+        self.vy = np.zeros(capacity)
+        self.size = np.zeros(capacity)
+        self.damage = np.zeros(capacity, dtype=np.intp)
+        self.owner = np.zeros(capacity, dtype=np.int8)
+        self.shooter = np.full(capacity, NO_SHOOTER, dtype=np.int32)
+        # Ids stay with a projectile when removals move it to another slot
+        self.id = np.zeros(capacity, dtype=np.uint64)
+        self.next_id = 1
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, x, y, vx, vy, size, damage, owner, shooter=NO_SHOOTER):
+        # Returns the new slot, or -1 when the pool is full and the shot is
+        # dropped
+        if self.count == self.capacity:
+            self.dropped += 1
+            return -1
+        index = self.count
+        self.x[index] = x
+        self.y[index] = y
+        self.prev_x[index] = x
+        self.prev_y[index] = y
+        self.vx[index] = vx
+        self.vy[index] = vy
+        self.size[index] = size
+        self.damage[index] = damage
+        self.owner[index] = owner
+        self.shooter[index] = shooter
+        self.id[index] = self.next_id
+        self.next_id += 1
+        self.count += 1
+        if self.count > self.high_water_mark:
+            self.high_water_mark = self.count
+        return index
+
+    def spawn_many(self, x, y, vx, vy, size, damage, owner, shooter=NO_SHOOTER):
+        # spawn for arrays of projectiles; those past the capacity are
+        # dropped. Returns how many were spawned.
+        start = self.count
+        wanted = len(x)
+        spawned = min(wanted, self.capacity - start)
+        self.dropped += wanted - spawned
+        end = start + spawned
+        self.x[start:end] = x[:spawned]
+        self.y[start:end] = y[:spawned]
+        self.prev_x[start:end] = x[:spawned]
+        self.prev_y[start:end] = y[:spawned]
+        self.vx[start:end] = vx[:spawned]
+        self.vy[start:end] = vy[:spawned]
+        self.size[start:end] = size
+        self.damage[start:end] = damage
+        self.owner[start:end] = owner
+        self.shooter[start:end] = shooter
+        self.id[start:end] = np.arange(self.next_id, self.next_id + spawned)
+        self.next_id += spawned
+        self.count = end
+        if end > self.high_water_mark:
+            self.high_water_mark = end
+        return spawned
+
+    def remove(self, index):
+        last = self.count - 1
+        if index != last:
+            for name in self.fields:
+                values = getattr(self, name)
+                values[index] = values[last]
+        self.count = last
+
+    def remove_many(self, removed):
+        # Swap-remove every slot flagged in the boolean mask `removed` (length
+        # `count`): live slots past the new end fill the holes before it
+        count = self.count
+        remaining = count - int(np.count_nonzero(removed))
+        if remaining == count:
+            return
+        holes = np.flatnonzero(removed[:remaining])
+        fillers = remaining + np.flatnonzero(~removed[remaining:count])
+        if len(holes):
+            for name in self.fields:
+                values = getattr(self, name)
+                values[holes] = values[fillers]
+        self.count = remaining
+
+    def clear(self):
+        self.count = 0
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "occupancy": self.count / self.capacity,
+            "high_water_mark": self.high_water_mark,
+            "dropped": self.dropped,
+        }
 
 
 class ProjectileManager:
-    def __init__(self, screen_leftx, screen_rightx, screen_topy, screen_bottomy):
-        self.projectiles = []
+    def __init__(
+        self,
+        screen_leftx,
+        screen_rightx,
+        screen_topy,
+        screen_bottomy,
+        stats=game_stats,
+        capacity=1024,
+    ):
+        self.pool = ProjectilePool(capacity)
+        self.stats = stats
         self.screen_leftx = screen_leftx
         self.screen_rightx = screen_rightx
         self.screen_topy = screen_topy
         self.screen_bottomy = screen_bottomy
 
-    def fire(self, x, y, angle, speed, size, color, damage):
+    @property
+    def projectiles(self):
+        return [Projectile(self.pool, index) for index in range(self.pool.count)]
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def fire(self, x, y, angle, speed, size, damage, owner, shooter=NO_SHOOTER):
         vx = math.cos(angle) * speed
         vy = math.sin(angle) * speed
-        projectile = Projectile(x, y, vx, vy, size, color, damage)
-        self.projectiles.append(projectile)
+        self.pool.spawn(x, y, vx, vy, size, damage, owner, shooter)
+
+    def fire_many(self, x, y, angle, speed, size, damage, owner, shooter=NO_SHOOTER):
+        # fire for arrays of positions and angles
+        self.pool.spawn_many(
+            x,
+            y,
+            np.cos(angle) * speed,
+            np.sin(angle) * speed,
+            size,
+            damage,
+            owner,
+            shooter,
+        )
 
     def update_projectiles(self):
-        for projectile in self.projectiles:
-            projectile.update()
-
-    def draw_projectiles(self):
-        for projectile in self.projectiles:
-            projectile.draw()
-
-    def check_collisions(self, snake, enemy_manager):
-        remaining_projectiles = []
-        for projectile in self.projectiles:
-            # Check collision with world borders
-            if not (
-                self.screen_leftx <= projectile.x <= self.screen_rightx
-                and self.screen_topy <= projectile.y <= self.screen_bottomy
-            ):
-                continue  # Skip projectiles that are outside the world borders
-
-            # Check collision with the snake
-            if self.is_colliding_with_snake(projectile, snake) and projectile.color == (
-                1,
-                0,
-                0,
-            ):
-                snake.shrink(projectile.damage)
-                continue  # Skip projectiles that collided with the snake
-
-            # Check collision with enemies
-            collided_with_enemy = False
-            for enemy in enemy_manager.enemies:
-                if self.is_colliding_with_enemy(projectile, enemy):
-                    if projectile.color == (0, 0, 1):  # Blue projectile
-                        enemy_manager.destroy_enemy(enemy)  # Remove the enemy
-                        snake_len = snake.getSize
-                        if snake_len < 5:
-                            game_stats.add_score(1)
-                        elif snake_len < 7:
-                            game_stats.add_score(2)
-                        else:
-                            game_stats.add_score(3)
-
-                    collided_with_enemy = True
-                    break
-
-            if not collided_with_enemy and projectile.color == (0, 0, 1):
-                remaining_projectiles.append(projectile)
-            elif projectile.color == (1, 0, 0):
-                remaining_projectiles.append(projectile)
-
-        self.projectiles = remaining_projectiles
-
-    def is_colliding_with_snake(self, projectile, snake):
-        for segment in snake.particles:
-            distance = math.sqrt(
-                (segment.x - projectile.x) ** 2 + (segment.y - projectile.y) ** 2
-            )
-            if distance < (segment.r + projectile.size):
-                return True
-        return False
+        pool = self.pool
+        n = pool.count
+        pool.prev_x[:n] = pool.x[:n]
+        pool.prev_y[:n] = pool.y[:n]
+        pool.x[:n] += pool.vx[:n]
+        pool.y[:n] += pool.vy[:n]
 
-    def is_colliding_with_enemy(self, projectile, enemy):
-        distance = math.sqrt(
-            (enemy.x - projectile.x) ** 2 + (enemy.y - projectile.y) ** 2
+    def check_collisions(self, snake, enemy_manager, world=None):
+        # Hits are swept from each projectile's previous position, against
+        # bodies indexed in `world` this tick (indexed here when not given)
+        if world is None:
+            world = CollisionWorld()
+            world.index_snake(snake)
+            enemy_manager.index(world)
+
+        pool = self.pool
+        n = pool.count
+        if n == 0:
+            return
+        x = pool.x[:n]
+        y = pool.y[:n]
+        size = pool.size[:n]
+        owner = pool.owner[:n]
+
+        # Check collision with world borders
+        removed = ~(
+            (self.screen_leftx <= x)
+            & (x <= self.screen_rightx)
+            & (self.screen_topy <= y)
+            & (y <= self.screen_bottomy)
         )
-        if distance < (enemy.size + projectile.size):
-            return True
-        return False
+
+        # Check collision with the snake, for enemy projectiles only. Damage
+        # pops tail segments, so a hit only counts while the first segment it
+        # touched is still attached.
+        shooters = np.flatnonzero(~removed & (owner == OWNER_ENEMY))
+        if len(shooters):
+            first_segment = world.sweeps(
+                "snake",
+                pool.prev_x[shooters],
+                pool.prev_y[shooters],
+                x[shooters],
+                y[shooters],
+                size[shooters],
+            )
+            for index, segment in zip(shooters, first_segment):
+                if 0 <= segment < snake.getSize:
+                    snake.shrink(int(pool.damage[index]))
+                    removed[index] = True
+
+        # Check collision with enemies, for snake projectiles only; enemy
+        # projectiles pass through their own ships
+        shooters = np.flatnonzero(~removed & (owner == OWNER_SNAKE))
+        enemies = world.layers.get("enemies")
+        if len(shooters) and enemies is not None:
+            query, body = world.sweep_pairs(
+                "enemies",
+                pool.prev_x[shooters],
+                pool.prev_y[shooters],
+                x[shooters],
+                y[shooters],
+                size[shooters],
+            )
+
+            # Each projectile destroys the first ship it touches that an
+            # earlier projectile hasn't already destroyed this tick
+            for query_index, body_index in zip(query, body):
+                index = shooters[query_index]
+                enemy = enemies.items[body_index]
+                if removed[index] or not enemy_manager.destroy_enemy(enemy):
+                    continue
+                self.stats.record_kill(kill_score(snake.getSize))
+                removed[index] = True
+
+        pool.remove_many(removed)
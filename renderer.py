@@ -0,0 +1,226 @@
+import ctypes
+from array import array
+from math import cos as cos
+from math import sin as sin
+
+import numpy as np
+from OpenGL.GL import (
+    GL_ARRAY_BUFFER,
+    GL_COLOR_ARRAY,
+    GL_FLOAT,
+    GL_STREAM_DRAW,
+    GL_TRIANGLES,
+    GL_VERTEX_ARRAY,
+    glBindBuffer,
+    glBufferData,
+    glColorPointer,
+    glDisableClientState,
+    glDrawArrays,
+    glEnableClientState,
+    glGenBuffers,
+    glVertexPointer,
+)
+
+from projectile import OWNER_COLORS
+from swarm import swarm_angle
+from utils import DEFAULT_CIRCLE_SEGMENTS
+from utils import unit_circle
+
+# Interleaved vertex layout: x, y, r, g, b as 32-bit floats
+FLOATS_PER_VERTEX = 5
+VERTEX_STRIDE = FLOATS_PER_VERTEX * 4
+COLOR_OFFSET = 2 * 4
+
+FOOD_COLOR = (1.0, 1.0, 1.0)
+ENEMY_COLOR = (1.0, 0.0, 0.0)
+
+# Ship triangle in model space, tip along +y, scaled by the ship size and
+# turned by its facing
+SHIP_VERTICES = ((-0.5, -0.5), (0.5, -0.5), (0.0, 0.5))
+
+
+class VertexBatch:
+    # One vertex buffer object refilled each frame and drawn with a single
+    # glDrawArrays call
+    def __init__(self):
+        self.data = array("f")
+        self.vbo = None
+
+    def clear(self):
+        del self.data[:]
+
+    @property
+    def vertex_count(self):
+        return len(self.data) // FLOATS_PER_VERTEX
+
+    def add_triangle(self, x1, y1, x2, y2, x3, y3, color):
+        r, g, b = color
+        self.data.extend((x1, y1, r, g, b, x2, y2, r, g, b, x3, y3, r, g, b))
+
+    def draw(self):
+        self.draw_vertices(self.data.tobytes(), self.vertex_count)
+
+    def draw_vertices(self, data, count):
+        # Upload `count` interleaved vertices packed in `data` and draw them
+        if count == 0:
+            return
+        if self.vbo is None:
+            self.vbo = glGenBuffers(1)
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, len(data), data, GL_STREAM_DRAW)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(2, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glColorPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(COLOR_OFFSET))
+        glDrawArrays(GL_TRIANGLES, 0, count)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
+class BatchRenderer:
+    # Gathers every entity of a type into one vertex buffer per frame, so
+    # food, enemies and projectiles each cost one draw call
+    def __init__(self, viewport=None):
+        self.viewport = viewport
+        self.food_batch = VertexBatch()
+        self.enemy_batch = VertexBatch()
+        self.projectile_batch = VertexBatch()
+
+        # Color lookup table indexed by projectile owner
+        self.owner_colors = np.zeros((max(OWNER_COLORS) + 1, 3), dtype=np.float32)
+        for owner, color in OWNER_COLORS.items():
+            self.owner_colors[owner] = color
+
+    def draw_food(self, food):
+        # Every visible item of a FoodField as a fan of the same segment
+        # count, built from its position arrays. The field's grid finds the
+        # items on screen without looking at the rest.
+        radius = food.food_size
+        viewport = self.viewport
+        if viewport is None:
+            segments = DEFAULT_CIRCLE_SEGMENTS
+            x, y = food.positions()
+        else:
+            segments = viewport.circle_segments(radius)
+            visible = food.visible(
+                min(viewport.leftx, viewport.rightx) - radius,
+                max(viewport.leftx, viewport.rightx) + radius,
+                min(viewport.topy, viewport.bottomy) - radius,
+                max(viewport.topy, viewport.bottomy) + radius,
+            )
+            x = food.x[visible]
+            y = food.y[visible]
+        n = len(x)
+        if n == 0:
+            return
+
+        # Centre, rim point and next rim point of each triangle of the fan
+        rim = np.array(unit_circle(segments), dtype=np.float32) * radius
+        fan = np.zeros((segments, 3, 2), dtype=np.float32)
+        fan[:, 1] = rim[:-1]
+        fan[:, 2] = rim[1:]
+        vertices = np.empty((n, segments, 3, FLOATS_PER_VERTEX), dtype=np.float32)
+        vertices[..., 0] = x[:, None, None] + fan[None, :, :, 0]
+        vertices[..., 1] = y[:, None, None] + fan[None, :, :, 1]
+        vertices[..., 2:] = FOOD_COLOR
+
+        self.food_batch.draw_vertices(vertices.tobytes(), 3 * segments * n)
+
+    def draw_enemies(self, enemies, alpha=1.0):
+        batch = self.enemy_batch
+        batch.clear()
+        for enemy in enemies:
+            self.add_enemy(batch, enemy, alpha)
+        batch.draw()
+
+    def draw_swarm(self, ships, alpha=1.0):
+        # Every ship of an EnemySwarm's ShipPool in one draw call: the ship
+        # triangle is turned and placed per ship with array operations,
+        # standing in for instancing on the fixed-function pipeline
+        n = ships.count
+        if n == 0:
+            return
+        prev_x = ships.prev_x[:n]
+        prev_y = ships.prev_y[:n]
+        x = prev_x + (ships.x[:n] - prev_x) * alpha
+        y = prev_y + (ships.y[:n] - prev_y) * alpha
+        angle = swarm_angle(
+            ships.prev_angle[:n], ships.angle[:n], ships.in_position[:n], alpha
+        )
+        size = ships.size
+        if self.viewport is not None:
+            visible = self.viewport.visible_mask(x, y, size)
+            x = x[visible]
+            y = y[visible]
+            angle = angle[visible]
+            n = len(x)
+            if n == 0:
+                return
+
+        model = np.array(SHIP_VERTICES) * size
+        cos_angle = np.cos(angle)[:, None]
+        sin_angle = np.sin(angle)[:, None]
+        vertices = np.empty((n, 3, FLOATS_PER_VERTEX), dtype=np.float32)
+        vertices[..., 0] = (
+            x[:, None] + model[:, 0] * cos_angle - model[:, 1] * sin_angle
+        )
+        vertices[..., 1] = (
+            y[:, None] + model[:, 0] * sin_angle + model[:, 1] * cos_angle
+        )
+        vertices[..., 2:] = ENEMY_COLOR
+
+        self.enemy_batch.draw_vertices(vertices.tobytes(), 3 * n)
+
+    def draw_projectiles(self, pool, alpha=1.0):
+        # Vertices come straight from the pool arrays, one triangle per slot,
+        # placed `alpha` of the way from the previous tick's positions
+        n = pool.count
+        if n == 0:
+            return
+        prev_x = pool.prev_x[:n]
+        prev_y = pool.prev_y[:n]
+        x = prev_x + (pool.x[:n] - prev_x) * alpha
+        y = prev_y + (pool.y[:n] - prev_y) * alpha
+        size = pool.size[:n]
+        owner = pool.owner[:n]
+        if self.viewport is not None:
+            visible = self.viewport.visible_mask(x, y, size)
+            x = x[visible]
+            y = y[visible]
+            size = size[visible]
+            owner = owner[visible]
+            n = len(x)
+            if n == 0:
+                return
+
+        vertices = np.empty((n, 3, FLOATS_PER_VERTEX), dtype=np.float32)
+        vertices[:, 0, 0] = x - size
+        vertices[:, 0, 1] = y - size
+        vertices[:, 1, 0] = x + size
+        vertices[:, 1, 1] = y - size
+        vertices[:, 2, 0] = x
+        vertices[:, 2, 1] = y + size
+        vertices[:, :, 2:] = self.owner_colors[owner][:, None, :]
+
+        self.projectile_batch.draw_vertices(vertices.tobytes(), 3 * n)
+
+    def add_enemy(self, batch, enemy, alpha=1.0):
+        # Approaching ships fly unrotated from their entry point; ships in
+        # position are turned towards their target
+        size = enemy.size
+        x, y, angle = enemy.interpolate(alpha)
+        if self.viewport is not None and not self.viewport.is_visible(x, y, size):
+            return
+        cos_angle, sin_angle = cos(angle), sin(angle)
+
+        corners = []
+        for vx, vy in SHIP_VERTICES:
+            vx *= size
+            vy *= size
+            corners.append(x + vx * cos_angle - vy * sin_angle)
+            corners.append(y + vx * sin_angle + vy * cos_angle)
+        batch.add_triangle(*corners, ENEMY_COLOR)
@@ -0,0 +1,264 @@
+import hashlib
+import struct
+import time
+
+import numpy as np
+
+from clock import SimulationClock
+from collision import particle_arrays
+from stats import GameStats
+
+# Log layout: a header, then a stream of records that each start with their
+# kind. Inputs carry the tick they were applied before and the host time in
+# seconds since recording started; every simulated tick appends the hash of
+# the state it produced, so tick records are numbered by their position.
+LOG_MAGIC = b"SRPL"
+LOG_VERSION = 5
+HEADER = struct.Struct("<4sBqdI4dI")
+
+RECORD_MOVE = 0
+RECORD_SHOOT = 1
+RECORD_TICK = 2
+RECORDS = {
+    RECORD_MOVE: struct.Struct("<BIfB"),
+    RECORD_SHOOT: struct.Struct("<BIfdd"),
+    RECORD_TICK: struct.Struct("<B8s"),
+}
+
+DIRECTIONS = ("up", "down", "left", "right")
+
+
+class ReplayDivergence(Exception):
+    def __init__(self, tick, expected, actual):
+        super().__init__(
+            "Replay diverged at tick "
+            + str(tick)
+            + ": expected state "
+            + expected.hex()
+            + ", got "
+            + actual.hex()
+        )
+        self.tick = tick
+        self.expected = expected
+        self.actual = actual
+
+
+def state_hash(game):
+    # 8-byte digest of everything the simulation carries from tick to tick
+    digest = hashlib.blake2b(digest_size=8)
+    snake = game.snake
+    x, y, r = particle_arrays(snake.particles)
+    digest.update(np.ascontiguousarray(x).tobytes())
+    digest.update(np.ascontiguousarray(y).tobytes())
+    digest.update(np.ascontiguousarray(r).tobytes())
+
+    pool = game.projectile_manager.pool
+    n = pool.count
+    for name in ("x", "y", "vx", "vy", "owner"):
+        digest.update(getattr(pool, name)[:n].tobytes())
+
+    ships = getattr(game.enemy_manager, "ships", None)
+    if ships is not None:
+        n = ships.count
+        for name in ("x", "y", "target_x", "target_y", "angle", "in_position"):
+            digest.update(getattr(ships, name)[:n].tobytes())
+    for enemy in () if ships is not None else game.enemy_manager.enemies:
+        digest.update(
+            struct.pack(
+                "<5d?",
+                enemy.init_x,
+                enemy.init_y,
+                enemy.x,
+                enemy.y,
+                enemy.angle,
+                enemy.inPosition,
+            )
+        )
+
+    food_x, food_y = game.food.positions()
+    digest.update(food_x.tobytes())
+    digest.update(food_y.tobytes())
+    digest.update(
+        struct.pack(
+            "<I2dd?",
+            game.tick,
+            *snake.snake_direction,
+            game.stats.get_score,
+            snake.deadFlag,
+        )
+    )
+    return digest.digest()
+
+
+class InputLog:
+    # A loaded recording: the seed, tick length, food count, world bounds and
+    # swarm size to rebuild the game with, the inputs applied before each
+    # tick and the state hash after each tick
+    def __init__(self, seed, time_delta, food_count=1, bounds=(-5, 5, -5, 5), swarm=0):
+        self.seed = seed
+        self.time_delta = time_delta
+        self.food_count = food_count
+        self.bounds = bounds
+        self.swarm = swarm
+        self.actions = {}
+        self.timestamps = []
+        self.hashes = []
+
+    @property
+    def ticks(self):
+        return len(self.hashes)
+
+    def actions_at(self, tick):
+        return self.actions.get(tick, ())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as log_file:
+            data = log_file.read()
+
+        # Headers grow between versions; check the version before the rest
+        magic, version = struct.unpack_from("<4sB", data)
+        if magic != LOG_MAGIC:
+            raise ValueError("Not an input log: " + str(path))
+        if version != LOG_VERSION:
+            raise ValueError("Unknown input log version: " + str(version))
+        _, _, seed, time_delta, food_count, *bounds, swarm = HEADER.unpack_from(data)
+
+        log = cls(seed, time_delta, food_count, tuple(bounds), swarm)
+        offset = HEADER.size
+        while offset < len(data):
+            kind = data[offset]
+            record = RECORDS.get(kind)
+            if record is None:
+                raise ValueError("Unknown record kind: " + str(kind))
+            if offset + record.size > len(data):
+                # A session cut short mid-write; keep everything before it
+                break
+            fields = record.unpack_from(data, offset)
+            offset += record.size
+
+            if kind == RECORD_TICK:
+                log.hashes.append(fields[1])
+                continue
+            tick, timestamp = fields[1], fields[2]
+            if kind == RECORD_MOVE:
+                action = ("move", DIRECTIONS[fields[3]])
+            else:
+                action = ("shoot", fields[3], fields[4])
+            log.actions.setdefault(tick, []).append(action)
+            log.timestamps.append(timestamp)
+        return log
+
+
+class InputRecorder:
+    # Streams a game's inputs and per-tick state hashes to a log file as they
+    # happen, so a crashed session still leaves a replayable log behind
+    def __init__(
+        self, path, seed, time_delta, food_count=1, bounds=(-5, 5, -5, 5), swarm=0
+    ):
+        if not isinstance(seed, int):
+            raise ValueError("Only integer seeds can be recorded: " + str(seed))
+        self.path = path
+        self.log_file = open(path, "wb")
+        self.log_file.write(
+            HEADER.pack(
+                LOG_MAGIC, LOG_VERSION, seed, time_delta, food_count, *bounds, swarm
+            )
+        )
+        self.start_time = time.perf_counter()
+
+    def record_action(self, tick, action):
+        timestamp = time.perf_counter() - self.start_time
+        if action[0] == "move":
+            self.log_file.write(
+                RECORDS[RECORD_MOVE].pack(
+                    RECORD_MOVE, tick, timestamp, DIRECTIONS.index(action[1])
+                )
+            )
+        elif action[0] == "shoot":
+            self.log_file.write(
+                RECORDS[RECORD_SHOOT].pack(
+                    RECORD_SHOOT, tick, timestamp, action[1], action[2]
+                )
+            )
+        else:
+            raise ValueError("Unknown action: " + str(action[0]))
+
+    def record_tick(self, game):
+        self.log_file.write(RECORDS[RECORD_TICK].pack(RECORD_TICK, state_hash(game)))
+
+    def close(self):
+        self.log_file.close()
+
+
+class Playback:
+    # Feeds a log's inputs back into a game and checks every tick's state
+    # against the recorded hash
+    def __init__(self, log):
+        self.log = log
+
+    def actions_at(self, tick):
+        return self.log.actions_at(tick)
+
+    def finished(self, tick):
+        return tick >= self.log.ticks
+
+    def check(self, game):
+        # Called after the tick that brought the clock to game.tick
+        index = game.tick - 1
+        if index >= self.log.ticks:
+            return
+        expected = self.log.hashes[index]
+        actual = state_hash(game)
+        if actual != expected:
+            raise ReplayDivergence(game.tick, expected, actual)
+
+
+def replay(path, render=False):
+    # Re-run a recorded session: headless at full speed, or in a window at
+    # the speed it was played. Raises ReplayDivergence on the first tick
+    # whose state doesn't match the recording.
+    from game import Game
+
+    log = InputLog.load(path)
+    leftx, rightx, topy, bottomy = log.bounds
+    game = Game(
+        screen_leftx=leftx,
+        screen_rightx=rightx,
+        screen_topy=topy,
+        screen_bottomy=bottomy,
+        headless=not render,
+        stats=GameStats(),
+        seed=log.seed,
+        clock=SimulationClock(log.time_delta),
+        food_count=log.food_count,
+        swarm=log.swarm,
+    )
+    game.playback = Playback(log)
+    if render:
+        game.run()
+        return game
+
+    while not game.playback.finished(game.tick) and not game.snake.deadFlag:
+        game.update()
+    return game
+
+
+if __name__ == "__main__":
+    # Recording games import this module too; only the CLI parses arguments
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay a recorded session")
+    parser.add_argument("log", help="input log written by game.py --record")
+    parser.add_argument("--render", action="store_true", help="play in a window")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        game = replay(args.log, render=args.render)
+    except ReplayDivergence as error:
+        print(error)
+        raise SystemExit(1)
+    elapsed = time.perf_counter() - start
+    print("Replayed " + str(game.tick) + " ticks in " + str(elapsed) + "s")
+    print("Score: " + str(game.stats.get_score))
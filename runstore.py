@@ -0,0 +1,416 @@
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from itertools import count
+
+import numpy as np
+
+# Ticks between interval samples of a run: one second of game time
+INTERVAL_TICKS = 64
+
+# Most queued writes the writer thread commits in one transaction
+BATCH_SIZE = 512
+
+# Per-run numbers kept in the runs table, and the ones sampled every interval
+RUN_METRICS = (
+    "ticks",
+    "score",
+    "time_alive",
+    "length",
+    "enemies_destroyed",
+    "shots_fired",
+)
+INTERVAL_METRICS = (
+    "score",
+    "time_alive",
+    "length",
+    "enemies_destroyed",
+    "shots_fired",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    label TEXT NOT NULL,
+    seed INTEGER,
+    started_at REAL NOT NULL,
+    ticks INTEGER NOT NULL,
+    score REAL NOT NULL,
+    time_alive REAL NOT NULL,
+    length INTEGER NOT NULL,
+    enemies_destroyed INTEGER NOT NULL,
+    shots_fired INTEGER NOT NULL,
+    died INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_label ON runs (label);
+CREATE TABLE IF NOT EXISTS intervals (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    tick INTEGER NOT NULL,
+    score REAL NOT NULL,
+    time_alive REAL NOT NULL,
+    length INTEGER NOT NULL,
+    enemies_destroyed INTEGER NOT NULL,
+    shots_fired INTEGER NOT NULL,
+    PRIMARY KEY (run_id, tick)
+);
+CREATE TABLE IF NOT EXISTS score_events (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    tick INTEGER NOT NULL,
+    points REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS score_events_run ON score_events (run_id);
+"""
+
+INSERT_RUN = (
+    "INSERT INTO runs (id, label, seed, started_at, died, "
+    + ", ".join(RUN_METRICS)
+    + ") VALUES (?, ?, ?, ?, ?"
+    + ", ?" * len(RUN_METRICS)
+    + ")"
+)
+INSERT_INTERVAL = (
+    "INSERT INTO intervals (run_id, tick, "
+    + ", ".join(INTERVAL_METRICS)
+    + ") VALUES (?, ?"
+    + ", ?" * len(INTERVAL_METRICS)
+    + ")"
+)
+INSERT_SCORE_EVENT = "INSERT INTO score_events (run_id, tick, points) VALUES (?, ?, ?)"
+
+# Range of SQLite's 64-bit INTEGER
+INTEGER_MIN = -(1 << 63)
+INTEGER_MAX = (1 << 63) - 1
+
+# Seconds between checks that the writer is still alive while flushing
+FLUSH_POLL = 0.1
+
+# Queued in place of a write to stop the writer thread
+STOP = object()
+
+
+def integer_value(value):
+    # A Python int SQLite can store, from any integer type
+    if isinstance(value, (int, np.integer)):
+        value = int(value)
+        if INTEGER_MIN <= value <= INTEGER_MAX:
+            return value
+        raise ValueError("Integer out of SQLite range: " + str(value))
+    raise ValueError("Not an integer: " + str(value))
+
+
+def number_row(row, length):
+    # A row of ints and floats for SQLite, checked against its expected length
+    row = tuple(row)
+    if len(row) != length:
+        raise ValueError("Expected " + str(length) + " values: " + str(row))
+    return tuple(
+        (
+            float(value)
+            if isinstance(value, (float, np.floating))
+            else integer_value(value)
+        )
+        for value in row
+    )
+
+
+class RunRecorder:
+    # Follows one game while it runs: a row of its stats every `interval`
+    # ticks and an event whenever its score changes. Everything stays in
+    # memory until finish(), so observing a tick costs a few comparisons.
+    def __init__(self, label="", seed=None, interval=INTERVAL_TICKS):
+        self.label = label
+        self.seed = seed
+        self.interval = interval
+        self.started_at = time.time()
+        self.intervals = []
+        self.score_events = []
+        self.last_score = 0
+
+    @staticmethod
+    def sample(game):
+        stats = game.stats
+        return (
+            stats.score,
+            stats.elapsed_time,
+            game.snake.getSize,
+            stats.enemies_destroyed,
+            stats.shots_fired,
+        )
+
+    def observe(self, game):
+        # Called after every tick
+        score = game.stats.score
+        if score != self.last_score:
+            self.score_events.append((game.tick, score - self.last_score))
+            self.last_score = score
+        if game.tick % self.interval == 0:
+            self.intervals.append((game.tick,) + self.sample(game))
+
+    def finish(self, game):
+        # The run as a plain dict, ready for RunStore.record_run or for
+        # sending between processes
+        return {
+            "label": self.label,
+            "seed": self.seed,
+            "started_at": self.started_at,
+            "died": game.snake.deadFlag,
+            "metrics": (game.tick,) + self.sample(game),
+            "intervals": self.intervals,
+            "score_events": self.score_events,
+        }
+
+
+class RunStore:
+    # Run statistics in a SQLite database. Writes are queued and committed
+    # by a background thread, each batch of whatever queued up during the
+    # previous commit in one transaction, so callers never wait on the disk.
+    # Queries read through a connection of their own after a flush(). Run
+    # ids are handed out here, so only one RunStore should write to a
+    # database at a time.
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        connection = sqlite3.connect(path)
+        try:
+            with connection:
+                connection.executescript(SCHEMA)
+            (last_id,) = connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM runs"
+            ).fetchone()
+        finally:
+            connection.close()
+        self.run_ids = count(last_id + 1)
+
+        self.queue = queue.SimpleQueue()
+        # Errors that dropped writes since the last check(), appended by the
+        # writer thread
+        self.errors = []
+        self.transactions = 0
+        self.writes = 0
+        self.writer = threading.Thread(
+            target=self.write_loop, name="RunStore writer", daemon=True
+        )
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_loop(self):
+        # Each batch is one transaction and each run in it one savepoint, so
+        # a run that fails to insert is rolled back alone and the rest of
+        # the batch still commits. Errors are reported by the next flush()
+        # or close(); the flush events of the batch in hand are set
+        # regardless, so no caller waits on a writer that is gone.
+        done = []
+        try:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            try:
+                while True:
+                    batch = [self.queue.get()]
+                    while len(batch) < self.batch_size:
+                        try:
+                            batch.append(self.queue.get_nowait())
+                        except queue.Empty:
+                            break
+
+                    stop = False
+                    writes = []
+                    for item in batch:
+                        if item is STOP:
+                            stop = True
+                        elif isinstance(item, threading.Event):
+                            done.append(item)
+                        else:
+                            writes.append(item)
+                    if writes:
+                        self.write_batch(connection, writes)
+                    for event in done:
+                        event.set()
+                    done = []
+                    if stop:
+                        return
+            finally:
+                connection.close()
+        except Exception as error:
+            self.errors.append("writer: " + str(error))
+        finally:
+            for event in done:
+                event.set()
+
+    def write_batch(self, connection, writes):
+        written = 0
+        try:
+            connection.execute("BEGIN")
+            for run_id, statements in writes:
+                connection.execute("SAVEPOINT run")
+                try:
+                    for statement, rows in statements:
+                        connection.executemany(statement, rows)
+                    written += 1
+                except Exception as error:
+                    connection.execute("ROLLBACK TO run")
+                    self.errors.append("run " + str(run_id) + ": " + str(error))
+                connection.execute("RELEASE run")
+            connection.execute("COMMIT")
+        except Exception as error:
+            # Such as a full disk; the whole batch is lost
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            self.errors.append("batch of " + str(len(writes)) + " runs: " + str(error))
+            return
+        self.transactions += 1
+        self.writes += written
+
+    def check(self):
+        # Raise once for the errors since the last check
+        errors = self.errors[:]
+        if errors:
+            del self.errors[: len(errors)]
+            raise RuntimeError("Run statistics write failed: " + "; ".join(errors))
+
+    def record_run(self, run):
+        # Queue a run from RunRecorder.finish and return its id. The rows are
+        # checked here, so a malformed run raises ValueError in the caller;
+        # they are one queued write, committed whole or not at all.
+        seed = run["seed"]
+        if seed is not None:
+            seed = integer_value(seed)
+        metrics = number_row(run["metrics"], len(RUN_METRICS))
+        intervals = [
+            number_row(row, 1 + len(INTERVAL_METRICS)) for row in run["intervals"]
+        ]
+        score_events = [number_row(event, 2) for event in run["score_events"]]
+        header = (
+            str(run["label"]),
+            seed,
+            float(run["started_at"]),
+            int(bool(run["died"])),
+        )
+
+        run_id = next(self.run_ids)
+        self.queue.put(
+            (
+                run_id,
+                (
+                    (INSERT_RUN, [(run_id,) + header + metrics]),
+                    (INSERT_INTERVAL, [(run_id,) + row for row in intervals]),
+                    (INSERT_SCORE_EVENT, [(run_id,) + event for event in score_events]),
+                ),
+            )
+        )
+        return run_id
+
+    def flush(self):
+        # Wait until everything queued so far is committed
+        done = threading.Event()
+        if self.writer.is_alive():
+            self.queue.put(done)
+            # The writer may stop before it gets to the event
+            while not done.wait(FLUSH_POLL) and self.writer.is_alive():
+                pass
+        self.check()
+        if not done.is_set():
+            raise RuntimeError("Run statistics writer has stopped")
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(STOP)
+            self.writer.join()
+        self.check()
+
+    def read(self, query, parameters=()):
+        self.flush()
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(query, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def labels(self):
+        return [label for (label,) in self.read("SELECT DISTINCT label FROM runs")]
+
+    def percentiles(self, metric="score", percentiles=(50, 90, 99), label=None):
+        # {percentile: value} of a per-run metric over every run, or over
+        # the runs of one label; None when there are no runs
+        if metric not in RUN_METRICS:
+            raise ValueError("Unknown metric: " + str(metric))
+        if label is None:
+            rows = self.read("SELECT " + metric + " FROM runs")
+        else:
+            rows = self.read(
+                "SELECT " + metric + " FROM runs WHERE label = ?", (label,)
+            )
+        if not rows:
+            return None
+        values = np.percentile([row[0] for row in rows], percentiles)
+        return dict(zip(percentiles, values.tolist()))
+
+    def summary(self, label=None):
+        # Run count, deaths and the mean of every per-run metric
+        query = (
+            "SELECT COUNT(*), SUM(died), "
+            + ", ".join("AVG(" + metric + ")" for metric in RUN_METRICS)
+            + " FROM runs"
+        )
+        if label is None:
+            (row,) = self.read(query)
+        else:
+            (row,) = self.read(query + " WHERE label = ?", (label,))
+        result = {"runs": row[0], "deaths": row[1] or 0}
+        for metric, mean in zip(RUN_METRICS, row[2:]):
+            result["mean_" + metric] = mean
+        return result
+
+    def score_timeline(self, label=None):
+        # Mean score at each interval tick, over the runs still alive then
+        query = "SELECT tick, AVG(score), COUNT(*) FROM intervals"
+        if label is None:
+            return self.read(query + " GROUP BY tick ORDER BY tick")
+        return self.read(
+            query
+            + " JOIN runs ON runs.id = intervals.run_id WHERE label = ?"
+            + " GROUP BY tick ORDER BY tick",
+            (label,),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize recorded runs")
+    parser.add_argument("database", help="SQLite file written by --stats-db")
+    parser.add_argument("--label", default=None, help="only runs with this label")
+    parser.add_argument(
+        "--metric", choices=RUN_METRICS, default="score", help="metric to rank"
+    )
+    args = parser.parse_args()
+
+    with RunStore(args.database) as store:
+        labels = store.labels() if args.label is None else [args.label]
+        for label in labels:
+            summary = store.summary(label)
+            percentiles = store.percentiles(args.metric, label=label)
+            print(
+                (label or "(unlabelled)")
+                + ": "
+                + str(summary["runs"])
+                + " runs, "
+                + str(summary["deaths"])
+                + " deaths, mean score "
+                + format(summary["mean_score"], ".2f")
+                + ", mean time alive "
+                + format(summary["mean_time_alive"], ".1f")
+                + "s"
+            )
+            print(
+                "  "
+                + args.metric
+                + " "
+                + ", ".join(
+                    "p" + str(p) + " " + format(value, ".2f")
+                    for p, value in percentiles.items()
+                )
+            )
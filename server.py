@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import json
+import struct
+import time
+
+import numpy as np
+
+from arena import Arena
+from collision import particle_arrays
+from profiler import RingBuffer
+from statestream import QUANTUM
+from statestream import StreamEncoder
+from statestream import capture_arena
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7464
+
+DIRECTIONS = ("up", "down", "left", "right")
+STREAMS = ("binary", "json")
+
+# Client messages are JSON objects, one per line:
+#   {"type": "move", "direction": "up"}
+#   {"type": "shoot", "x": 1.5, "y": -2.0}
+#   {"type": "respawn"}
+#   {"type": "ack", "tick": 128}
+# The server answers with a "welcome" line holding the player id and the
+# stream format. With the "json" stream every later message is a JSON line
+# too: a "state" every broadcast tick, or an "error" for messages it can't
+# use. With the "binary" stream every later message is a MESSAGE_HEADER
+# (payload length, kind) and its payload: statestream frames, or JSON
+# errors. Clients acknowledge each keyframe they receive with an "ack", and
+# get later frames as deltas against it.
+MESSAGE_HEADER = struct.Struct("<IB")
+KIND_FRAME = 1
+KIND_JSON = 2
+
+# Decimal places of coordinates in state messages
+STATE_PRECISION = 3
+
+# Bytes a client may leave unread in its socket buffer before state messages
+# are skipped for it rather than queued without bound
+MAX_CLIENT_BACKLOG = 1 << 18
+
+# Past this many seconds behind schedule the tick loop drops the missed ticks
+# instead of running them back to back
+MAX_TICK_LAG = 0.25
+
+# Pending connections the listening socket holds, for bursts of joins
+LISTEN_BACKLOG = 1024
+
+# Seconds between status lines
+REPORT_INTERVAL = 5.0
+
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def parse_message(line):
+    # The arena action for one client message; raises ValueError for
+    # anything malformed
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError("Message is not an object: " + str(message))
+    kind = message.get("type")
+    if kind == "move":
+        direction = message.get("direction")
+        if direction not in DIRECTIONS:
+            raise ValueError("Unknown direction: " + str(direction))
+        return ("move", direction)
+    elif kind == "shoot":
+        x, y = message.get("x"), message.get("y")
+        if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+            raise ValueError("Shoot needs numeric x and y")
+        return ("shoot", float(x), float(y))
+    elif kind == "respawn":
+        return ("respawn",)
+    elif kind == "ack":
+        tick = message.get("tick")
+        if not isinstance(tick, int):
+            raise ValueError("Ack needs an integer tick")
+        return ("ack", tick)
+    raise ValueError("Unknown message: " + str(kind))
+
+
+def error_message(error):
+    return {"type": "error", "message": str(error)}
+
+
+def rounded(values):
+    return np.round(values, STATE_PRECISION).tolist()
+
+
+def encode_state(arena):
+    # The whole arena as one state message, encoded once for every client
+    players = []
+    for player in arena.players.values():
+        entry = {"id": player.id, "alive": player.alive, "score": player.stats.score}
+        if player.alive:
+            x, y, _ = particle_arrays(player.snake.particles)
+            entry["x"] = rounded(x)
+            entry["y"] = rounded(y)
+        players.append(entry)
+
+    enemies = arena.enemy_manager.enemies
+    pool = arena.projectile_manager.pool
+    n = pool.count
+    food_x, food_y = arena.food.positions()
+    return encode(
+        {
+            "type": "state",
+            "tick": arena.tick,
+            "players": players,
+            "food": {"x": rounded(food_x), "y": rounded(food_y)},
+            "enemies": {
+                "x": rounded([enemy.init_x for enemy in enemies]),
+                "y": rounded([enemy.init_y for enemy in enemies]),
+                "angle": rounded([enemy.angle for enemy in enemies]),
+            },
+            "projectiles": {
+                "x": rounded(pool.x[:n]),
+                "y": rounded(pool.y[:n]),
+                "owner": pool.owner[:n].tolist(),
+            },
+        }
+    )
+
+
+class ArenaServer:
+    # Authoritative server: the arena steps at a fixed rate on the event
+    # loop, inputs arriving between ticks are queued into the next one, and
+    # every `broadcast_every` ticks all clients get the state
+    def __init__(self, arena, tick_rate=None, broadcast_every=1, stream="binary"):
+        if stream not in STREAMS:
+            raise ValueError("Unknown stream: " + str(stream))
+        self.arena = arena
+        self.stream = stream
+        self.encoder = StreamEncoder()
+        if tick_rate is None:
+            self.tick_time = arena.clock.time_delta
+        else:
+            self.tick_time = 1.0 / tick_rate
+        self.broadcast_every = broadcast_every
+        self.clients = {}  # Player id -> StreamWriter
+        self.acks = {}  # Player id -> newest keyframe tick acknowledged
+        self.tick_durations = RingBuffer(1024)
+        self.sent_bytes = 0
+        self.skipped_messages = 0
+        self.dropped_ticks = 0
+
+    async def handle_client(self, reader, writer):
+        try:
+            player = self.arena.join()
+        except RuntimeError as error:
+            # Sent in place of the welcome, so always a JSON line
+            writer.write(encode(error_message(error)))
+            await writer.drain()
+            writer.close()
+            return
+
+        self.clients[player.id] = writer
+        writer.write(
+            encode(
+                {
+                    "type": "welcome",
+                    "id": player.id,
+                    "tick_rate": 1.0 / self.tick_time,
+                    "broadcast_every": self.broadcast_every,
+                    "stream": self.stream,
+                    "quantum": QUANTUM,
+                    "bounds": [
+                        self.arena.leftx,
+                        self.arena.rightx,
+                        self.arena.topy,
+                        self.arena.bottomy,
+                    ],
+                }
+            )
+        )
+        try:
+            async for line in reader:
+                try:
+                    action = parse_message(line)
+                except ValueError as error:
+                    writer.write(self.encode_message(error_message(error)))
+                    continue
+                if action[0] == "ack":
+                    self.acks[player.id] = action[1]
+                else:
+                    self.arena.queue_action(player.id, action)
+        except (ConnectionError, ValueError):
+            # Reset connections and lines over the reader's limit end the
+            # session like a clean disconnect
+            pass
+        finally:
+            del self.clients[player.id]
+            self.acks.pop(player.id, None)
+            self.arena.leave(player.id)
+            writer.close()
+
+    def encode_message(self, message):
+        # A JSON message after the welcome, framed for the stream in use
+        if self.stream == "json":
+            return encode(message)
+        payload = json.dumps(message, separators=(",", ":")).encode()
+        return MESSAGE_HEADER.pack(len(payload), KIND_JSON) + payload
+
+    def broadcast(self):
+        if not self.clients:
+            return
+        if self.stream == "json":
+            message = encode_state(self.arena)
+        else:
+            self.encoder.begin(capture_arena(self.arena))
+        for player_id, writer in self.clients.items():
+            if writer.is_closing():
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BACKLOG:
+                self.skipped_messages += 1
+                continue
+            if self.stream == "json":
+                writer.write(message)
+                self.sent_bytes += len(message)
+            else:
+                frame = self.encoder.frame(self.acks.get(player_id))
+                writer.write(MESSAGE_HEADER.pack(len(frame), KIND_FRAME))
+                writer.write(frame)
+                self.sent_bytes += MESSAGE_HEADER.size + len(frame)
+
+    async def run_ticks(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            start = time.perf_counter()
+            self.arena.step()
+            if self.arena.tick % self.broadcast_every == 0:
+                self.broadcast()
+            self.tick_durations.append(time.perf_counter() - start)
+
+            next_tick += self.tick_time
+            delay = next_tick - loop.time()
+            if delay < -MAX_TICK_LAG:
+                missed = int(-delay / self.tick_time)
+                self.dropped_ticks += missed
+                next_tick += missed * self.tick_time
+                delay = next_tick - loop.time()
+            # Sleeping even when late lets queued client input in
+            await asyncio.sleep(max(delay, 0.0))
+
+    async def report(self, interval=REPORT_INTERVAL):
+        last_tick = self.arena.tick
+        last_bytes = self.sent_bytes
+        while True:
+            await asyncio.sleep(interval)
+            durations = self.tick_durations.recent() * 1000.0
+            p50, p95 = np.percentile(durations, (50, 95)) if len(durations) else (0, 0)
+            print(
+                "tick "
+                + str(self.arena.tick)
+                + ", "
+                + str(len(self.clients))
+                + " clients, "
+                + format((self.arena.tick - last_tick) / interval, ".1f")
+                + " ticks/s, tick p50 "
+                + format(p50, ".2f")
+                + " ms p95 "
+                + format(p95, ".2f")
+                + " ms, sent "
+                + format((self.sent_bytes - last_bytes) / interval / 1e6, ".2f")
+                + " MB/s, skipped "
+                + str(self.skipped_messages)
+                + ", dropped ticks "
+                + str(self.dropped_ticks),
+                flush=True,
+            )
+            last_tick = self.arena.tick
+            last_bytes = self.sent_bytes
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, quiet=False):
+        # Listen on a Unix socket at `path` when given, else on TCP
+        if path is None:
+            server = await asyncio.start_server(
+                self.handle_client, host, port, backlog=LISTEN_BACKLOG
+            )
+        else:
+            server = await asyncio.start_unix_server(
+                self.handle_client, path, backlog=LISTEN_BACKLOG
+            )
+        tasks = [self.run_ticks()]
+        if not quiet:
+            tasks.append(self.report())
+        async with server:
+            await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host a multiplayer arena")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--unix", metavar="PATH", help="listen on a Unix socket instead of TCP"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-players", type=int, default=64)
+    parser.add_argument(
+        "--tick-rate", type=float, default=None, help="ticks per second (default 64)"
+    )
+    parser.add_argument(
+        "--broadcast-every", type=int, default=1, help="ticks between state messages"
+    )
+    parser.add_argument("--stream", choices=STREAMS, default="binary")
+    parser.add_argument("--food", type=int, default=1, help="food items on the field")
+    parser.add_argument(
+        "--world-size", type=float, default=None, help="side of the square world"
+    )
+    parser.add_argument("--quiet", action="store_true", help="no status lines")
+    args = parser.parse_args()
+
+    arena = Arena(
+        seed=args.seed,
+        max_players=args.max_players,
+        food_count=args.food,
+        world_size=args.world_size,
+    )
+    server = ArenaServer(arena, args.tick_rate, args.broadcast_every, args.stream)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix, args.quiet))
+    except KeyboardInterrupt:
+        pass
@@ -1,121 +1,160 @@
+from clock import WallClock
+from collision import particle_arrays
+from projectile import OWNER_SNAKE
+from projectile import NO_SHOOTER
+from utils import BroadphaseStats
 from utils import Constraint
 from utils import Particle
-from OpenGL.GL import *
-
-from OpenGL.GLUT import *
+from utils import SolverStats
+from utils import SpatialHash
+from utils import draw_circles
 from math import sqrt as sqrt
 from math import atan2 as atan2
 
-import time
+
+def solve_tridiagonal(diagonal, off_diagonal, rhs):
+    # Thomas algorithm for a symmetric tridiagonal system, off_diagonal[k]
+    # coupling unknowns k and k + 1. A chain's J M^-1 J^T is diagonally
+    # dominant, so no pivoting is needed.
+    n = len(diagonal)
+    upper = [0.0] * n
+    solution = [0.0] * n
+    scale = diagonal[0]
+    solution[0] = rhs[0] / scale
+    for k in range(1, n):
+        upper[k - 1] = off_diagonal[k - 1] / scale
+        scale = diagonal[k] - off_diagonal[k - 1] * upper[k - 1]
+        solution[k] = (rhs[k] - off_diagonal[k - 1] * solution[k - 1]) / scale
+    for k in range(n - 2, -1, -1):
+        solution[k] -= upper[k] * solution[k + 1]
+    return solution
 
 
 class SnakePhysics:
-    def __init__(self, particles, distance_constraints, time_delta):
+    def __init__(self, particles, distance_constraints, time_delta, cell_size=0.2):
         self.particles = particles
         self.distance_constraints = distance_constraints
         self.time_delta = time_delta
+        self.cell_size = cell_size
+        self.broadphase = SpatialHash(cell_size)
+        self.broadphase_stats = BroadphaseStats()
+        self.solver_stats = SolverStats()
+
+        # Largest distance a particle moved in the last update_velocities;
+        # the broadphase still holds the positions from before that move
+        self.max_displacement = None
+
+    head_speed = 0.1
+    friction = 0.94
+
+    # The distance solver iterates until no link is off its rest length by
+    # more than solver_tolerance, or for max_solver_iterations iterations
+    max_solver_iterations = 8
+    solver_tolerance = 1e-3
 
     def apply_physics(self, snake_direction):
-        head_speed = 0.1
-        friction = 0.94
+        self.predict_positions(snake_direction)
+
+        self.resolve_collision_constraints()
+        self.apply_distance_constraints()
+
+        # Update positions and velocities
+        self.update_velocities()
+
+    def predict_positions(self, snake_direction):
         for index, particle in enumerate(self.particles):
             if index == 0:  # Apply direction movement to the head
-                particle.px += snake_direction[0] * head_speed
-                particle.py += snake_direction[1] * head_speed
+                particle.px += snake_direction[0] * self.head_speed
+                particle.py += snake_direction[1] * self.head_speed
             else:  # Apply friction to other particles
-                particle.vx *= friction
-                particle.vy *= friction
+                particle.vx *= self.friction
+                particle.vy *= self.friction
                 particle.px = particle.x + particle.vx * self.time_delta
                 particle.py = particle.y + particle.vy * self.time_delta
 
-        self.resolve_collision_constraints()
-        self.apply_distance_constraints()
-
-        # Update positions and velocities
+    def update_velocities(self):
+        max_displacement_squared = 0.0
         for particle in self.particles:
-            particle.vx = (particle.px - particle.x) / self.time_delta
-            particle.vy = (particle.py - particle.y) / self.time_delta
+            delta_x = particle.px - particle.x
+            delta_y = particle.py - particle.y
+            displacement_squared = delta_x * delta_x + delta_y * delta_y
+            if displacement_squared > max_displacement_squared:
+                max_displacement_squared = displacement_squared
+            particle.vx = delta_x / self.time_delta
+            particle.vy = delta_y / self.time_delta
             particle.x = particle.px
             particle.y = particle.py
-
-        # Redraw the scene
-        glutPostRedisplay()
+        self.max_displacement = sqrt(max_displacement_squared)
 
     def apply_distance_constraints(self):
-        i = 1
-        while i < 4:
-            # Apply distance constraints
-            for constraint in self.distance_constraints:
-                stiffness = 1 - (1 - constraint.stiffness) ** (1 / i)
-                delta_x1, delta_y1, delta_x2, delta_y2 = self.distance_constraint(
-                    self.particles[constraint.id1],
-                    self.particles[constraint.id2],
-                    constraint.distance,
-                )
-                self.particles[constraint.id1].px += stiffness * delta_x1
-                self.particles[constraint.id1].py += stiffness * delta_y1
-                self.particles[constraint.id2].px += stiffness * delta_x2
-                self.particles[constraint.id2].py += stiffness * delta_y2
-            i += 1
-
-    def distance_constraint(
-        self, particle1, particle2, constraint_distance, stiffness=0.8, damping=0.1
-    ):
-        current_distance = self.distance(
-            particle1.x, particle1.y, particle2.x, particle2.y
-        )
-
-        difference = current_distance - constraint_distance
-
-        if current_distance == 0:
-            direction = (0, 0)
-        else:
-            direction = (
-                (particle1.x - particle2.x) / current_distance,
-                (particle1.y - particle2.y) / current_distance,
-            )
-
-        inv_mass1 = particle1.inv_mass
-        inv_mass2 = particle2.inv_mass
-        total_inv_mass = inv_mass1 + inv_mass2
-
-        if total_inv_mass == 0:
-            return (0.0, 0.0, 0.0, 0.0)
-
-        correction_x1 = (
-            -inv_mass1
-            / total_inv_mass
-            * difference
-            * direction[0]
-            * stiffness
-            * (1 - damping)
-        )
-        correction_y1 = (
-            -inv_mass1
-            / total_inv_mass
-            * difference
-            * direction[1]
-            * stiffness
-            * (1 - damping)
-        )
-        correction_x2 = (
-            inv_mass2
-            / total_inv_mass
-            * difference
-            * direction[0]
-            * stiffness
-            * (1 - damping)
-        )
-        correction_y2 = (
-            inv_mass2
-            / total_inv_mass
-            * difference
-            * direction[1]
-            * stiffness
-            * (1 - damping)
-        )
-
-        return (correction_x1, correction_y1, correction_x2, correction_y2)
+        # Projects the predicted positions of the chain onto its link
+        # lengths. Each iteration linearizes every link about the current
+        # positions and solves J M^-1 J^T lambda = -C for all the link
+        # corrections at once. Link k joins particles k and k + 1, so only
+        # neighbouring links share a particle, the system is tridiagonal and
+        # solve_tridiagonal takes O(n). The corrections propagate down the
+        # whole chain in one iteration, so a few reach the tolerance at any
+        # length.
+        constraints = self.distance_constraints
+        particles = self.particles
+        if not constraints:
+            self.solver_stats.record(0, 0, 0.0)
+            return
+
+        px = [particle.px for particle in particles]
+        py = [particle.py for particle in particles]
+        inv_mass = [particle.inv_mass for particle in particles]
+        links = [(c.id1, c.id2, c.distance) for c in constraints]
+        count = len(links)
+
+        iterations = 0
+        while True:
+            # Link directions, J M^-1 J^T diagonal and errors. Degenerate
+            # links get no correction this iteration.
+            normal_x = [0.0] * count
+            normal_y = [0.0] * count
+            diagonal = [1.0] * count
+            rhs = [0.0] * count
+            residual = 0.0
+            for k, (i, j, rest) in enumerate(links):
+                delta_x = px[j] - px[i]
+                delta_y = py[j] - py[i]
+                current_distance = sqrt(delta_x * delta_x + delta_y * delta_y)
+                difference = current_distance - rest
+                if abs(difference) > residual:
+                    residual = abs(difference)
+
+                total_inv_mass = inv_mass[i] + inv_mass[j]
+                if current_distance == 0 or total_inv_mass == 0:
+                    continue
+                normal_x[k] = delta_x / current_distance
+                normal_y[k] = delta_y / current_distance
+                diagonal[k] = total_inv_mass
+                rhs[k] = -difference
+
+            if residual <= self.solver_tolerance:
+                break
+            if iterations == self.max_solver_iterations:
+                break
+            iterations += 1
+
+            # Neighbouring links couple through the particle they share
+            off_diagonal = [
+                -inv_mass[links[k][1]]
+                * (normal_x[k] * normal_x[k + 1] + normal_y[k] * normal_y[k + 1])
+                for k in range(count - 1)
+            ]
+            lambdas = solve_tridiagonal(diagonal, off_diagonal, rhs)
+            for (i, j, _), step, nx, ny in zip(links, lambdas, normal_x, normal_y):
+                px[i] -= inv_mass[i] * step * nx
+                py[i] -= inv_mass[i] * step * ny
+                px[j] += inv_mass[j] * step * nx
+                py[j] += inv_mass[j] * step * ny
+
+        for particle, x, y in zip(particles, px, py):
+            particle.px = x
+            particle.py = y
+        self.solver_stats.record(len(constraints), iterations, residual)
 
     def collision_constraint(self, particle1, particle2, damping=0.2):
         current_distance = self.distance(
@@ -155,17 +194,80 @@ class SnakePhysics:
         else:
             return (0.0, 0.0, 0.0, 0.0)
 
+    def broadphase_cell_size(self, max_radius):
+        # Cells must span at least one particle diameter for the neighbour
+        # search to find every overlapping pair
+        return max(self.cell_size, 2 * max_radius)
+
     def resolve_collision_constraints(self):
-        for p1 in self.particles:
-            for p2 in self.particles:
-                delta_x1, delta_y1, delta_x2, delta_y2 = self.collision_constraint(
-                    p1, p2
-                )
-                self.collision_constraint(p1, p2)
-                p1.px += delta_x1
-                p1.py += delta_y1
-                p2.px += delta_x2
-                p2.py += delta_y2
+        particles = self.particles
+        xs = [particle.x for particle in particles]
+        ys = [particle.y for particle in particles]
+        max_radius = max((particle.r for particle in particles), default=0.0)
+
+        self.broadphase.cell_size = self.broadphase_cell_size(max_radius)
+        self.broadphase.update(xs, ys)
+        self.max_displacement = None
+        pairs = self.broadphase.candidate_pairs()
+
+        contacts = 0
+        for i, j in pairs:
+            p1 = particles[i]
+            p2 = particles[j]
+            delta_x = xs[i] - xs[j]
+            delta_y = ys[i] - ys[j]
+            distance_squared = delta_x * delta_x + delta_y * delta_y
+            radii_sum = p1.r + p2.r
+
+            # Coincident particles are left alone: visiting both orderings of
+            # the pair, as the solver always has, cancels their (1, 0) pushes
+            if distance_squared >= radii_sum * radii_sum or distance_squared == 0:
+                continue
+
+            delta_x1, delta_y1, delta_x2, delta_y2 = self.collision_constraint(p1, p2)
+            contacts += 1
+
+            # Both orderings of a pair produce the same correction, so the
+            # single visit applies it twice
+            p1.px += 2 * delta_x1
+            p1.py += 2 * delta_y1
+            p2.px += 2 * delta_x2
+            p2.py += 2 * delta_y2
+
+        self.broadphase_stats.record(
+            len(particles), len(self.broadphase.cells), len(pairs), contacts
+        )
+
+    def head_collision(self, first=2):
+        # Whether the head overlaps any particle from index `first` on. Right
+        # after apply_physics the broadphase holds every particle's position
+        # from before the step, and no particle moved further than
+        # max_displacement since, so only the cells around the head can hold
+        # a particle touching it. Otherwise every particle is tested.
+        particles = self.particles
+        if len(particles) <= first:
+            return False
+        head = particles[0]
+        head_x = head.x
+        head_y = head.y
+
+        broadphase = self.broadphase
+        if self.max_displacement is None or len(broadphase.keys) != len(particles):
+            candidates = range(first, len(particles))
+        else:
+            reach = head.r + broadphase.cell_size / 2 + self.max_displacement
+            candidates = broadphase.query(head_x, head_y, reach)
+
+        for index in candidates:
+            if index < first:
+                continue
+            segment = particles[index]
+            delta_x = segment.x - head_x
+            delta_y = segment.y - head_y
+            radii_sum = head.r + segment.r
+            if delta_x * delta_x + delta_y * delta_y < radii_sum * radii_sum:
+                return True
+        return False
 
     @staticmethod
     def distance(x1, y1, x2, y2):
@@ -181,23 +283,51 @@ class Snake:
         screen_rightx=5,
         screen_topy=-5,
         screen_bottomy=5,
+        physics_backend="python",
+        clock=None,
     ):
         self.deadFlag = False
+        self.player_id = NO_SHOOTER  # Set by multiplayer arenas
+        self.clock = WallClock() if clock is None else clock
         self.particle_radii = 0.1
         self.particle_distance = self.particle_radii * 2.5
+        self.screen_leftx = screen_leftx
+        self.screen_rightx = screen_rightx
         self.screen_topy = screen_topy
-        self.particles = []
+        self.screen_bottomy = screen_bottomy
         self.snake_direction = [0, 0]  # [x, y]
-        self.time_delta = 1 / 64.0
+        self.time_delta = self.clock.time_delta
         self.distance_constraints = [
             Constraint(i, i + 1, self.particle_distance)
             for i in range(initial_length - 1)
         ]
-        self.physics = SnakePhysics(
-            self.particles, self.distance_constraints, self.time_delta
-        )
+        if physics_backend == "python":
+            self.particles = []
+            self.physics = SnakePhysics(
+                self.particles,
+                self.distance_constraints,
+                self.time_delta,
+                cell_size=2 * self.particle_radii,
+            )
+        elif physics_backend == "numpy":
+            # Structure-of-arrays backend; self.particles stays indexable and
+            # iterable, yielding particle views backed by the arrays
+            from array_physics import ArraySnakePhysics, ParticleArray
+
+            self.particles = ParticleArray()
+            self.physics = ArraySnakePhysics(
+                self.particles,
+                self.distance_constraints,
+                self.time_delta,
+                cell_size=2 * self.particle_radii,
+            )
+        else:
+            raise ValueError("Unknown physics backend: " + str(physics_backend))
         self.initialize_snake(initial_length)
-        self.last_fire_time = time.time()
+        # Particle positions before the last tick, for drawing between ticks
+        self.prev_x = None
+        self.prev_y = None
+        self.last_fire_time = self.clock.time
         self.bulllets = []
         self.fire_rate = 0.15  # One bullet every 1.75 seconds
         self.bullet_speed = 0.025
@@ -217,17 +347,48 @@ class Snake:
             y = self.screen_topy + 3 * self.particle_radii
             self.particles.append(Particle(x, y, self.particle_radii))
 
-    def draw(self):
-        self.draw_particles()
-        self.draw_snake()
-
-    def draw_snake(self):
-        for i in range(len(self.particles) - 1):
-            p1 = self.particles[i]
-            p2 = self.particles[i + 1]
-
-            # Calculate the direction from p1 to p2
-            direction = (p2.x - p1.x, p2.y - p1.y)
+    def interpolate(self, alpha=1.0):
+        # x, y and radius arrays of the particles `alpha` of the way from the
+        # previous tick to the current one. Particles grown since then are
+        # drawn where they are.
+        x, y, r = particle_arrays(self.particles)
+        if self.prev_x is None or alpha >= 1.0:
+            return x, y, r
+        n = min(len(x), len(self.prev_x))
+        x = x.copy()
+        y = y.copy()
+        x[:n] = self.prev_x[:n] + (x[:n] - self.prev_x[:n]) * alpha
+        y[:n] = self.prev_y[:n] + (y[:n] - self.prev_y[:n]) * alpha
+        return x, y, r
+
+    def draw(self, viewport=None, alpha=1.0):
+        # `alpha` is how far the frame lies between the previous tick and the
+        # current one
+        x, y, r = self.interpolate(alpha)
+        x = x.tolist()
+        y = y.tolist()
+        self.draw_particles(x, y, r.tolist(), viewport)
+        self.draw_snake(x, y, viewport)
+
+    def draw_snake(self, x, y, viewport=None):
+        from OpenGL.GL import GL_QUADS, glBegin, glEnd, glVertex2f
+
+        for i in range(len(x) - 1):
+            x1, y1 = x[i], y[i]
+            x2, y2 = x[i + 1], y[i + 1]
+
+            # Every point of the link's quad lies within a link length of one
+            # of its ends, so skip links whose ends are both that far off
+            # screen
+            margin = self.particle_distance
+            if viewport is not None and not (
+                viewport.is_visible(x1, y1, margin)
+                or viewport.is_visible(x2, y2, margin)
+            ):
+                continue
+
+            # Calculate the direction along the link
+            direction = (x2 - x1, y2 - y1)
 
             # Calculate the normal to this direction (to get the perpendicular vector)
             normal = (-direction[1], direction[0])
@@ -241,10 +402,10 @@ class Snake:
             half_width = self.particle_radii
 
             # Calculate the four corners of the rectangle
-            corner1 = (p1.x + normal[0] * half_width, p1.y + normal[1] * half_width)
-            corner2 = (p1.x - normal[0] * half_width, p1.y - normal[1] * half_width)
-            corner3 = (p2.x - normal[0] * half_width, p2.y - normal[1] * half_width)
-            corner4 = (p2.x + normal[0] * half_width, p2.y + normal[1] * half_width)
+            corner1 = (x1 + normal[0] * half_width, y1 + normal[1] * half_width)
+            corner2 = (x1 - normal[0] * half_width, y1 - normal[1] * half_width)
+            corner3 = (x2 - normal[0] * half_width, y2 - normal[1] * half_width)
+            corner4 = (x2 + normal[0] * half_width, y2 + normal[1] * half_width)
 
             # Draw the rectangle (quad)
             glBegin(GL_QUADS)
@@ -254,10 +415,11 @@ class Snake:
             glVertex2f(*corner4)
             glEnd()
 
-    def draw_particles(self):
+    def draw_particles(self, x, y, r, viewport=None):
+        from OpenGL.GL import glColor3f
+
         glColor3f(1.0, 1.0, 1.0)
-        for particle in self.particles:
-            particle.draw()
+        draw_circles(zip(x, y, r), viewport)
 
     def move(self, direction):
         if direction == "up":
@@ -270,33 +432,20 @@ class Snake:
             self.snake_direction = [0.25, 0]
 
     def check_self_collision(self):
-        head = self.particles[0]
-        for segment in self.particles[2:]:  # Check head against all other segments
-            dist = SnakePhysics.distance(head.x, head.y, segment.x, segment.y)
-            if dist < (head.r + segment.r):
-                return True  # Collision detected
-        return False  # No collision
-
-    def check_food_collision(self, food_pos):
-        head = self.particles[0]
-        dist = SnakePhysics.distance(head.x, head.y, food_pos[0], food_pos[1])
-        if dist < (head.r + self.particle_radii):
-            return True  # Collision detected
-        return False  # No collision
+        # Check head against all segments but its neighbour
+        return self.physics.head_collision(first=2)
 
     def check_wall_collision(self):
         head = self.particles[0]
-        if head.x < -5 or head.x > 5 or head.y < -5 or head.y > 5:
+        if (
+            head.x < self.screen_leftx
+            or head.x > self.screen_rightx
+            or head.y < self.screen_topy
+            or head.y > self.screen_bottomy
+        ):
             return True
         return False
 
-    def check_collision(self, x, y, r):
-        for particle in self.particles:
-            dist = SnakePhysics.distance(x, y, particle.x, particle.y)
-            if dist < (r + particle.r):
-                return True
-        return False
-
     def grow(self):
         last_particle = self.particles[-1]
         new_particle = Particle(last_particle.x, last_particle.y, last_particle.r)
@@ -317,11 +466,15 @@ class Snake:
             self.deadFlag = True
 
     def update(self):
+        x, y, _ = particle_arrays(self.particles)
+        self.prev_x = x.copy()
+        self.prev_y = y.copy()
         self.physics.apply_physics(self.snake_direction)
         if self.check_self_collision() or self.check_wall_collision():
             self.deadFlag = True
 
     def shoot(self, target_x, target_y):
+        # Returns whether a bullet was fired; the cooldown may hold it back
         head = self.particles[0]
         direction_x = target_x - head.x
         direction_y = target_y - head.y
@@ -330,7 +483,7 @@ class Snake:
         angle_to_target = atan2(direction_y, direction_x)
 
         # Fire a bullet if the cooldown has expired
-        current_time = time.time()
+        current_time = self.clock.time
         if current_time - self.last_fire_time >= self.fire_rate:
             self.last_fire_time = current_time
             self.projectile_manager.fire(
@@ -339,6 +492,9 @@ class Snake:
                 angle_to_target,
                 self.bullet_speed,
                 size=0.1,
-                color=(0, 0, 1),
                 damage=1,
+                owner=OWNER_SNAKE,
+                shooter=self.player_id,
             )
+            return True
+        return False
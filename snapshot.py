@@ -0,0 +1,281 @@
+import random
+from itertools import count
+from operator import attrgetter
+
+# Per-object state captured by a snapshot, in the order it is stored
+PARTICLE_FIELDS = ("x", "y", "px", "py", "vx", "vy", "r", "inv_mass")
+ENEMY_FIELDS = (
+    "init_x",
+    "init_y",
+    "x",
+    "y",
+    "angle",
+    "inPosition",
+    "last_fire_time",
+    "prev_init_x",
+    "prev_init_y",
+    "prev_angle",
+)
+
+particle_state = attrgetter(*PARTICLE_FIELDS)
+enemy_state = attrgetter(*ENEMY_FIELDS)
+
+# Versions handed out to generator states; never reused, so equal versions
+# mean equal states even across restored branches
+rng_versions = count(1)
+
+
+class VersionedRandom(random.Random):
+    # random.Random that bumps a version number whenever its state changes.
+    # Copying the Mersenne Twister state is most of the cost of a snapshot,
+    # and between most snapshots nothing draws a number at all, so the last
+    # state copy is reused while the version is unchanged. Overriding
+    # getrandbits as well keeps randrange and choice on the same sequence as
+    # random.Random.
+    def seed(self, *args, **kwargs):
+        super().seed(*args, **kwargs)
+        self.version = next(rng_versions)
+        self.saved_version = None
+
+    def random(self):
+        self.version = next(rng_versions)
+        return super().random()
+
+    def getrandbits(self, k):
+        self.version = next(rng_versions)
+        return super().getrandbits(k)
+
+    def setstate(self, state):
+        super().setstate(state)
+        self.version = next(rng_versions)
+        self.saved_version = None
+
+    def versioned_state(self):
+        # (version, state), copying the state only if it changed since the
+        # last call
+        if self.saved_version != self.version:
+            self.saved_state = self.getstate()
+            self.saved_version = self.version
+        return self.version, self.saved_state
+
+    def restore_versioned_state(self, version, state):
+        if version != self.version:
+            self.setstate(state)
+            self.version = version
+            self.saved_version = version
+            self.saved_state = state
+
+
+class GameSnapshot:
+    # Everything a Game carries from one tick to the next, and nothing it
+    # rebuilds each tick (the collision world) or owns outside the simulation
+    # (window, renderer, recorder, profiler).
+    #
+    # Live objects are captured by reference next to their field values:
+    # restoring puts the same particle, constraint and enemy objects back in
+    # their lists and rewrites their fields, so it allocates next to nothing.
+    # Constraints are never modified once created, so the objects alone
+    # stand for their state.
+    __slots__ = (
+        "tick",
+        "rng_version",
+        "rng_state",
+        "score",
+        "start_time",
+        "elapsed_time",
+        "enemies_destroyed",
+        "shots_fired",
+        "dead",
+        "snake_direction",
+        "snake_last_fire_time",
+        "particles",
+        "particle_states",
+        "constraints",
+        "projectiles",
+        "projectile_count",
+        "projectile_high_water_mark",
+        "projectiles_dropped",
+        "projectile_next_id",
+        "enemies",
+        "enemy_states",
+        "enemy_next_id",
+        "ship_count",
+        "ship_next_id",
+        "last_spawn_time",
+        "food",
+        "food_count",
+        "food_free_count",
+        "food_next_id",
+    )
+
+
+def take_snapshot(game, snapshot=None):
+    # Capture `game` into `snapshot`, or into a new GameSnapshot. Reusing a
+    # snapshot keeps repeated saves from allocating new projectile arrays.
+    if snapshot is None:
+        snapshot = GameSnapshot()
+    snake = game.snake
+    snapshot.tick = game.clock.tick
+    if isinstance(game.rng, VersionedRandom):
+        snapshot.rng_version, snapshot.rng_state = game.rng.versioned_state()
+    else:
+        snapshot.rng_version, snapshot.rng_state = None, game.rng.getstate()
+    snapshot.score = game.stats.score
+    snapshot.start_time = game.stats.start_time
+    snapshot.elapsed_time = game.stats.elapsed_time
+    snapshot.enemies_destroyed = game.stats.enemies_destroyed
+    snapshot.shots_fired = game.stats.shots_fired
+    snapshot.dead = snake.deadFlag
+    snapshot.snake_direction = tuple(snake.snake_direction)
+    snapshot.snake_last_fire_time = snake.last_fire_time
+
+    particles = snake.particles
+    if hasattr(particles, "fields"):
+        # Structure-of-arrays particles are copied array by array
+        n = len(particles)
+        snapshot.particles = None
+        snapshot.particle_states = [
+            getattr(particles, name)[:n].copy() for name in particles.fields
+        ]
+    else:
+        snapshot.particles = tuple(particles)
+        snapshot.particle_states = [particle_state(p) for p in particles]
+    snapshot.constraints = tuple(snake.distance_constraints)
+
+    pool = game.projectile_manager.pool
+    n = pool.count
+    saved = getattr(snapshot, "projectiles", None)
+    if saved is None or len(saved[0]) < n:
+        saved = snapshot.projectiles = [
+            getattr(pool, name)[:n].copy() for name in pool.fields
+        ]
+    else:
+        for values, name in zip(saved, pool.fields):
+            values[:n] = getattr(pool, name)[:n]
+    snapshot.projectile_count = n
+    snapshot.projectile_high_water_mark = pool.high_water_mark
+    snapshot.projectiles_dropped = pool.dropped
+    snapshot.projectile_next_id = pool.next_id
+
+    enemy_manager = game.enemy_manager
+    ships = getattr(enemy_manager, "ships", None)
+    if ships is not None:
+        # A swarm's ShipPool is copied whole, like the food arrays
+        snapshot.enemies = None
+        saved = getattr(snapshot, "enemy_states", None)
+        if saved is None or len(saved[0]) != ships.capacity:
+            snapshot.enemy_states = [
+                getattr(ships, name).copy() for name in ships.fields
+            ]
+        else:
+            for values, name in zip(saved, ships.fields):
+                values[:] = getattr(ships, name)
+        snapshot.ship_count = ships.count
+        snapshot.ship_next_id = ships.next_id
+    else:
+        snapshot.enemies = tuple(enemy_manager.enemies)
+        snapshot.enemy_states = [enemy_state(enemy) for enemy in enemy_manager.enemies]
+        snapshot.enemy_next_id = enemy_manager.next_id
+    snapshot.last_spawn_time = enemy_manager.last_spawn_time
+
+    # Food arrays are sized for the whole grid up front, so they are copied
+    # whole and reused as they are
+    food = game.food
+    saved = getattr(snapshot, "food", None)
+    if saved is None:
+        snapshot.food = [getattr(food, name).copy() for name in food.fields]
+    else:
+        for values, name in zip(saved, food.fields):
+            values[:] = getattr(food, name)
+    snapshot.food_count = food.count
+    snapshot.food_free_count = food.free_count
+    snapshot.food_next_id = food.next_id
+    return snapshot
+
+
+def restore_snapshot(game, snapshot):
+    # Write `snapshot` back into the live objects of `game`, which must be the
+    # game it was taken from (or share its configuration and backend)
+    snake = game.snake
+    game.clock.tick = snapshot.tick
+    if snapshot.rng_version is None:
+        game.rng.setstate(snapshot.rng_state)
+    else:
+        game.rng.restore_versioned_state(snapshot.rng_version, snapshot.rng_state)
+    game.stats.score = snapshot.score
+    game.stats.start_time = snapshot.start_time
+    game.stats.elapsed_time = snapshot.elapsed_time
+    game.stats.enemies_destroyed = snapshot.enemies_destroyed
+    game.stats.shots_fired = snapshot.shots_fired
+    snake.deadFlag = snapshot.dead
+    snake.snake_direction[:] = snapshot.snake_direction
+    snake.last_fire_time = snapshot.snake_last_fire_time
+
+    particles = snake.particles
+    if snapshot.particles is None:
+        n = len(snapshot.particle_states[0])
+        particles.reserve(n)
+        for name, values in zip(particles.fields, snapshot.particle_states):
+            getattr(particles, name)[:n] = values
+        particles.count = n
+    else:
+        particles[:] = snapshot.particles
+        for particle, state in zip(particles, snapshot.particle_states):
+            (
+                particle.x,
+                particle.y,
+                particle.px,
+                particle.py,
+                particle.vx,
+                particle.vy,
+                particle.r,
+                particle.inv_mass,
+            ) = state
+    snake.distance_constraints[:] = snapshot.constraints
+    # The broadphase and the positions to draw from no longer match the
+    # particles
+    snake.physics.max_displacement = None
+    snake.prev_x = None
+    snake.prev_y = None
+
+    pool = game.projectile_manager.pool
+    n = snapshot.projectile_count
+    for name, values in zip(pool.fields, snapshot.projectiles):
+        getattr(pool, name)[:n] = values[:n]
+    pool.count = n
+    pool.high_water_mark = snapshot.projectile_high_water_mark
+    pool.dropped = snapshot.projectiles_dropped
+    pool.next_id = snapshot.projectile_next_id
+
+    enemy_manager = game.enemy_manager
+    if snapshot.enemies is None:
+        ships = enemy_manager.ships
+        for values, name in zip(snapshot.enemy_states, ships.fields):
+            getattr(ships, name)[:] = values
+        ships.count = snapshot.ship_count
+        ships.next_id = snapshot.ship_next_id
+        ships.rebuild_slots()
+    else:
+        enemy_manager.enemies[:] = snapshot.enemies
+        for enemy, state in zip(enemy_manager.enemies, snapshot.enemy_states):
+            (
+                enemy.init_x,
+                enemy.init_y,
+                enemy.x,
+                enemy.y,
+                enemy.angle,
+                enemy.inPosition,
+                enemy.last_fire_time,
+                enemy.prev_init_x,
+                enemy.prev_init_y,
+                enemy.prev_angle,
+            ) = state
+        enemy_manager.next_id = snapshot.enemy_next_id
+    enemy_manager.last_spawn_time = snapshot.last_spawn_time
+
+    food = game.food
+    for values, name in zip(snapshot.food, food.fields):
+        getattr(food, name)[:] = values
+    food.count = snapshot.food_count
+    food.free_count = snapshot.food_free_count
+    food.next_id = snapshot.food_next_id
@@ -0,0 +1,355 @@
+import struct
+
+import numpy as np
+
+from collision import particle_arrays
+
+# Binary world state frames for clients and spectators.
+#
+# A frame holds a small table of players and four entity sections: snake
+# segments, projectiles, enemy ships and food. Entities carry stable ids
+# (player id and segment index for segments, pool ids for projectiles, spawn
+# numbers for ships) and their columns are quantized to int32. Each frame is
+# encoded against a keyframe the receiver acknowledged: entities of the
+# keyframe that are gone or moved are flagged in two bitmasks, moved ones
+# carry int16 deltas, and only new entities are sent in full. A frame
+# against no keyframe is therefore the whole world.
+#
+# Frame layout, little endian:
+#   header    flags u8, tick u32, keyframe tick u32 (NO_BASE for none),
+#             player count u16
+#   players   PLAYER_DTYPE rows
+#   sections  in SECTIONS order, each:
+#               keyframe entities u32, changed u32, added u32
+#               kept bitmask and changed bitmask over the keyframe entities
+#               changed deltas i16[changed, columns]
+#               added ids u64[added], added values i32[added, columns]
+
+# World units per coordinate step, and radians per angle step
+QUANTUM = 1 / 1024
+ANGLE_QUANTUM = 2 * np.pi / 4096
+
+# Entity sections in wire order, with their columns
+SECTIONS = (
+    ("segments", ("x", "y")),
+    ("projectiles", ("x", "y", "owner")),
+    ("enemies", ("x", "y", "angle")),
+    ("food", ("x", "y")),
+)
+SECTION_INDEX = {name: index for index, (name, _) in enumerate(SECTIONS)}
+
+# Frame flags
+FRAME_KEYFRAME = 1  # Receivers keep the frame as a keyframe and acknowledge it
+
+NO_BASE = 0xFFFFFFFF
+
+FRAME_HEADER = struct.Struct("<BIIH")
+SECTION_HEADER = struct.Struct("<III")
+PLAYER_DTYPE = np.dtype(
+    [("id", "<u4"), ("alive", "u1"), ("length", "<u2"), ("score", "<f4")]
+)
+
+DELTA_MIN = np.iinfo(np.int16).min
+DELTA_MAX = np.iinfo(np.int16).max
+
+
+class WorldState:
+    # Quantized world at one tick: per section, ids sorted ascending and an
+    # int32 row of column values per entity
+    __slots__ = ("tick", "players", "ids", "values")
+
+    def __init__(self, tick, players, ids, values):
+        self.tick = tick
+        self.players = players
+        self.ids = ids
+        self.values = values
+
+    def section(self, name):
+        index = SECTION_INDEX[name]
+        return self.ids[index], self.values[index]
+
+    def positions(self, name):
+        # World coordinates of a section's entities, as (ids, x, y)
+        ids, values = self.section(name)
+        return ids, values[:, 0] * QUANTUM, values[:, 1] * QUANTUM
+
+
+def empty_state():
+    return WorldState(
+        None,
+        np.zeros(0, PLAYER_DTYPE),
+        [np.zeros(0, np.uint64) for _ in SECTIONS],
+        [np.zeros((0, len(columns)), np.int32) for _, columns in SECTIONS],
+    )
+
+
+def quantize(values, quantum=QUANTUM):
+    return np.rint(np.asarray(values, dtype=np.float64) / quantum).astype(np.int32)
+
+
+def sorted_section(ids, *columns):
+    values = np.empty((len(ids), len(columns)), np.int32)
+    for index, column in enumerate(columns):
+        values[:, index] = column
+    order = np.argsort(ids, kind="stable")
+    return ids[order], values[order]
+
+
+def capture_world(tick, players, snakes, pool, ships, food):
+    # `snakes` are (player id, particles) pairs, `ships` the ship_arrays() of
+    # an enemy manager and `food` a FoodField. Everything but the snakes is
+    # read straight from the arrays that hold it.
+    segment_ids = []
+    segment_x = []
+    segment_y = []
+    for player_id, particles in snakes:
+        x, y, _ = particle_arrays(particles)
+        segment_ids.append(
+            (np.uint64(player_id) << np.uint64(32)) | np.arange(len(x), dtype=np.uint64)
+        )
+        segment_x.append(x)
+        segment_y.append(y)
+    if snakes:
+        segments = sorted_section(
+            np.concatenate(segment_ids),
+            quantize(np.concatenate(segment_x)),
+            quantize(np.concatenate(segment_y)),
+        )
+    else:
+        segments = sorted_section(np.zeros(0, np.uint64), [], [])
+
+    n = pool.count
+    projectiles = sorted_section(
+        pool.id[:n], quantize(pool.x[:n]), quantize(pool.y[:n]), pool.owner[:n]
+    )
+
+    ship_ids, ship_x, ship_y, ship_angle = ships
+    ships = sorted_section(
+        ship_ids,
+        quantize(ship_x),
+        quantize(ship_y),
+        quantize(ship_angle % (2 * np.pi), ANGLE_QUANTUM),
+    )
+
+    n = food.count
+    food = sorted_section(food.id[:n], quantize(food.x[:n]), quantize(food.y[:n]))
+
+    sections = (segments, projectiles, ships, food)
+    return WorldState(
+        tick,
+        players,
+        [section[0] for section in sections],
+        [section[1] for section in sections],
+    )
+
+
+def capture_arena(arena):
+    players = np.zeros(len(arena.players), PLAYER_DTYPE)
+    snakes = []
+    for row, player in enumerate(arena.players.values()):
+        players[row] = (
+            player.id,
+            player.alive,
+            player.snake.getSize,
+            player.stats.score,
+        )
+        if player.alive:
+            snakes.append((player.id, player.snake.particles))
+    return capture_world(
+        arena.tick,
+        players,
+        snakes,
+        arena.projectile_manager.pool,
+        arena.enemy_manager.ship_arrays(),
+        arena.food,
+    )
+
+
+def capture_game(game, player_id=0):
+    # A single player Game, for spectators
+    snake = game.snake
+    players = np.zeros(1, PLAYER_DTYPE)
+    players[0] = (player_id, not snake.deadFlag, snake.getSize, game.stats.score)
+    return capture_world(
+        game.tick,
+        players,
+        [(player_id, snake.particles)],
+        game.projectile_manager.pool,
+        game.enemy_manager.ship_arrays(),
+        game.food,
+    )
+
+
+def encode_section(ids, values, base_ids, base_values):
+    base_count = len(base_ids)
+    slot = np.searchsorted(base_ids, ids)
+    if base_count:
+        in_base = base_ids[np.minimum(slot, base_count - 1)] == ids
+    else:
+        in_base = np.zeros(len(ids), dtype=bool)
+
+    # Entities of the keyframe still alive; those that moved too far for an
+    # int16 delta are sent again in full instead
+    kept_slot = slot[in_base]
+    delta = values[in_base].astype(np.int64) - base_values[kept_slot]
+    fits = np.all((DELTA_MIN <= delta) & (delta <= DELTA_MAX), axis=1)
+    added = ~in_base
+    added[np.flatnonzero(in_base)[~fits]] = True
+    kept_slot = kept_slot[fits]
+    delta = delta[fits]
+    moved = np.any(delta != 0, axis=1)
+
+    kept = np.zeros(base_count, dtype=bool)
+    kept[kept_slot] = True
+    changed = np.zeros(base_count, dtype=bool)
+    changed[kept_slot[moved]] = True
+    added_count = int(np.count_nonzero(added))
+    return (
+        SECTION_HEADER.pack(base_count, int(np.count_nonzero(moved)), added_count),
+        np.packbits(kept).tobytes(),
+        np.packbits(changed).tobytes(),
+        delta[moved].astype("<i2").tobytes(),
+        ids[added].astype("<u8").tobytes(),
+        values[added].astype("<i4").tobytes(),
+    )
+
+
+def encode_frame(state, base=None, keyframe=False):
+    # `state` as a frame against the keyframe `base`, or in full
+    if base is None:
+        base = empty_state()
+        base_tick = NO_BASE
+    else:
+        base_tick = base.tick
+    parts = [
+        FRAME_HEADER.pack(
+            FRAME_KEYFRAME if keyframe else 0,
+            state.tick,
+            base_tick,
+            len(state.players),
+        ),
+        state.players.astype(PLAYER_DTYPE).tobytes(),
+    ]
+    for index in range(len(SECTIONS)):
+        parts.extend(
+            encode_section(
+                state.ids[index],
+                state.values[index],
+                base.ids[index],
+                base.values[index],
+            )
+        )
+    return b"".join(parts)
+
+
+def decode_frame(data, base=None):
+    # (flags, WorldState) of a frame; `base` must be the keyframe it was
+    # encoded against
+    flags, tick, base_tick, player_count = FRAME_HEADER.unpack_from(data)
+    if base_tick == NO_BASE:
+        base = empty_state()
+    elif base is None or base.tick != base_tick:
+        raise ValueError("Frame needs the keyframe of tick: " + str(base_tick))
+    offset = FRAME_HEADER.size
+    players = np.frombuffer(data, PLAYER_DTYPE, player_count, offset).copy()
+    offset += player_count * PLAYER_DTYPE.itemsize
+
+    ids = []
+    values = []
+    for index, (_, section_columns) in enumerate(SECTIONS):
+        columns = len(section_columns)
+        base_ids = base.ids[index]
+        base_count, changed_count, added_count = SECTION_HEADER.unpack_from(
+            data, offset
+        )
+        if base_count != len(base_ids):
+            raise ValueError("Keyframe does not match frame: " + str(base_tick))
+        offset += SECTION_HEADER.size
+        mask_size = (base_count + 7) // 8
+        kept = np.unpackbits(
+            np.frombuffer(data, np.uint8, mask_size, offset), count=base_count
+        ).astype(bool)
+        offset += mask_size
+        changed = np.unpackbits(
+            np.frombuffer(data, np.uint8, mask_size, offset), count=base_count
+        ).astype(bool)
+        offset += mask_size
+        delta = np.frombuffer(data, "<i2", changed_count * columns, offset)
+        offset += delta.nbytes
+        added_ids = np.frombuffer(data, "<u8", added_count, offset)
+        offset += added_ids.nbytes
+        added_values = np.frombuffer(data, "<i4", added_count * columns, offset)
+        offset += added_values.nbytes
+
+        section_values = base.values[index].copy()
+        section_values[changed] += delta.reshape(changed_count, columns)
+        section_ids = np.concatenate([base_ids[kept], added_ids.astype(np.uint64)])
+        section_values = np.concatenate(
+            [
+                section_values[kept],
+                added_values.reshape(added_count, columns).astype(np.int32),
+            ]
+        )
+        order = np.argsort(section_ids, kind="stable")
+        ids.append(section_ids[order])
+        values.append(section_values[order])
+    return flags, WorldState(tick, players, ids, values)
+
+
+class StreamEncoder:
+    # Frames for many receivers of the same world. Every `keyframe_interval`
+    # frames is a keyframe; each receiver gets frames against the newest
+    # keyframe it acknowledged that is still among the last `history`.
+    # Receivers without one get full frames, which are keyframes too, so
+    # they can switch to deltas after one round trip. Receivers on the same
+    # keyframe share one encoding.
+    def __init__(self, keyframe_interval=32, history=16):
+        self.keyframe_interval = keyframe_interval
+        self.history = history
+        self.keyframes = {}
+        self.frame_count = 0
+        self.state = None
+        self.is_keyframe = False
+        self.encoded = {}
+
+    def begin(self, state):
+        self.state = state
+        self.is_keyframe = self.frame_count % self.keyframe_interval == 0
+        self.frame_count += 1
+        if self.is_keyframe:
+            self.keep(state)
+        self.encoded.clear()
+
+    def keep(self, state):
+        self.keyframes[state.tick] = state
+        while len(self.keyframes) > self.history:
+            del self.keyframes[next(iter(self.keyframes))]
+
+    def frame(self, acked_tick=None):
+        base = self.keyframes.get(acked_tick)
+        key = None if base is None else base.tick
+        frame = self.encoded.get(key)
+        if frame is None:
+            if base is None and not self.is_keyframe:
+                self.keep(self.state)
+            frame = encode_frame(self.state, base, base is None or self.is_keyframe)
+            self.encoded[key] = frame
+        return frame
+
+
+class StreamDecoder:
+    # Receiving end of a StreamEncoder: keeps the keyframes it acknowledges
+    def __init__(self, history=16):
+        self.history = history
+        self.keyframes = {}
+        self.ack = None  # Tick of the newest keyframe, to acknowledge
+
+    def decode(self, data):
+        _, _, base_tick, _ = FRAME_HEADER.unpack_from(data)
+        flags, state = decode_frame(data, self.keyframes.get(base_tick))
+        if flags & FRAME_KEYFRAME:
+            self.keyframes[state.tick] = state
+            while len(self.keyframes) > self.history:
+                del self.keyframes[next(iter(self.keyframes))]
+            self.ack = state.tick
+        return state
@@ -1,27 +1,42 @@
+import time
+
+
 class GameStats:
     def __init__(self):
         self.score = 0
         self.start_time = None
         self.elapsed_time = 0
+        self.clock = None
+        self.enemies_destroyed = 0
+        self.shots_fired = 0
 
-    def start_timer(self):
-        import time
-
-        self.start_time = time.time()
+    def start_timer(self, clock=None):
+        self.clock = clock
+        self.start_time = time.time() if clock is None else clock.time
 
     def update_time(self):
-        import time
-
         if self.start_time is not None:
-            self.elapsed_time = time.time() - self.start_time
+            now = time.time() if self.clock is None else self.clock.time
+            self.elapsed_time = now - self.start_time
 
     def add_score(self, points):
         self.score += points
 
+    def record_kill(self, points):
+        # An enemy destroyed by a shot or a ram, and what it scored
+        self.enemies_destroyed += 1
+        self.add_score(points)
+
+    def record_shot(self):
+        self.shots_fired += 1
+
     def reset(self):
         self.score = 0
         self.start_time = None
         self.elapsed_time = 0
+        self.clock = None
+        self.enemies_destroyed = 0
+        self.shots_fired = 0
 
     @property
     def get_score(self):
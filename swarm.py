@@ -0,0 +1,317 @@
+import math
+import random
+
+import numpy as np
+
+from clock import WallClock
+from collision import CollisionWorld
+from projectile import OWNER_ENEMY
+from stats import game_stats
+
+# Ship settings, as in Enemy
+SHIP_SIZE = 0.45
+SHIP_SPEED = 0.06
+FIRE_RATE = 1.75
+BULLET_SPEED = 0.025
+BULLET_SIZE = 0.1
+BULLET_DAMAGE = 1
+
+# Tail segments a ram pops, and the points it scores by snake length, as in
+# EnemyManager.check_collision
+RAM_DAMAGE = 2
+RAM_SCORES = (0.5, 1, 1.75)
+
+# Spawn periods a swarm takes to fill up when no batch size is given
+SPAWN_PERIODS = 8
+
+
+class Ship:
+    # Handle onto one live slot of a ShipPool, with the attribute names of
+    # Enemy so code written for EnemyManager.enemies can read a swarm. Slots
+    # move when ships are removed, so handles are only valid until then.
+    __slots__ = ("pool", "index")
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    def _field(name, kind=float):
+        def getter(self):
+            return kind(getattr(self.pool, name)[self.index])
+
+        return property(getter)
+
+    id = _field("id", int)
+    init_x = _field("x")
+    init_y = _field("y")
+    x = _field("target_x")
+    y = _field("target_y")
+    angle = _field("angle")
+    inPosition = _field("in_position", bool)
+    last_fire_time = _field("last_fire_time")
+
+    del _field
+
+    @property
+    def size(self):
+        return self.pool.size
+
+
+class ShipPool:
+    # Fixed-capacity structure of arrays, packed into the first `count` slots
+    # like a ProjectilePool. `slot` maps a ship id to its slot, so ships are
+    # removed by id in constant time by swapping the last ship into the hole.
+    fields = (
+        "id",
+        "x",
+        "y",
+        "prev_x",
+        "prev_y",
+        "target_x",
+        "target_y",
+        "angle",
+        "prev_angle",
+        "in_position",
+        "last_fire_time",
+    )
+
+    def __init__(self, capacity, size=SHIP_SIZE):
+        self.capacity = capacity
+        self.size = size
+        self.count = 0
+        self.next_id = 1
+        self.slot = {}
+        self.id = np.zeros(capacity, dtype=np.uint64)
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.target_x = np.zeros(capacity)
+        self.target_y = np.zeros(capacity)
+        self.angle = np.zeros(capacity)
+        self.prev_angle = np.zeros(capacity)
+        self.in_position = np.zeros(capacity, dtype=bool)
+        self.last_fire_time = np.zeros(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, x, y, target_x, target_y, time):
+        # Returns the new slot, or -1 when the pool is full
+        if self.count == self.capacity:
+            return -1
+        index = self.count
+        ship_id = self.next_id
+        self.next_id += 1
+        self.id[index] = ship_id
+        self.x[index] = self.prev_x[index] = x
+        self.y[index] = self.prev_y[index] = y
+        self.target_x[index] = target_x
+        self.target_y[index] = target_y
+        self.angle[index] = self.prev_angle[index] = 0.0
+        self.in_position[index] = False
+        self.last_fire_time[index] = time
+        self.slot[ship_id] = index
+        self.count += 1
+        return index
+
+    def remove(self, ship_id):
+        # Returns whether the ship was still alive
+        index = self.slot.pop(int(ship_id), None)
+        if index is None:
+            return False
+        last = self.count - 1
+        if index != last:
+            for name in self.fields:
+                values = getattr(self, name)
+                values[index] = values[last]
+            self.slot[int(self.id[index])] = index
+        self.count = last
+        return True
+
+    def rebuild_slots(self):
+        # After the arrays were written wholesale, as by restore_snapshot
+        n = self.count
+        self.slot = dict(zip(self.id[:n].tolist(), range(n)))
+
+
+class EnemySwarm:
+    # EnemyManager for hordes: every ship lives in a ShipPool, and a tick
+    # moves, aims, fires and rams for all of them with array operations. The
+    # ships behave as Enemy ships do; they spawn `spawn_batch` at a time.
+    def __init__(
+        self,
+        screen_leftx,
+        screen_rightx,
+        screen_topy,
+        screen_bottomy,
+        projectile_manager,
+        max_enemies=1000,
+        stats=game_stats,
+        clock=None,
+        rng=None,
+        spawn_batch=None,
+    ):
+        self.ships = ShipPool(max_enemies)
+        self.stats = stats
+        self.clock = WallClock() if clock is None else clock
+        self.rng = random if rng is None else rng
+        self.max_enemies = max_enemies
+        self.screen_bounds = (screen_leftx, screen_rightx, screen_topy, screen_bottomy)
+        self.projectile_manager = projectile_manager
+        self.spawn_rate = 3  # Time in seconds between spawn batches
+        if spawn_batch is None:
+            spawn_batch = max(1, max_enemies // SPAWN_PERIODS)
+        self.spawn_batch = spawn_batch
+        self.last_spawn_time = self.clock.time
+
+    @property
+    def enemies(self):
+        return [Ship(self.ships, index) for index in range(self.ships.count)]
+
+    def update(self, snake, world=None, stats=None):
+        if (
+            self.ships.count < self.max_enemies
+            and self.clock.time - self.last_spawn_time > self.spawn_rate
+        ):
+            self.spawn_enemies(self.spawn_batch)
+            self.last_spawn_time = self.clock.time
+
+        ships = self.ships
+        n = ships.count
+        if n:
+            ships.prev_x[:n] = ships.x[:n]
+            ships.prev_y[:n] = ships.y[:n]
+            ships.prev_angle[:n] = np.where(ships.in_position[:n], ships.angle[:n], 0.0)
+            self.update_positions()
+            self.track_target(snake.getHead)
+
+        self.check_collision(snake, world, stats)
+
+    def spawn_enemies(self, count):
+        # Ships enter above the top edge and fly to a random point, drawn in
+        # the order Enemy draws its own
+        leftx, rightx, topy, bottomy = self.screen_bounds
+        size = self.ships.size
+        for _ in range(min(count, self.max_enemies - self.ships.count)):
+            target_x = self.rng.uniform(leftx + size, rightx - size)
+            target_y = self.rng.uniform(topy + size, bottomy - size)
+            self.ships.spawn(0.0, topy - 2 * size, target_x, target_y, self.clock.time)
+
+    def update_positions(self, speed=SHIP_SPEED):
+        # Enemy.update_position for every ship still flying in
+        ships = self.ships
+        moving = np.flatnonzero(~ships.in_position[: ships.count])
+        if len(moving) == 0:
+            return
+        x = ships.x[moving]
+        y = ships.y[moving]
+        target_x = ships.target_x[moving]
+        target_y = ships.target_y[moving]
+        direction_x = target_x - x
+        direction_y = target_y - y
+        distance = np.hypot(direction_x, direction_y)
+        scale = np.divide(
+            speed, distance, out=np.zeros_like(distance), where=distance != 0
+        )
+        x += direction_x * scale
+        y += direction_y * scale
+
+        arrived = (np.abs(x - target_x) < speed) & (np.abs(y - target_y) < speed)
+        x[arrived] = target_x[arrived]
+        y[arrived] = target_y[arrived]
+        ships.x[moving] = x
+        ships.y[moving] = y
+        ships.in_position[moving[arrived]] = True
+
+    def track_target(self, head):
+        # Enemy.track_target for every ship in position: face the head, and
+        # fire at it once the cooldown has passed
+        ships = self.ships
+        aiming = np.flatnonzero(ships.in_position[: ships.count])
+        if len(aiming) == 0:
+            return
+        x = ships.target_x[aiming]
+        y = ships.target_y[aiming]
+        angle = np.arctan2(head.y - y, head.x - x)
+        ships.angle[aiming] = angle
+
+        now = self.clock.time
+        ready = now - ships.last_fire_time[aiming] >= FIRE_RATE
+        if not ready.any():
+            return
+        ships.last_fire_time[aiming[ready]] = now
+        self.projectile_manager.fire_many(
+            x[ready],
+            y[ready],
+            angle[ready],
+            BULLET_SPEED,
+            size=BULLET_SIZE,
+            damage=BULLET_DAMAGE,
+            owner=OWNER_ENEMY,
+        )
+
+    def index(self, world):
+        # Ships in the "enemies" layer at their target points, as
+        # CollisionWorld.index_enemies places Enemy ships; items are ship ids
+        ships = self.ships
+        n = ships.count
+        return world.set_layer(
+            "enemies",
+            ships.target_x[:n].copy(),
+            ships.target_y[:n].copy(),
+            np.full(n, ships.size),
+            ships.id[:n].copy(),
+        )
+
+    def ship_arrays(self):
+        # (id, x, y, angle) of every ship where it is drawn
+        ships = self.ships
+        n = ships.count
+        return ships.id[:n], ships.x[:n], ships.y[:n], ships.angle[:n]
+
+    def destroy_enemy(self, ship_id):
+        # Returns whether the ship was still alive
+        return self.ships.remove(ship_id)
+
+    def check_collision(self, snake, world=None, stats=None):
+        # EnemyManager.check_collision for the whole swarm: the overlap test
+        # is batched, and only the ships that hit are handled one by one
+        ships = self.ships
+        rammers = np.flatnonzero(ships.in_position[: ships.count])
+        if len(rammers) == 0:
+            return
+        if stats is None:
+            stats = self.stats
+        if world is None:
+            world = CollisionWorld()
+            world.index_snake(snake)
+
+        first_segment = world.overlaps(
+            "snake",
+            ships.target_x[rammers],
+            ships.target_y[rammers],
+            np.full(len(rammers), ships.size),
+        )
+        hits = first_segment >= 0
+        for ship_id, segment in zip(
+            ships.id[rammers[hits]].tolist(), first_segment[hits].tolist()
+        ):
+            # Earlier rams pop tail segments, so the hit must still be attached
+            if segment < snake.getSize:
+                snake.shrink(RAM_DAMAGE)
+                self.destroy_enemy(ship_id)
+
+                snake_len = snake.getSize
+                if snake_len < 5:
+                    stats.record_kill(RAM_SCORES[0])
+                elif snake_len < 7:
+                    stats.record_kill(RAM_SCORES[1])
+                else:
+                    stats.record_kill(RAM_SCORES[2])
+
+
+def swarm_angle(prev_angle, angle, in_position, alpha):
+    # Enemy.interpolate's facing for arrays of ships
+    turn = (angle - prev_angle + math.pi) % (2 * math.pi) - math.pi
+    return np.where(in_position, prev_angle + turn * alpha, 0.0)
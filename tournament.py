@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from multiprocessing import Pool
+
+from controllers import load_controller
+
+DEFAULT_MAX_TICKS = 20000
+
+
+def match_seeds(seed, games):
+    # Seeds shared by every controller, so each plays the same arenas
+    rng = random.Random(seed)
+    return [rng.randrange(1 << 63) for _ in range(games)]
+
+
+def play_match(match):
+    # One headless game of a controller; runs in a worker process. Everything
+    # random in the match derives from its seed, so results don't depend on
+    # which worker plays it or in what order.
+    from game import Game
+    from stats import GameStats
+
+    controller_name, seed, max_ticks, world_size, run_stats = match
+    random.seed(seed)
+    controller = load_controller(controller_name)(seed)
+    game = Game(headless=True, stats=GameStats(), seed=seed, world_size=world_size)
+    if run_stats:
+        from runstore import RunRecorder
+
+        game.run_recorder = RunRecorder(controller_name, seed)
+
+    start = time.perf_counter()
+    while not game.snake.deadFlag and game.tick < max_ticks:
+        game.step(controller.act(game))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "controller": controller_name,
+        "seed": seed,
+        "score": game.stats.get_score,
+        "time_alive": game.stats.get_time,
+        "ticks": game.tick,
+        "length": game.snake.getSize,
+        "died": game.snake.deadFlag,
+        "wall_time": elapsed,
+        "worker": os.getpid(),
+    }
+    if run_stats:
+        # Intervals and score events, for the parent to store
+        result["run"] = game.run_recorder.finish(game)
+    return result
+
+
+def run_tournament(
+    controllers,
+    games,
+    seed=0,
+    workers=None,
+    max_ticks=None,
+    world_size=None,
+    run_stats=False,
+):
+    # Yield match results as they finish, spread over `workers` processes
+    # (all cores by default; 0 plays them in this process). With run_stats
+    # each result also holds a "run" for RunStore.record_run.
+    if max_ticks is None:
+        max_ticks = DEFAULT_MAX_TICKS
+    for name in controllers:
+        load_controller(name)  # Fail before starting any worker
+    matches = [
+        (name, match_seed, max_ticks, world_size, run_stats)
+        for match_seed in match_seeds(seed, games)
+        for name in controllers
+    ]
+
+    if workers == 0:
+        for match in matches:
+            yield play_match(match)
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # A few chunks per worker keeps them all busy to the end without paying
+    # for a round trip per match
+    chunksize = max(1, len(matches) // (workers * 4))
+    with Pool(workers) as pool:
+        yield from pool.imap_unordered(play_match, matches, chunksize)
+
+
+def aggregate(results):
+    # Per-controller score and time alive summaries
+    by_controller = {}
+    for result in results:
+        by_controller.setdefault(result["controller"], []).append(result)
+
+    summary = {}
+    for name, played in by_controller.items():
+        scores = [result["score"] for result in played]
+        alive = [result["time_alive"] for result in played]
+        summary[name] = {
+            "games": len(played),
+            "mean_score": statistics.fmean(scores),
+            "stdev_score": statistics.stdev(scores) if len(scores) > 1 else 0.0,
+            "median_score": statistics.median(scores),
+            "mean_time_alive": statistics.fmean(alive),
+            "median_time_alive": statistics.median(alive),
+            "deaths": sum(result["died"] for result in played),
+            "ticks": sum(result["ticks"] for result in played),
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play controllers headlessly")
+    parser.add_argument(
+        "controllers",
+        nargs="+",
+        help="built-in controller names or module:Class paths",
+    )
+    parser.add_argument("--games", type=int, default=32, help="games per controller")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="processes (default: all cores)"
+    )
+    parser.add_argument("--max-ticks", type=int, default=DEFAULT_MAX_TICKS)
+    parser.add_argument(
+        "--world-size", type=float, default=None, help="side of the square world"
+    )
+    parser.add_argument(
+        "--jsonl", metavar="PATH", help="stream every match result to PATH"
+    )
+    parser.add_argument(
+        "--stats-db",
+        metavar="PATH",
+        help="add every match's run stats to a SQLite file, labelled by controller",
+    )
+    args = parser.parse_args()
+
+    results = []
+    start = time.perf_counter()
+    output = open(args.jsonl, "w") if args.jsonl else None
+    store = None
+    if args.stats_db:
+        from runstore import RunStore
+
+        store = RunStore(args.stats_db)
+    try:
+        for result in run_tournament(
+            args.controllers,
+            args.games,
+            args.seed,
+            args.workers,
+            args.max_ticks,
+            args.world_size,
+            store is not None,
+        ):
+            if store is not None:
+                store.record_run(result.pop("run"))
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+    finally:
+        if output is not None:
+            output.close()
+        if store is not None:
+            store.close()
+    elapsed = time.perf_counter() - start
+
+    summaries = aggregate(results)
+    for name in dict.fromkeys(args.controllers):
+        summary = summaries[name]
+        print(
+            name
+            + ": mean score "
+            + format(summary["mean_score"], ".2f")
+            + " (sd "
+            + format(summary["stdev_score"], ".2f")
+            + "), mean time alive "
+            + format(summary["mean_time_alive"], ".1f")
+            + "s over "
+            + str(summary["games"])
+            + " games"
+        )
+    ticks = sum(result["ticks"] for result in results)
+    print(
+        str(len(results))
+        + " games, "
+        + str(ticks)
+        + " ticks in "
+        + format(elapsed, ".2f")
+        + "s ("
+        + format(ticks / elapsed, ".0f")
+        + " ticks/s)"
+    )
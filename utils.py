@@ -1,8 +1,26 @@
+from functools import lru_cache
+from math import ceil as ceil
 from math import cos as cos
 from math import sin as sin
 from math import pi as PI
+from math import floor as floor
 
-from OpenGL.GL import *
+# Circle level of detail: longest on-screen edge and segment count limits
+CIRCLE_EDGE_PIXELS = 3.0
+MIN_CIRCLE_SEGMENTS = 6
+MAX_CIRCLE_SEGMENTS = 48
+DEFAULT_CIRCLE_SEGMENTS = 18
+
+# Side of the square world centred on the origin, and of the part of it the
+# camera shows
+WORLD_SIZE = 10.0
+VIEW_SIZE = 10.0
+
+
+def world_bounds(size=WORLD_SIZE):
+    # (leftx, rightx, topy, bottomy) of a square world of side `size`
+    half = size / 2
+    return -half, half, -half, half
 
 
 class Constraint:
@@ -10,7 +28,273 @@ class Constraint:
         self.id1 = id1
         self.id2 = id2
         self.distance = distance
-        self.stiffness = 0.1
+
+
+class BroadphaseStats:
+    def __init__(self):
+        self.particles = 0
+        self.cells = 0
+        self.candidate_pairs = 0
+        self.contacts = 0
+
+    def record(self, particles, cells, candidate_pairs, contacts):
+        self.particles = particles
+        self.cells = cells
+        self.candidate_pairs = candidate_pairs
+        self.contacts = contacts
+
+    def as_dict(self):
+        return {
+            "particles": self.particles,
+            "cells": self.cells,
+            "candidate_pairs": self.candidate_pairs,
+            "contacts": self.contacts,
+        }
+
+
+class SolverStats:
+    def __init__(self):
+        self.constraints = 0
+        self.iterations = 0
+        self.residual = 0.0
+
+    def record(self, constraints, iterations, residual):
+        self.constraints = constraints
+        self.iterations = iterations
+        self.residual = residual
+
+    def as_dict(self):
+        return {
+            "constraints": self.constraints,
+            "iterations": self.iterations,
+            "residual": self.residual,
+        }
+
+
+class SpatialHash:
+    # Uniform grid keyed by integer cell coordinates. With a cell size of at
+    # least twice the largest radius, every overlapping pair of circles lies
+    # in the same or in adjacent cells.
+    neighbour_offsets = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.keys = []
+        self.built_cell_size = None
+
+    def build(self, xs, ys):
+        inv_cell_size = 1.0 / self.cell_size
+        cells = {}
+        keys = []
+        for index, (x, y) in enumerate(zip(xs, ys)):
+            key = (floor(x * inv_cell_size), floor(y * inv_cell_size))
+            keys.append(key)
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [index]
+            else:
+                bucket.append(index)
+        self.cells = cells
+        self.keys = keys
+        self.built_cell_size = self.cell_size
+
+    def update(self, xs, ys):
+        # Bring the hash up to date with new positions of the same points,
+        # moving only the points that changed cell. Rebuilds when the number
+        # of points or the cell size changed.
+        if len(xs) != len(self.keys) or self.cell_size != self.built_cell_size:
+            self.build(xs, ys)
+            return
+        inv_cell_size = 1.0 / self.cell_size
+        keys = self.keys
+        for index, (x, y) in enumerate(zip(xs, ys)):
+            key = (floor(x * inv_cell_size), floor(y * inv_cell_size))
+            if key != keys[index]:
+                self.relocate(index, key)
+
+    def relocate(self, index, key):
+        cells = self.cells
+        bucket = cells[self.keys[index]]
+        bucket.remove(index)
+        if not bucket:
+            del cells[self.keys[index]]
+        bucket = cells.get(key)
+        if bucket is None:
+            cells[key] = [index]
+        else:
+            bucket.append(index)
+        self.keys[index] = key
+
+    def query(self, x, y, radius):
+        # Points in every cell overlapping the square of half-width `radius`
+        # around (x, y)
+        inv_cell_size = 1.0 / self.cell_size
+        cells = self.cells
+        found = []
+        for cx in range(
+            floor((x - radius) * inv_cell_size), floor((x + radius) * inv_cell_size) + 1
+        ):
+            for cy in range(
+                floor((y - radius) * inv_cell_size),
+                floor((y + radius) * inv_cell_size) + 1,
+            ):
+                bucket = cells.get((cx, cy))
+                if bucket is not None:
+                    found.extend(bucket)
+        return found
+
+    def candidate_pairs(self):
+        # Pairs inside each cell plus pairs with the four "forward" neighbours,
+        # so every unordered pair is produced exactly once
+        pairs = []
+        cells = self.cells
+        for (cx, cy), bucket in cells.items():
+            count = len(bucket)
+            for a in range(count):
+                for b in range(a + 1, count):
+                    pairs.append((bucket[a], bucket[b]))
+            for dx, dy in self.neighbour_offsets:
+                other = cells.get((cx + dx, cy + dy))
+                if other is not None:
+                    for i in bucket:
+                        for j in other:
+                            pairs.append((i, j))
+        return pairs
+
+
+class Viewport:
+    # Visible world rectangle and the window size it is mapped onto
+    def __init__(self, leftx, rightx, topy, bottomy, width, height):
+        self.leftx = leftx
+        self.rightx = rightx
+        self.topy = topy
+        self.bottomy = bottomy
+        self.width = width
+        self.height = height
+
+    @property
+    def pixels_per_unit(self):
+        return min(
+            self.width / abs(self.rightx - self.leftx),
+            self.height / abs(self.bottomy - self.topy),
+        )
+
+    def is_visible(self, x, y, radius):
+        return (
+            min(self.leftx, self.rightx) - radius <= x
+            and x <= max(self.leftx, self.rightx) + radius
+            and min(self.topy, self.bottomy) - radius <= y
+            and y <= max(self.topy, self.bottomy) + radius
+        )
+
+    def visible_mask(self, x, y, radius):
+        # is_visible over arrays of centres
+        return (
+            (min(self.leftx, self.rightx) - radius <= x)
+            & (x <= max(self.leftx, self.rightx) + radius)
+            & (min(self.topy, self.bottomy) - radius <= y)
+            & (y <= max(self.topy, self.bottomy) + radius)
+        )
+
+    def circle_segments(self, radius):
+        return circle_segments(radius * self.pixels_per_unit)
+
+
+class Camera:
+    # Slides a viewport of `view_size` world units over the world to keep a
+    # point in its centre, stopping at the world's edges. Worlds no larger
+    # than the view are shown whole.
+    def __init__(self, viewport, leftx, rightx, topy, bottomy, view_size=VIEW_SIZE):
+        self.viewport = viewport
+        self.bounds = (leftx, rightx, topy, bottomy)
+        self.view_width = min(view_size, rightx - leftx)
+        self.view_height = min(view_size, bottomy - topy)
+        self.follow((leftx + rightx) / 2, (topy + bottomy) / 2)
+
+    def follow(self, x, y):
+        leftx, rightx, topy, bottomy = self.bounds
+        left = min(max(x - self.view_width / 2, leftx), rightx - self.view_width)
+        top = min(max(y - self.view_height / 2, topy), bottomy - self.view_height)
+        viewport = self.viewport
+        viewport.leftx = left
+        viewport.rightx = left + self.view_width
+        viewport.topy = top
+        viewport.bottomy = top + self.view_height
+
+    def apply(self):
+        # Load the viewport as the projection, y growing downwards
+        from OpenGL.GL import GL_MODELVIEW, GL_PROJECTION, glLoadIdentity, glMatrixMode
+        from OpenGL.GLU import gluOrtho2D
+
+        viewport = self.viewport
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        gluOrtho2D(viewport.leftx, viewport.rightx, viewport.bottomy, viewport.topy)
+        glMatrixMode(GL_MODELVIEW)
+
+
+def circle_segments(radius_pixels):
+    # Enough segments that no edge is longer than CIRCLE_EDGE_PIXELS on screen
+    segments = ceil(2 * PI * radius_pixels / CIRCLE_EDGE_PIXELS)
+    return max(MIN_CIRCLE_SEGMENTS, min(MAX_CIRCLE_SEGMENTS, segments))
+
+
+@lru_cache(maxsize=None)
+def unit_circle(segments):
+    # Rim points of a unit circle, first point repeated at the end
+    return tuple(
+        (cos(2 * PI * i / segments), sin(2 * PI * i / segments))
+        for i in range(segments + 1)
+    )
+
+
+@lru_cache(maxsize=None)
+def unit_circle_fan(segments):
+    # Unit circle as a GL_TRIANGLE_FAN vertex array: centre, then the rim
+    import ctypes
+
+    vertices = [0.0, 0.0]
+    for x, y in unit_circle(segments):
+        vertices.append(x)
+        vertices.append(y)
+    return (ctypes.c_float * len(vertices))(*vertices)
+
+
+def draw_circles(circles, viewport=None):
+    # (x, y, radius) circles drawn with the shared unit circle mesh, placed
+    # and sized by the modelview matrix. GL is imported and the vertex array
+    # enabled once for the whole batch.
+    from OpenGL.GL import (
+        GL_FLOAT,
+        GL_TRIANGLE_FAN,
+        GL_VERTEX_ARRAY,
+        glDisableClientState,
+        glDrawArrays,
+        glEnableClientState,
+        glPopMatrix,
+        glPushMatrix,
+        glScalef,
+        glTranslatef,
+        glVertexPointer,
+    )
+
+    glEnableClientState(GL_VERTEX_ARRAY)
+    for x, y, r in circles:
+        if viewport is None:
+            segments = DEFAULT_CIRCLE_SEGMENTS
+        elif viewport.is_visible(x, y, r):
+            segments = viewport.circle_segments(r)
+        else:
+            continue
+
+        glPushMatrix()
+        glTranslatef(x, y, 0)
+        glScalef(r, r, 1.0)
+        glVertexPointer(2, GL_FLOAT, 0, unit_circle_fan(segments))
+        glDrawArrays(GL_TRIANGLE_FAN, 0, segments + 2)
+        glPopMatrix()
+    glDisableClientState(GL_VERTEX_ARRAY)
 
 
 class Particle:
@@ -24,15 +308,5 @@ class Particle:
         self.r = particle_radii
         self.inv_mass = 1.0
 
-    def draw(self):
-        i = 0.0
-        glLineWidth(1)
-        glBegin(GL_TRIANGLE_FAN)
-        glVertex2f(self.x, self.y)
-        while i <= 360.0:
-            glVertex2f(
-                self.r * cos(PI * i / 180.0) + self.x,
-                self.r * sin(PI * i / 180.0) + self.y,
-            )
-            i += 360.0 / 18.0
-        glEnd()
+    def draw(self, viewport=None):
+        draw_circles(((self.x, self.y, self.r),), viewport)
@@ -0,0 +1,604 @@
+import argparse
+import time
+
+import numpy as np
+
+from array_physics import (
+    ParticleArray,
+    grid_candidate_pairs,
+    project_chain_constraints,
+    project_collision_pairs,
+)
+from collision import swept_touching
+from projectile import OWNER_ENEMY
+from projectile import OWNER_SNAKE
+from snake import SnakePhysics
+from utils import world_bounds
+
+# Per-environment move actions, matching the directions of Snake.move
+MOVE_NONE = 0
+MOVE_UP = 1
+MOVE_DOWN = 2
+MOVE_LEFT = 3
+MOVE_RIGHT = 4
+MOVE_DIRECTIONS = np.array(
+    [[0.0, 0.0], [0.0, -0.25], [0.0, 0.25], [-0.25, 0.0], [0.25, 0.0]]
+)
+
+
+class VectorGame:
+    # N independent arenas stepped in lockstep. Every entity type lives in
+    # shared (num_envs, slots) arrays and each tick runs the rules of
+    # Game.update (SnakePhysics, EnemyManager.update, ProjectileManager
+    # and food collisions) as batched operations. Game time advances by
+    # time_delta per tick. Environments whose snake dies are reset at the end
+    # of the step that killed them.
+    def __init__(
+        self,
+        num_envs,
+        seed=None,
+        initial_length=3,
+        screen_leftx=-5,
+        screen_rightx=5,
+        screen_topy=-5,
+        screen_bottomy=5,
+        max_enemies=3,
+        max_projectiles=128,
+        snake_capacity=64,
+        world_size=None,
+    ):
+        # A world_size replaces the screen bounds, as in Game
+        if world_size is not None:
+            screen_leftx, screen_rightx, screen_topy, screen_bottomy = world_bounds(
+                world_size
+            )
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.initial_length = initial_length
+        self.leftx = screen_leftx
+        self.rightx = screen_rightx
+        self.topy = screen_topy
+        self.bottomy = screen_bottomy
+
+        # Snake settings, as in Snake and SnakePhysics
+        self.particle_radii = 0.1
+        self.particle_distance = self.particle_radii * 2.5
+        self.time_delta = 1 / 64.0
+        self.head_speed = SnakePhysics.head_speed
+        self.friction = SnakePhysics.friction
+        self.fire_rate = 0.15
+        self.bullet_speed = 0.025
+        self.bullet_size = 0.1
+        self.bullet_damage = 1
+
+        # Enemy settings, as in Enemy and EnemyManager
+        self.max_enemies = max_enemies
+        self.enemy_size = 0.45
+        self.enemy_speed = 0.06
+        self.enemy_fire_rate = 1.75
+        self.spawn_rate = 3
+
+        self.food_size = 0.12
+
+        # Arenas are laid side by side along x for the shared broadphase
+        self.arena_stride = (self.rightx - self.leftx) + 10.0
+
+        self.capacity = max(snake_capacity, initial_length)
+        self.particles = ParticleArray(num_envs * self.capacity)
+        self.particles.count = num_envs * self.capacity
+        self.length = np.zeros(num_envs, dtype=np.intp)
+        self.direction = np.zeros((num_envs, 2))
+        self.dead = np.zeros(num_envs, dtype=bool)
+        self.score = np.zeros(num_envs)
+        self.time = np.zeros(num_envs)
+        self.ticks = np.zeros(num_envs, dtype=np.int64)
+        self.last_fire_time = np.zeros(num_envs)
+
+        self.food_x = np.zeros(num_envs)
+        self.food_y = np.zeros(num_envs)
+
+        shape = (num_envs, max_enemies)
+        self.enemy_alive = np.zeros(shape, dtype=bool)
+        self.enemy_in_position = np.zeros(shape, dtype=bool)
+        self.enemy_x = np.zeros(shape)
+        self.enemy_y = np.zeros(shape)
+        self.enemy_init_x = np.zeros(shape)
+        self.enemy_init_y = np.zeros(shape)
+        self.enemy_angle = np.zeros(shape)
+        self.enemy_last_fire_time = np.zeros(shape)
+        self.last_spawn_time = np.zeros(num_envs)
+
+        shape = (num_envs, max_projectiles)
+        self.projectile_alive = np.zeros(shape, dtype=bool)
+        self.projectile_x = np.zeros(shape)
+        self.projectile_y = np.zeros(shape)
+        self.projectile_prev_x = np.zeros(shape)
+        self.projectile_prev_y = np.zeros(shape)
+        self.projectile_vx = np.zeros(shape)
+        self.projectile_vy = np.zeros(shape)
+        self.projectile_size = np.zeros(shape)
+        self.projectile_damage = np.zeros(shape, dtype=np.intp)
+        self.projectile_owner = np.zeros(shape, dtype=np.int8)
+
+        # Score and length of the most recently finished episode per arena
+        self.episode_score = np.zeros(num_envs)
+        self.episode_ticks = np.zeros(num_envs, dtype=np.int64)
+        self.episodes_finished = 0
+
+        self.reset(np.ones(num_envs, dtype=bool))
+
+    def field(self, name):
+        # (num_envs, capacity) view of one particle field
+        return getattr(self.particles, name).reshape(self.num_envs, self.capacity)
+
+    def live_mask(self):
+        return np.arange(self.capacity) < self.length[:, None]
+
+    def reserve(self, length):
+        if length <= self.capacity:
+            return
+        capacity = max(length, self.capacity * 2)
+        particles = ParticleArray(self.num_envs * capacity)
+        particles.count = self.num_envs * capacity
+        for name in ParticleArray.fields:
+            grown = getattr(particles, name).reshape(self.num_envs, capacity)
+            grown[:, : self.capacity] = self.field(name)
+        self.particles = particles
+        self.capacity = capacity
+
+    def reset(self, mask):
+        envs = np.flatnonzero(mask)
+        if len(envs) == 0:
+            return
+
+        # Snake.initialize_snake
+        self.reserve(self.initial_length)
+        column = np.arange(self.capacity)
+        x = column * self.particle_radii * 2.1
+        y = self.topy + 3 * self.particle_radii
+        for name, value in (
+            ("x", x),
+            ("y", y),
+            ("px", x),
+            ("py", y),
+            ("vx", 0.0),
+            ("vy", 0.0),
+            ("r", self.particle_radii),
+            ("inv_mass", 1.0),
+        ):
+            self.field(name)[envs] = value
+        self.length[envs] = self.initial_length
+        self.direction[envs] = 0.0
+        self.dead[envs] = False
+        self.score[envs] = 0.0
+        self.time[envs] = 0.0
+        self.ticks[envs] = 0
+        self.last_fire_time[envs] = 0.0
+
+        self.enemy_alive[envs] = False
+        self.last_spawn_time[envs] = 0.0
+        self.projectile_alive[envs] = False
+        self.spawn_food(envs)
+
+    def spawn_food(self, envs):
+        # One food item per arena, placed anywhere inside the walls rather
+        # than on a FoodField grid
+        self.food_x[envs] = self.rng.uniform(
+            self.leftx + self.food_size, self.rightx - self.food_size, len(envs)
+        )
+        self.food_y[envs] = self.rng.uniform(
+            self.topy + self.food_size, self.bottomy - self.food_size, len(envs)
+        )
+
+    def step(self, moves, shoot=None, targets=None):
+        # moves: (num_envs,) MOVE_* codes; shoot: (num_envs,) bools with
+        # (num_envs, 2) game-space targets. Returns per-arena score deltas and
+        # done flags; done arenas are already reset when this returns.
+        moves = np.asarray(moves)
+        turning = moves != MOVE_NONE
+        self.direction[turning] = MOVE_DIRECTIONS[moves[turning]]
+        if shoot is not None:
+            self.snake_shoot(np.flatnonzero(shoot), np.asarray(targets))
+
+        previous_score = self.score.copy()
+
+        # Game.update
+        self.time += self.time_delta
+        self.ticks += 1
+        self.update_snakes()
+        self.projectile_prev_x[:] = self.projectile_x
+        self.projectile_prev_y[:] = self.projectile_y
+        self.projectile_x += self.projectile_vx
+        self.projectile_y += self.projectile_vy
+        self.update_enemies()
+        self.check_food_collisions()
+        self.check_projectile_collisions()
+
+        rewards = self.score - previous_score
+        dones = self.dead.copy()
+        if dones.any():
+            self.episode_score[dones] = self.score[dones]
+            self.episode_ticks[dones] = self.ticks[dones]
+            self.episodes_finished += int(dones.sum())
+            self.reset(dones)
+        return rewards, dones
+
+    def update_snakes(self):
+        # SnakePhysics.apply_physics for every arena at once
+        p = self.particles
+        capacity = self.capacity
+        live = np.flatnonzero(self.live_mask())
+        heads = np.arange(self.num_envs) * capacity
+        body = live[live % capacity != 0]
+
+        p.px[heads] += self.direction[:, 0] * self.head_speed
+        p.py[heads] += self.direction[:, 1] * self.head_speed
+        p.vx[body] *= self.friction
+        p.vy[body] *= self.friction
+        p.px[body] = p.x[body] + p.vx[body] * self.time_delta
+        p.py[body] = p.y[body] + p.vy[body] * self.time_delta
+
+        # Shared broadphase over all arenas, offset so they never share cells
+        offset = (live // capacity) * self.arena_stride
+        cell_size = max(2 * self.particle_radii, 2 * float(p.r[live].max()))
+        id1, id2, _ = grid_candidate_pairs(p.x[live] + offset, p.y[live], cell_size)
+        project_collision_pairs(p, live[id1], live[id2])
+
+        # Every body is a chain, so each arena is one column of links up to
+        # the longest snake; links past an arena's own tail stay inactive
+        longest = int(self.length.max())
+        link = np.arange(longest - 1)[:, None]
+        project_chain_constraints(
+            self.field("px").T[:longest],
+            self.field("py").T[:longest],
+            self.field("inv_mass").T[:longest],
+            np.full((longest - 1, self.num_envs), self.particle_distance),
+            SnakePhysics.max_solver_iterations,
+            SnakePhysics.solver_tolerance,
+            active=link < self.length - 1,
+        )
+
+        p.vx[live] = (p.px[live] - p.x[live]) / self.time_delta
+        p.vy[live] = (p.py[live] - p.y[live]) / self.time_delta
+        p.x[live] = p.px[live]
+        p.y[live] = p.py[live]
+
+        # Snake.check_self_collision and check_wall_collision
+        x = self.field("x")
+        y = self.field("y")
+        r = self.field("r")
+        head_x = x[:, 0:1]
+        head_y = y[:, 0:1]
+        distance_squared = (x - head_x) ** 2 + (y - head_y) ** 2
+        reach = r[:, 0:1] + r
+        segment = self.live_mask()
+        segment[:, :2] = False
+        self_collision = (segment & (distance_squared < reach * reach)).any(axis=1)
+        wall_collision = (
+            (x[:, 0] < self.leftx)
+            | (x[:, 0] > self.rightx)
+            | (y[:, 0] < self.topy)
+            | (y[:, 0] > self.bottomy)
+        )
+        self.dead |= self_collision | wall_collision
+
+    def shrink(self, envs, damage):
+        # Snake.shrink; envs may repeat, each entry applying its damage in turn
+        total = np.bincount(envs, weights=damage, minlength=self.num_envs)
+        total = total.astype(np.intp)
+        hit = total > 0
+        lethal = hit & (self.length <= total)
+        self.dead |= lethal
+        survivors = hit & ~lethal
+        self.length[survivors] -= total[survivors]
+
+    def grow(self, envs):
+        # Snake.grow: the new particle starts on top of the tail
+        self.reserve(int(self.length[envs].max()) + 1)
+        tail = self.length[envs] - 1
+        for name in ("x", "y", "r"):
+            values = self.field(name)
+            values[envs, tail + 1] = values[envs, tail]
+        self.field("px")[envs, tail + 1] = self.field("x")[envs, tail]
+        self.field("py")[envs, tail + 1] = self.field("y")[envs, tail]
+        self.field("vx")[envs, tail + 1] = 0.0
+        self.field("vy")[envs, tail + 1] = 0.0
+        self.field("inv_mass")[envs, tail + 1] = 1.0
+        self.length[envs] += 1
+
+    def fire(self, envs, x, y, angle, speed, size, damage, owner):
+        # ProjectileManager.fire into the first free slot of each arena; envs
+        # must be unique. Shots into a full arena are dropped.
+        slot = np.argmin(self.projectile_alive[envs], axis=1)
+        free = ~self.projectile_alive[envs, slot]
+        envs, slot = envs[free], slot[free]
+        angle = np.broadcast_to(angle, free.shape)[free]
+        self.projectile_alive[envs, slot] = True
+        x = np.broadcast_to(x, free.shape)[free]
+        y = np.broadcast_to(y, free.shape)[free]
+        self.projectile_x[envs, slot] = self.projectile_prev_x[envs, slot] = x
+        self.projectile_y[envs, slot] = self.projectile_prev_y[envs, slot] = y
+        self.projectile_vx[envs, slot] = np.cos(angle) * speed
+        self.projectile_vy[envs, slot] = np.sin(angle) * speed
+        self.projectile_size[envs, slot] = size
+        self.projectile_damage[envs, slot] = damage
+        self.projectile_owner[envs, slot] = owner
+
+    def snake_shoot(self, envs, targets):
+        # Snake.shoot
+        ready = self.time[envs] - self.last_fire_time[envs] >= self.fire_rate
+        envs = envs[ready]
+        if len(envs) == 0:
+            return
+        head_x = self.field("x")[envs, 0]
+        head_y = self.field("y")[envs, 0]
+        direction_x = targets[envs, 0] - head_x
+        direction_y = targets[envs, 1] - head_y
+        self.last_fire_time[envs] = self.time[envs]
+        self.fire(
+            envs,
+            head_x + direction_x * 0.1,
+            head_y + direction_y * 0.1,
+            np.arctan2(direction_y, direction_x),
+            self.bullet_speed,
+            self.bullet_size,
+            self.bullet_damage,
+            OWNER_SNAKE,
+        )
+
+    def update_enemies(self):
+        # EnemyManager.update: spawn
+        spawning = (self.enemy_alive.sum(axis=1) < self.max_enemies) & (
+            self.time - self.last_spawn_time > self.spawn_rate
+        )
+        envs = np.flatnonzero(spawning)
+        if len(envs):
+            slot = np.argmin(self.enemy_alive[envs], axis=1)
+            size = self.enemy_size
+            self.enemy_alive[envs, slot] = True
+            self.enemy_in_position[envs, slot] = False
+            self.enemy_init_x[envs, slot] = 0.0
+            self.enemy_init_y[envs, slot] = self.topy - 2 * size
+            self.enemy_x[envs, slot] = self.rng.uniform(
+                self.leftx + size, self.rightx - size, len(envs)
+            )
+            self.enemy_y[envs, slot] = self.rng.uniform(
+                self.topy + size, self.bottomy - size, len(envs)
+            )
+            self.enemy_angle[envs, slot] = 0.0
+            self.enemy_last_fire_time[envs, slot] = self.time[envs]
+            self.last_spawn_time[envs] = self.time[envs]
+
+        # Enemy.update_position
+        speed = self.enemy_speed
+        direction_x = self.enemy_x - self.enemy_init_x
+        direction_y = self.enemy_y - self.enemy_init_y
+        distance = np.sqrt(direction_x**2 + direction_y**2)
+        moving = self.enemy_alive & (distance != 0)
+        safe_distance = np.where(moving, distance, 1.0)
+        self.enemy_init_x += np.where(moving, direction_x / safe_distance * speed, 0)
+        self.enemy_init_y += np.where(moving, direction_y / safe_distance * speed, 0)
+        arrived = (
+            self.enemy_alive
+            & (np.abs(self.enemy_init_x - self.enemy_x) < speed)
+            & (np.abs(self.enemy_init_y - self.enemy_y) < speed)
+        )
+        self.enemy_init_x[arrived] = self.enemy_x[arrived]
+        self.enemy_init_y[arrived] = self.enemy_y[arrived]
+        self.enemy_in_position |= arrived
+
+        # Enemy.track_target
+        head_x = self.field("x")[:, 0:1]
+        head_y = self.field("y")[:, 0:1]
+        tracking = self.enemy_alive & self.enemy_in_position
+        angle = np.arctan2(head_y - self.enemy_y, head_x - self.enemy_x)
+        self.enemy_angle = np.where(tracking, angle, self.enemy_angle)
+        ready = tracking & (
+            self.time[:, None] - self.enemy_last_fire_time >= self.enemy_fire_rate
+        )
+        self.enemy_last_fire_time[ready] = np.broadcast_to(
+            self.time[:, None], ready.shape
+        )[ready]
+        for slot in range(self.max_enemies):
+            envs = np.flatnonzero(ready[:, slot])
+            if len(envs):
+                self.fire(
+                    envs,
+                    self.enemy_x[envs, slot],
+                    self.enemy_y[envs, slot],
+                    angle[envs, slot],
+                    self.bullet_speed,
+                    self.bullet_size,
+                    self.bullet_damage,
+                    OWNER_ENEMY,
+                )
+
+        # EnemyManager.check_collision, one enemy slot at a time so repeated
+        # rams in one arena shrink the snake in turn
+        live = self.live_mask()
+        x = self.field("x")
+        y = self.field("y")
+        r = self.field("r")
+        for slot in range(self.max_enemies):
+            ramming = self.enemy_alive[:, slot] & self.enemy_in_position[:, slot]
+            if not ramming.any():
+                continue
+            reach = self.enemy_size + r
+            distance_squared = (x - self.enemy_x[:, slot : slot + 1]) ** 2 + (
+                y - self.enemy_y[:, slot : slot + 1]
+            ) ** 2
+            hit = ramming & (live & (distance_squared < reach * reach)).any(axis=1)
+            envs = np.flatnonzero(hit)
+            if len(envs) == 0:
+                continue
+            self.shrink(envs, np.full(len(envs), 2))
+            self.enemy_alive[envs, slot] = False
+            self.score[envs] += self.length_bonus(envs, (0.5, 1, 1.75))
+            live = self.live_mask()
+
+    def length_bonus(self, envs, points):
+        snake_len = self.length[envs]
+        return np.where(
+            snake_len < 5, points[0], np.where(snake_len < 7, points[1], points[2])
+        )
+
+    def check_food_collisions(self):
+        # FoodField.eat for the one item per arena, Snake.grow and a respawn
+        head_x = self.field("x")[:, 0]
+        head_y = self.field("y")[:, 0]
+        reach = self.field("r")[:, 0] + self.particle_radii
+        distance_squared = (head_x - self.food_x) ** 2 + (head_y - self.food_y) ** 2
+        envs = np.flatnonzero(distance_squared < reach * reach)
+        if len(envs):
+            self.grow(envs)
+            self.spawn_food(envs)
+
+    def projectile_sweeps(self, envs, slots, body_x, body_y, body_r):
+        # (hits, bodies) matrix of the projectiles at (envs, slots), swept
+        # from their previous positions, against one row of bodies per hit
+        return swept_touching(
+            self.projectile_prev_x[envs, slots][:, None],
+            self.projectile_prev_y[envs, slots][:, None],
+            self.projectile_x[envs, slots][:, None],
+            self.projectile_y[envs, slots][:, None],
+            self.projectile_size[envs, slots][:, None],
+            body_x,
+            body_y,
+            body_r,
+        )
+
+    def check_projectile_collisions(self):
+        # ProjectileManager.check_collisions
+        alive = self.projectile_alive
+        alive &= (
+            (self.leftx <= self.projectile_x)
+            & (self.projectile_x <= self.rightx)
+            & (self.topy <= self.projectile_y)
+            & (self.projectile_y <= self.bottomy)
+        )
+
+        # Enemy projectiles against the snake body, swept from their previous
+        # positions. As in check_collisions, projectiles are taken in slot
+        # order and a hit only counts while the first segment it touched is
+        # still attached after the damage of earlier hits.
+        shooting = alive & (self.projectile_owner == OWNER_ENEMY)
+        envs, slots = np.nonzero(shooting)
+        if len(envs):
+            touching = self.live_mask()[envs] & self.projectile_sweeps(
+                envs,
+                slots,
+                self.field("x")[envs],
+                self.field("y")[envs],
+                self.field("r")[envs],
+            )
+            first_segment = np.full(shooting.shape, -1, dtype=np.intp)
+            first_segment[envs, slots] = np.where(
+                touching.any(axis=1), np.argmax(touching, axis=1), -1
+            )
+            for slot in np.flatnonzero((first_segment >= 0).any(axis=0)):
+                segment = first_segment[:, slot]
+                envs = np.flatnonzero((0 <= segment) & (segment < self.length))
+                if len(envs) == 0:
+                    continue
+                self.shrink(envs, self.projectile_damage[envs, slot])
+                alive[envs, slot] = False
+
+        # Snake projectiles against enemies. As in check_collisions, each
+        # projectile in slot order destroys the first ship it touches that an
+        # earlier projectile hasn't destroyed this tick; a projectile that
+        # only touches destroyed ships stays in flight.
+        shooting = alive & (self.projectile_owner == OWNER_SNAKE)
+        envs, slots = np.nonzero(shooting)
+        if len(envs) == 0:
+            return
+        touching = np.zeros(shooting.shape + (self.max_enemies,), dtype=bool)
+        touching[envs, slots] = self.enemy_alive[envs] & self.projectile_sweeps(
+            envs, slots, self.enemy_x[envs], self.enemy_y[envs], self.enemy_size
+        )
+        for slot in np.flatnonzero(touching.any(axis=(0, 2))):
+            targets = touching[:, slot] & self.enemy_alive
+            envs = np.flatnonzero(targets.any(axis=1))
+            if len(envs) == 0:
+                continue
+            self.enemy_alive[envs, np.argmax(targets[envs], axis=1)] = False
+            alive[envs, slot] = False
+            self.score[envs] += self.length_bonus(envs, (1, 2, 3))
+
+
+def random_actions(rng, num_envs, bounds, shoot_probability=0.1):
+    leftx, rightx, topy, bottomy = bounds
+    moves = rng.integers(0, 5, num_envs)
+    shoot = rng.random(num_envs) < shoot_probability
+    targets = rng.uniform((leftx, topy), (rightx, bottomy), (num_envs, 2))
+    return moves, shoot, targets
+
+
+def benchmark(num_envs, ticks, seed=0, world_size=None):
+    # Compare env-ticks per second of VectorGame against a Python loop over
+    # headless Game instances driven by the same kind of random actions
+    from game import Game
+    from stats import GameStats
+
+    names = {
+        MOVE_UP: "up",
+        MOVE_DOWN: "down",
+        MOVE_LEFT: "left",
+        MOVE_RIGHT: "right",
+    }
+
+    rng = np.random.default_rng(seed)
+    vector_game = VectorGame(num_envs, seed=seed, world_size=world_size)
+    bounds = (
+        vector_game.leftx,
+        vector_game.rightx,
+        vector_game.topy,
+        vector_game.bottomy,
+    )
+    start = time.perf_counter()
+    for _ in range(ticks):
+        vector_game.step(*random_actions(rng, num_envs, bounds))
+    vector_elapsed = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    games = [
+        Game(headless=True, stats=GameStats(), world_size=world_size)
+        for _ in range(num_envs)
+    ]
+    start = time.perf_counter()
+    for _ in range(ticks):
+        moves, shoot, targets = random_actions(rng, num_envs, bounds)
+        for index, game in enumerate(games):
+            actions = []
+            if moves[index] != MOVE_NONE:
+                actions.append(("move", names[moves[index]]))
+            if shoot[index]:
+                actions.append(("shoot", targets[index, 0], targets[index, 1]))
+            if game.step(actions):
+                games[index] = Game(
+                    headless=True, stats=GameStats(), world_size=world_size
+                )
+    loop_elapsed = time.perf_counter() - start
+
+    env_ticks = num_envs * ticks
+    return {
+        "num_envs": num_envs,
+        "ticks": ticks,
+        "vector_env_ticks_per_second": env_ticks / vector_elapsed,
+        "loop_env_ticks_per_second": env_ticks / loop_elapsed,
+        "speedup": loop_elapsed / vector_elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark VectorGame throughput")
+    parser.add_argument("--envs", type=int, default=256)
+    parser.add_argument("--ticks", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--world-size", type=float, default=None, help="side of the square world"
+    )
+    args = parser.parse_args()
+
+    results = benchmark(args.envs, args.ticks, args.seed, args.world_size)
+    for key, value in results.items():
+        print(key + ": " + str(value))